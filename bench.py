@@ -0,0 +1,633 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+# Load and latency benchmarks against a synthetic catalog, e.g.
+#   python bench.py seed --icons 20000
+#   python bench.py run --concurrency 1,8,32 --duration 15
+#   python bench.py compare bench_results/before.json bench_results/after.json
+#   python bench.py startup --budget 1.5
+#
+# `seed` fills a dedicated database (SQLite by default, or a local PostgreSQL
+# passed with --database) from a fixed random seed, so every run on every
+# commit measures the same data. `run` starts the real app in-process under
+# uvicorn with Cloudinary replaced by a local fake, drives each scenario at
+# each concurrency level over HTTP, and writes throughput, latency
+# percentiles and SQL statements per request to a JSON file. `compare` diffs
+# two of those files and exits non-zero on a regression. The write scenarios
+# add candles, comments and icons, so reseed with --reset between runs that
+# are meant to be compared strictly.
+#
+# App modules read their configuration at import time, so they are only
+# imported once the command line has set up the environment.
+
+BENCH_DATABASE = "sqlite:///bench.db"
+BENCH_PASSWORD = "bench-password"
+RESULTS_DIR = "bench_results"
+
+# Seconds the web app may take from `import index` to serving, bot excluded
+STARTUP_BUDGET = 1.5
+
+TRADITIONS = ("Byzantine", "Russian", "Coptic", "Ethiopian", "Georgian", "Serbian", "Cretan", "Armenian")
+CENTURIES = tuple(f"{n}th" for n in range(11, 21))
+REGIONS = ("Constantinople", "Novgorod", "Moscow", "Crete", "Mount Athos", "Sinai", "Cappadocia", "Ohrid", "Kyiv", "Alexandria")
+SUBJECTS = ("Theotokos", "Christ Pantocrator", "Deesis", "Transfiguration", "Nativity", "Dormition", "Annunciation", "Resurrection", "Baptism", "Entry into Jerusalem")
+EPITHETS = ("Hodegetria", "Eleusa", "of the Sign", "Enthroned", "with Scenes", "of Tenderness", "Unburnt Bush", "Life-giving Spring")
+SAINT_NAMES = ("George", "Nicholas", "Demetrios", "Basil", "Gregory", "John", "Catherine", "Barbara", "Panteleimon", "Sergius", "Seraphim", "Irene", "Anna", "Elias", "Paraskevi", "Spyridon")
+WORDS = ("gold", "tempera", "panel", "gesso", "halo", "linden", "egg", "silver", "riza", "kovcheg", "inscription", "border", "feast", "liturgy", "icon", "light", "prayer", "candle")
+
+DEFAULT_SCENARIOS = ("home", "home_filtered", "home_trending", "trending_api", "icon", "icon_api", "venerate", "comment", "upload")
+
+# Requests and seeded activity favour low icon ids following a power law, so
+# some icons are popular and most are rarely seen, as on the real site
+POPULARITY_SKEW = 3
+
+
+def popular(rng: random.Random, count: int) -> int:
+    return int(count * rng.random() ** POPULARITY_SKEW) + 1
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def configure_environment(database: str, page_cache: bool = True):
+    os.environ["DATABASE_URL"] = database
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["IMAGE_STORAGE"] = "bench"
+    os.environ["UPLOAD_STAGING_DIR"] = tempfile.mkdtemp(prefix="bench-uploads-")
+    # Measure the web app only; the Discord bot stays offline
+    os.environ["BOT_MODE"] = "off"
+    if not page_cache:
+        # Entries are still written but never young enough to be served
+        os.environ["PAGE_CACHE_TTL"] = "0"
+        os.environ["PAGE_CACHE_STALE"] = "0"
+
+
+# Stands in for Cloudinary: waits about as long as an upload round trip and
+# returns a Cloudinary-shaped URL without storing anything
+class FakeCloudinaryStorage:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def save(self, key: str, data: bytes, content_type: str) -> str:
+        time.sleep(self.latency)
+        return f"https://res.cloudinary.com/bench/image/upload/{key}"
+
+
+def fake_derivatives(icon_id: int) -> dict:
+    base = f"https://res.cloudinary.com/bench/image/upload/icons/{icon_id}"
+    return {
+        name: {"width": edge * 3 // 4, "height": edge, "webp": f"{base}/{name}.webp", "jpeg": f"{base}/{name}.jpeg"}
+        for name, edge in (("card", 256), ("thumb", 480), ("detail", 1200))
+    }
+
+
+# ---- seed ------------------------------------------------------------------
+
+def reset_database(engine):
+    from sqlalchemy import text
+    from models import Base
+
+    if engine.dialect.name == "sqlite":
+        engine.dispose()
+        if engine.url.database and os.path.exists(engine.url.database):
+            os.remove(engine.url.database)
+        return
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS icon_search CASCADE"))
+    Base.metadata.drop_all(engine)
+
+
+def insert_batches(conn, table, rows: list, batch_size: int = 5000):
+    from sqlalchemy import insert
+
+    for start in range(0, len(rows), batch_size):
+        conn.execute(insert(table), rows[start:start + batch_size])
+
+
+def cmd_seed(args):
+    configure_environment(args.database)
+    import bcrypt
+    from sqlalchemy import func, select
+    import database
+    from counters import recount_icons
+    from migrations import migrate
+    from rankings import rebuild_trending
+    from related import refresh_related
+    from models import Comment, Icon, ModRank, Saint, Tradition, User, candles, icon_saints
+    from saints import normalize_saint_name
+    from search import rebuild_index
+
+    if args.reset:
+        reset_database(database.engine)
+    migrate(database.engine)
+    with database.engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(User.__table__)).scalar():
+            sys.exit(f"{args.database} already has data; pass --reset to recreate it")
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    hashed_pw = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+    saint_names = []
+    for i in range(args.saints):
+        name = f"Saint {SAINT_NAMES[i % len(SAINT_NAMES)]}" + (f" {i // len(SAINT_NAMES) + 1}" if i >= len(SAINT_NAMES) else "")
+        saint_names.append(name)
+
+    icons = []
+    for icon_id in range(1, args.icons + 1):
+        changed = now - timedelta(days=rng.random() * 365)
+        icons.append({
+            "id": icon_id,
+            "title": f"{rng.choice(SUBJECTS)} {rng.choice(EPITHETS)}",
+            "image_url": f"https://res.cloudinary.com/bench/image/upload/icons/{icon_id}/original.jpg",
+            "derivatives": fake_derivatives(icon_id),
+            "century": rng.choice(CENTURIES),
+            "region": rng.choice(REGIONS),
+            "iconographer": rng.choice((None, "Andrei Rublev", "Theophanes the Greek", "Dionisius", "Simon Ushakov")),
+            "description": sentence(rng, rng.randint(8, 40)),
+            "tradition_id": rng.randint(1, len(TRADITIONS)),
+            "user_id": rng.randint(1, args.users),
+            "status": "ready",
+            "updated_at": changed,
+            "activity_at": changed,
+        })
+
+    saint_links = set()
+    for icon_id in range(1, args.icons + 1):
+        for _ in range(rng.randint(1, 3)):
+            saint_links.add((icon_id, popular(rng, args.saints)))
+
+    # Unique (icon, user) pairs; give up on the rest if the popular icons saturate
+    lit = set()
+    target = min(args.candles, args.icons * args.users)
+    for _ in range(target * 3):
+        if len(lit) >= target:
+            break
+        lit.add((popular(rng, args.icons), rng.randint(1, args.users)))
+
+    comments = [{
+        "text": sentence(rng, rng.randint(4, 60)),
+        "user_id": rng.randint(1, args.users),
+        "icon_id": popular(rng, args.icons),
+        "created_at": now - timedelta(days=rng.random() * 365),
+    } for _ in range(args.comments)]
+
+    with database.engine.begin() as conn:
+        insert_batches(conn, ModRank.__table__, [{"id": 1, "name": "Catechumen", "description": "New member"}])
+        insert_batches(conn, Tradition.__table__, [{"id": i, "name": name} for i, name in enumerate(TRADITIONS, 1)])
+        insert_batches(conn, User.__table__, [{
+            "id": i,
+            "username": f"bench{i}",
+            "display_name": f"Bench User {i}",
+            "email": f"bench{i}@example.com",
+            "hashed_pw": hashed_pw,
+            "mod_rank_id": 1,
+        } for i in range(1, args.users + 1)])
+        insert_batches(conn, Saint.__table__, [
+            {"id": i, "name": name, "normalized_name": normalize_saint_name(name)} for i, name in enumerate(saint_names, 1)
+        ])
+        insert_batches(conn, Icon.__table__, icons, batch_size=1000)
+        insert_batches(conn, icon_saints, [{"icon_id": i, "saint_id": s} for i, s in sorted(saint_links)])
+        insert_batches(conn, candles, [
+            {"icon_id": i, "user_id": u, "lit_at": now - timedelta(days=rng.random() * 365)} for i, u in sorted(lit)
+        ])
+        insert_batches(conn, Comment.__table__, comments)
+        recount_icons(conn)
+        rebuild_trending(conn)
+
+    with database.SessionLocal() as db:
+        rebuild_index(db)
+        db.commit()
+        refresh_related(db, full=True)
+
+    print(
+        f"Seeded {args.icons} icons, {args.users} users, {args.saints} saints, {len(lit)} candles "
+        f"and {args.comments} comments in {time.perf_counter() - started:.1f}s"
+    )
+
+
+# ---- run -------------------------------------------------------------------
+
+def describe_dataset(database) -> dict:
+    from sqlalchemy import func, select
+    from models import Comment, Icon, Saint, Tradition, User, candles
+
+    with database.SessionLocal() as db:
+        def count(table):
+            return db.execute(select(func.count()).select_from(table)).scalar()
+
+        return {
+            "dialect": database.engine.dialect.name,
+            "icons": count(Icon.__table__),
+            "max_icon_id": db.execute(select(func.max(Icon.id))).scalar() or 0,
+            "users": count(User.__table__),
+            "saints": count(Saint.__table__),
+            "candles": count(candles),
+            "comments": count(Comment.__table__),
+            "traditions": [t for (t,) in db.execute(select(Tradition.id).order_by(Tradition.id))],
+        }
+
+
+def upload_image() -> bytes:
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((900, 1200)).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def upload_request(rng, data):
+    import aiohttp
+
+    form = aiohttp.FormData()
+    form.add_field("title", f"{rng.choice(SUBJECTS)} {rng.choice(EPITHETS)}")
+    form.add_field("century", rng.choice(CENTURIES))
+    form.add_field("region", rng.choice(REGIONS))
+    form.add_field("saints", ", ".join(f"Saint {rng.choice(SAINT_NAMES)}" for _ in range(2)))
+    form.add_field("tradition_id", str(rng.choice(data["traditions"])))
+    form.add_field("image_file", data["upload_image"], filename="bench.jpg", content_type="image/jpeg")
+    # Every upload sends the same image; confirm it so each one is ingested
+    form.add_field("allow_duplicate", "true")
+    return "POST", "/upload", {"data": form}
+
+
+# Scenario name -> (needs a logged-in client, request builder(rng, dataset) -> (method, path, aiohttp kwargs))
+SCENARIOS = {
+    "home": (False, lambda rng, data: ("GET", "/", {})),
+    "home_filtered": (False, lambda rng, data: ("GET", "/", {"params": {
+        "tradition_id": str(rng.choice(data["traditions"])),
+        "century": rng.choice(CENTURIES),
+    }})),
+    "home_trending": (False, lambda rng, data: ("GET", "/", {"params": {"sort": rng.choice(("trending", "venerated"))}})),
+    "trending_api": (False, lambda rng, data: ("GET", "/api/trending", {"params": {
+        "tradition_id": str(rng.choice((0, *data["traditions"]))),
+        "sort": rng.choice(("trending", "venerated")),
+    }})),
+    "icon": (False, lambda rng, data: ("GET", f"/icon/{popular(rng, data['max_icon_id'])}", {})),
+    "icon_api": (False, lambda rng, data: ("GET", f"/api/icon/{popular(rng, data['max_icon_id'])}", {})),
+    "venerate": (True, lambda rng, data: ("POST", f"/icon/{popular(rng, data['max_icon_id'])}/venerate", {})),
+    "comment": (True, lambda rng, data: ("POST", f"/icon/{popular(rng, data['max_icon_id'])}/comment", {
+        "data": {"text": sentence(rng, rng.randint(4, 30))},
+        "headers": {"X-Requested-With": "fetch"},
+    })),
+    "upload": (True, upload_request),
+}
+
+
+# Counts every statement sent by any engine in the process, including the
+# ingest workers finishing uploads
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(ordered: list[float], q: float) -> float | None:
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+async def open_client(base_url: str, user_number: int | None):
+    import aiohttp
+
+    # unsafe=True keeps cookies set by an IP address host (127.0.0.1)
+    client = aiohttp.ClientSession(base_url=base_url, cookie_jar=aiohttp.CookieJar(unsafe=True))
+    if user_number is not None:
+        async with client.post("/login", data={"username": f"bench{user_number}", "password": BENCH_PASSWORD}, allow_redirects=False) as resp:
+            if resp.status != 302:
+                await client.close()
+                raise RuntimeError(f"Could not log in as bench{user_number} (HTTP {resp.status})")
+    return client
+
+
+async def drive(clients: list, build, rngs: list, data: dict, seconds: float):
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    errors = 0
+
+    async def worker(client, rng):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path, kwargs = build(rng, data)
+            started = time.perf_counter()
+            async with client.request(method, path, allow_redirects=False, **kwargs) as resp:
+                await resp.read()
+            latencies.append(time.perf_counter() - started)
+            if resp.status >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker(client, rng) for client, rng in zip(clients, rngs)))
+    return latencies, errors
+
+
+async def run_phase(base_url: str, name: str, concurrency: int, args, data: dict, counter: StatementCounter) -> dict:
+    needs_login, build = SCENARIOS[name]
+    login = needs_login or args.members
+    clients = [await open_client(base_url, (i % data["users"]) + 1 if login else None) for i in range(concurrency)]
+    rngs = [random.Random(f"{args.seed}:{name}:{concurrency}:{i}") for i in range(concurrency)]
+    try:
+        if args.warmup:
+            await drive(clients, build, rngs, data, args.warmup)
+        before = counter.count
+        started = time.perf_counter()
+        latencies, errors = await drive(clients, build, rngs, data, args.duration)
+        elapsed = time.perf_counter() - started
+        statements = counter.count - before
+    finally:
+        for client in clients:
+            await client.close()
+
+    ordered = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": ms(percentile(ordered, 50)),
+            "p95": ms(percentile(ordered, 95)),
+            "p99": ms(percentile(ordered, 99)),
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else None,
+            "max": ms(ordered[-1]) if ordered else None,
+        },
+        "statements_per_request": round(statements / len(latencies), 2) if latencies else None,
+    }
+
+
+async def run_all(app, args, data: dict, counter: StatementCounter) -> list[dict]:
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+            raise RuntimeError("The app exited during startup")
+        await asyncio.sleep(0.05)
+
+    results = []
+    try:
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                result = await run_phase(f"http://127.0.0.1:{port}", name, concurrency, args, data, counter)
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{name:<14} c={concurrency:<4} {result['throughput_rps']:>9} req/s  "
+                    f"p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  "
+                    f"{result['statements_per_request']} stmts/req  {result['errors']} errors"
+                )
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+def git_revision() -> tuple[str | None, bool]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def cmd_run(args):
+    configure_environment(args.database, page_cache=not args.no_page_cache)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(SCENARIOS)}")
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import database
+    import images
+
+    images.STORAGE_BACKENDS["bench"] = lambda: FakeCloudinaryStorage(args.storage_latency)
+    from index import app
+
+    data = describe_dataset(database)
+    if not data["icons"]:
+        sys.exit(f"{args.database} has no icons; run `python bench.py seed` first")
+    data["upload_image"] = upload_image()
+
+    counter = StatementCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+    created_at = datetime.now(timezone.utc)
+    results = asyncio.run(run_all(app, args, data, counter))
+
+    commit, dirty = git_revision()
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": created_at.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": {k: v for k, v in data.items() if k not in ("traditions", "upload_image")},
+            "settings": {
+                "duration_s": args.duration,
+                "warmup_s": args.warmup,
+                "seed": args.seed,
+                "members": args.members,
+                "page_cache": not args.no_page_cache,
+                "storage_latency_s": args.storage_latency,
+            },
+        },
+        "results": results,
+    }
+
+    output = args.output
+    if output is None:
+        label = (commit or "unknown")[:10] + ("-dirty" if dirty else "")
+        output = os.path.join(RESULTS_DIR, f"{label}-{data['dialect']}-{created_at:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+# ---- compare ---------------------------------------------------------------
+
+def _change(old, new) -> float | None:
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+# Runs are comparable when they use the same kind of database and roughly the
+# same catalog; earlier write scenarios will have grown it a little
+def _same_dataset(old: dict, new: dict) -> bool:
+    return (
+        old["dialect"] == new["dialect"]
+        and old["users"] == new["users"]
+        and abs(old["icons"] - new["icons"]) <= max(old["icons"], 1) * 0.05
+    )
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    if not _same_dataset(baseline["meta"]["dataset"], candidate["meta"]["dataset"]):
+        print("warning: the two runs used different datasets\n")
+
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"{'scenario':<14} {'c':>4} {'req/s':>10} {'change':>8} {'p95 ms':>9} {'change':>8} {'stmts':>6} {'was':>6}")
+    for result in candidate["results"]:
+        old = previous.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            print(f"{result['scenario']:<14} {result['concurrency']:>4}  (not in baseline)")
+            continue
+
+        throughput = _change(old["throughput_rps"], result["throughput_rps"])
+        p95 = _change(old["latency_ms"]["p95"], result["latency_ms"]["p95"])
+        statements, old_statements = result["statements_per_request"], old["statements_per_request"]
+        regressed = (
+            (throughput is not None and throughput < -args.threshold)
+            or (p95 is not None and p95 > args.threshold)
+            # Even one more statement per request is usually a new query in a loop
+            or (statements is not None and old_statements is not None and statements >= old_statements + 1)
+        )
+        regressions += regressed
+        fmt = lambda value: f"{value:+.1f}%" if value is not None else "n/a"
+        print(
+            f"{result['scenario']:<14} {result['concurrency']:>4} {result['throughput_rps']:>10} {fmt(throughput):>8} "
+            f"{result['latency_ms']['p95']:>9} {fmt(p95):>8} {statements:>6} {old_statements:>6}"
+            + ("  REGRESSION" if regressed else "")
+        )
+
+    if regressions:
+        sys.exit(f"\n{regressions} regression(s) beyond {args.threshold}%")
+
+
+# ---- startup ---------------------------------------------------------------
+
+# Run in a fresh interpreter each time, so nothing is imported or warm yet
+STARTUP_PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+
+async def boot():
+    async with index.lifespan(index.app):
+        return time.perf_counter()
+
+ready = asyncio.run(boot())
+print(json.dumps({"import_s": imported - started, "lifespan_s": ready - imported}))
+"""
+
+
+def cmd_startup(args):
+    configure_environment(args.database)
+    samples = []
+    for _ in range(args.repeat):
+        probe = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if probe.returncode:
+            sys.exit(probe.stderr)
+        samples.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+
+    middle = lambda values: sorted(values)[len(values) // 2]
+    imported = middle([s["import_s"] for s in samples])
+    lifespan = middle([s["lifespan_s"] for s in samples])
+    total = middle([s["import_s"] + s["lifespan_s"] for s in samples])
+    print(f"import {imported:.2f}s  lifespan {lifespan:.2f}s  total {total:.2f}s (median of {args.repeat})")
+    if total > args.budget:
+        sys.exit(f"Cold start took {total:.2f}s, over the {args.budget:.2f}s budget")
+
+
+# ---- command line ----------------------------------------------------------
+
+def _int_list(raw: str) -> list[int]:
+    return [int(value) for value in raw.split(",") if value.strip()]
+
+
+def _name_list(raw: str) -> list[str]:
+    return [value.strip() for value in raw.split(",") if value.strip()]
+
+
+COMMANDS = {
+    "seed": cmd_seed,
+    "run": cmd_run,
+    "compare": cmd_compare,
+    "startup": cmd_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Iconostasis load and latency benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed = subparsers.add_parser("seed", help="Fill a benchmark database with a synthetic catalog")
+    seed.add_argument("--database", default=BENCH_DATABASE, help=f"SQLAlchemy URL (default: {BENCH_DATABASE})")
+    seed.add_argument("--reset", action="store_true", help="Drop and recreate the benchmark database first")
+    seed.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    seed.add_argument("--icons", type=int, default=5000)
+    seed.add_argument("--users", type=int, default=500)
+    seed.add_argument("--saints", type=int, default=300)
+    seed.add_argument("--candles", type=int, default=50000)
+    seed.add_argument("--comments", type=int, default=20000)
+
+    run = subparsers.add_parser("run", help="Drive the app's key routes and record the results")
+    run.add_argument("--database", default=BENCH_DATABASE, help=f"SQLAlchemy URL (default: {BENCH_DATABASE})")
+    run.add_argument("--scenarios", type=_name_list, default=list(DEFAULT_SCENARIOS), help=f"Comma separated (default: {','.join(DEFAULT_SCENARIOS)})")
+    run.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="Comma separated client counts (default: 1,8,32)")
+    run.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario and level (default: 10)")
+    run.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before each measurement (default: 2)")
+    run.add_argument("--seed", type=int, default=1, help="Random seed for request choices (default: 1)")
+    run.add_argument("--members", action="store_true", help="Log in for read scenarios too (bypasses the anonymous page cache)")
+    run.add_argument("--no-page-cache", action="store_true", help="Never serve anonymous pages from the page cache")
+    run.add_argument("--storage-latency", type=float, default=0.15, help="Seconds per fake Cloudinary upload (default: 0.15)")
+    run.add_argument("--output", help=f"Result file (default: {RESULTS_DIR}/<commit>-<dialect>-<time>.json)")
+
+    compare = subparsers.add_parser("compare", help="Compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=10, help="Percent change counted as a regression (default: 10)")
+
+    startup = subparsers.add_parser("startup", help="Time the web app's cold start against a budget")
+    startup.add_argument("--database", default=BENCH_DATABASE, help=f"SQLAlchemy URL (default: {BENCH_DATABASE})")
+    startup.add_argument("--repeat", type=int, default=5, help="Cold starts to take the median of (default: 5)")
+    startup.add_argument("--budget", type=float, default=STARTUP_BUDGET, help=f"Seconds allowed for import plus startup (default: {STARTUP_BUDGET})")
+
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import asyncio
+import fcntl
+import importlib
+import logging
+import os
+import database
+from config import BOT_LOCK_FILE, BOT_LOCK_RETRY, BOT_MODE
+
+# Where the Discord bot runs. Exactly one bot should be connected per host:
+#   BOT_MODE=embedded  (default) inside the web app; with `uvicorn --workers N`
+#                      only the worker holding BOT_LOCK_FILE starts it, and the
+#                      others keep retrying so one takes over if it exits
+#   BOT_MODE=off       the web app never starts it; run `python botworker.py`
+#                      as its own process instead
+# The standalone worker takes the same lock, so it waits while a web worker
+# runs an embedded bot and never runs alongside one. It has its own database
+# pools; set DB_POOL_SIZE/DB_MAX_OVERFLOW in its environment to size them.
+#
+# iconobot (discord.py, fonts) is only imported once this process has won the
+# lock, so web workers that don't run the bot never load it.
+
+logger = logging.getLogger(__name__)
+
+
+# Hold an exclusive lock on BOT_LOCK_FILE for the life of the process; None if
+# another process has it. The OS releases it if the holder dies.
+def claim_bot_lock():
+    os.makedirs(os.path.dirname(BOT_LOCK_FILE) or ".", exist_ok=True)
+    handle = open(BOT_LOCK_FILE, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
+
+
+async def run_bot(token: str):
+    lock = claim_bot_lock()
+    while lock is None:
+        await asyncio.sleep(BOT_LOCK_RETRY)
+        lock = claim_bot_lock()
+
+    try:
+        iconobot = await asyncio.to_thread(importlib.import_module, "iconobot")
+        logger.info("Starting the Discord bot in process %s", os.getpid())
+        async with iconobot.bot:
+            await iconobot.bot.start(token)
+    except Exception:
+        logger.exception("The Discord bot stopped with an error")
+        raise
+    finally:
+        lock.close()
+
+
+# Started from the web app's lifespan; returns the task, or None when this
+# app doesn't run the bot
+def start_embedded() -> asyncio.Task | None:
+    token = os.getenv("DISCORD_BOT_TOKEN")
+    if BOT_MODE != "embedded":
+        return None
+    if not token:
+        logger.warning("DISCORD_BOT_TOKEN is not set; the Discord bot is disabled")
+        return None
+    return asyncio.create_task(run_bot(token))
+
+
+async def stop_embedded(task: asyncio.Task | None):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        # Errors were logged by run_bot when they happened
+        pass
+
+
+async def main():
+    token = os.getenv("DISCORD_BOT_TOKEN")
+    if not token:
+        raise SystemExit("DISCORD_BOT_TOKEN is not set")
+    try:
+        await run_bot(token)
+    finally:
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
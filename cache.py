@@ -0,0 +1,40 @@
+import threading
+import time
+
+# Small thread-safe TTL cache for values that are cheap to serve slightly stale.
+# Shared by request handlers (threadpool) and the bot (event loop), so every
+# operation is short and guarded by a lock.
+
+
+class TTLCache:
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if len(self._items) >= self.max_entries and key not in self._items:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del self._items[next(iter(self._items))]
+            self._items[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import metrics
+from config import CARD_CACHE_DIR, CARD_CACHE_DISK_BYTES, CARD_CACHE_MEMORY_BYTES
+
+# Content-addressed cache for rendered bot cards.
+# A card's key is derived from the icon id and every field drawn on it, so
+# editing an icon, renaming its uploader or its tradition produces a new key
+# and stale cards are simply never looked up again.
+# Lookups go memory LRU -> disk -> render; concurrent requests for the same key
+# share a single render.
+
+# Bump when render_card's layout changes to orphan every cached card
+RENDER_VERSION = 1
+
+
+# `fields` holds what the card shows (see iconobot.CARD_FIELDS)
+def card_key(icon_id: int, fields: dict) -> str:
+    raw = f"v{RENDER_VERSION}:{icon_id}:{json.dumps(fields, sort_keys=True)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# LRU bounded by the total size of the stored values rather than their number
+class MemoryLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+
+# One PNG per key under two-character fan-out directories; oldest files are
+# pruned once the store grows past max_bytes
+class DiskStore:
+    PRUNE_EVERY = 50
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class CardCache:
+    def __init__(self, memory_bytes: int, directory: str, disk_bytes: int):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskStore(directory, disk_bytes)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "shared_renders": 0, "misses": 0, "render_errors": 0}
+
+    # Return the cached card for `key`, or await `render()` (a coroutine function
+    # producing PNG bytes) exactly once no matter how many callers ask concurrently
+    async def get_or_render(self, key: str, render) -> bytes:
+        data = self.memory.get(key)
+        if data is not None:
+            self.counters["memory_hits"] += 1
+            return data
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters["shared_renders"] += 1
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            data = await loop.run_in_executor(None, self.disk.get, key)
+            if data is not None:
+                self.counters["disk_hits"] += 1
+            else:
+                self.counters["misses"] += 1
+                data = await render()
+                await loop.run_in_executor(None, self.disk.put, key, data)
+            self.memory.put(key, data)
+            future.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.counters["render_errors"] += 1
+            future.set_exception(e)
+            # Mark retrieved so a render nobody else waited on doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = sum(self.counters[k] for k in ("memory_hits", "disk_hits", "shared_renders", "misses"))
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "memory_evictions": self.memory.evictions,
+            "inflight": len(self._inflight),
+        }
+
+
+card_cache = CardCache(CARD_CACHE_MEMORY_BYTES, CARD_CACHE_DIR, CARD_CACHE_DISK_BYTES)
+
+metrics.Counter(
+    "card_cache_lookups_total", "Icon card lookups by outcome", ("outcome",),
+    collect=lambda: {(name,): value for name, value in card_cache.counters.items()},
+)
+metrics.Gauge("card_cache_memory_bytes", "Bytes of cards held in memory", collect=lambda: {(): card_cache.memory.size})
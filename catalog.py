@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.orm import load_only, selectinload
+from database import SessionLocal
+from models import Icon, icon_changed_at, icon_deletions
+from pagination import decode_cursor, encode_cursor
+from reference import reference
+
+# Machine-readable catalog for mirrors and analytics jobs:
+# incremental sync pages ordered by (last change, id), and full exports streamed
+# from a server-side cursor so memory stays flat however large the catalog is.
+#
+# A sync page interleaves icons that changed (edits, or candles and comments
+# moving the counts; models.icon_changed_at) with tombstones for icons deleted
+# since (icon_deletions). Icons only stop being ready by being deleted, so
+# those tombstones are all a mirror needs to drop what it has.
+
+EXPORT_BATCH_SIZE = 1000
+
+# Writes take their timestamp before they commit, so a change can become
+# visible after the feed has served newer ones. Sync pages only reach up to
+# this long before now, by which time every earlier change has committed.
+COMMIT_LAG = timedelta(minutes=5)
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+# Exportable fields: the Icon columns each one needs and how to read it
+EXPORT_FIELDS = {
+    "id": ((), lambda icon: icon.id),
+    "title": (("title",), lambda icon: icon.title),
+    "saints": ((), lambda icon: [s.name for s in icon.saints]),
+    "tradition": (("tradition_id",), lambda icon: reference.tradition_name(icon.tradition_id)),
+    "century": (("century",), lambda icon: icon.century),
+    "region": (("region",), lambda icon: icon.region),
+    "iconographer": (("iconographer",), lambda icon: icon.iconographer),
+    "description": (("description",), lambda icon: icon.description),
+    "image_url": (("image_url",), lambda icon: icon.image_url),
+    "thumb_url": (("image_url", "derivatives"), lambda icon: icon.image_variant("thumb")),
+    "candle_count": (("candle_count",), lambda icon: icon.candle_count),
+    "comment_count": (("comment_count",), lambda icon: icon.comment_count),
+    "updated_at": (("updated_at",), lambda icon: _isoformat(icon.updated_at)),
+}
+
+DEFAULT_EXPORT_FIELDS = ("id", "title", "saints", "tradition", "century", "region", "iconographer", "image_url", "updated_at")
+
+
+# Validate a comma separated ?fields= value; raises ValueError on unknown names
+def parse_fields(raw: str | None) -> list[str]:
+    if not raw:
+        return list(DEFAULT_EXPORT_FIELDS)
+    fields = list(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _export_query(fields: list[str]):
+    columns = {column for field in fields for column in EXPORT_FIELDS[field][0]}
+    options = [load_only(*(getattr(Icon, c) for c in columns))] if columns else [load_only(Icon.id)]
+    if "saints" in fields:
+        # Loaded one SELECT ... IN per batch alongside yield_per
+        options.append(selectinload(Icon.saints))
+    return select(Icon).options(*options).where(Icon.status == "ready").order_by(Icon.id)
+
+
+def export_row(icon: Icon, fields: list[str]) -> dict:
+    return {field: EXPORT_FIELDS[field][1](icon) for field in fields}
+
+
+# Record a deleted icon for sync clients, inside the caller's transaction
+def record_deletion(db, icon_id: int):
+    db.execute(delete(icon_deletions).where(icon_deletions.c.icon_id == icon_id))
+    db.execute(insert(icon_deletions).values(icon_id=icon_id))
+
+
+def _window(stamp, key, since, cursor, horizon) -> list:
+    conditions = [stamp < horizon]
+    if since is not None:
+        conditions.append(stamp >= since)
+    if cursor is not None:
+        after_stamp, after_id = cursor
+        conditions.append(or_(stamp > after_stamp, and_(stamp == after_stamp, key > after_id)))
+    return conditions
+
+
+# One page of changes at or after `since`, oldest first.
+# Returns (icons, deleted_ids, next_cursor, synced_until). next_cursor is None
+# once the caller is caught up, and synced_until is then the `since` to pass
+# next time; every change before it has been served.
+def changed_since(db, since: datetime | None, after: str | None, limit: int):
+    horizon = datetime.now(timezone.utc) - COMMIT_LAG
+    # Cursors carry the (change stamp, id) of the last row rather than just
+    # the id, so an icon edited mid-sync can't make the next page skip rows
+    cursor = decode_cursor(after, datetime) if after else None
+
+    live = db.execute(
+        select(icon_changed_at, Icon.id)
+        .where(Icon.status == "ready", Icon.updated_at.isnot(None), *_window(icon_changed_at, Icon.id, since, cursor, horizon))
+        .order_by(icon_changed_at, Icon.id).limit(limit + 1)
+    ).all()
+    stamp, icon_id = icon_deletions.c.deleted_at, icon_deletions.c.icon_id
+    gone = db.execute(
+        select(stamp, icon_id).where(*_window(stamp, icon_id, since, cursor, horizon)).order_by(stamp, icon_id).limit(limit + 1)
+    ).all()
+    changes = sorted([(*row, False) for row in live] + [(*row, True) for row in gone])[:limit + 1]
+
+    page = changes[:limit]
+    ids = [icon_id for _, icon_id, deleted in page if not deleted]
+    loaded = {icon.id: icon for icon in db.query(Icon).options(selectinload(Icon.saints)).filter(Icon.id.in_(ids), Icon.status == "ready")} if ids else {}
+    icons = [loaded[icon_id] for icon_id in ids if icon_id in loaded]
+    deleted = [icon_id for _, icon_id, deleted in page if deleted]
+
+    if len(changes) <= limit:
+        return icons, deleted, None, horizon
+    last_stamp, last_id, _ = page[-1]
+    return icons, deleted, encode_cursor(last_stamp, last_id), None
+
+
+# Generators for StreamingResponse. They open their own session because
+# request-scoped dependencies are closed before the body is streamed.
+def _stream_icons(fields: list[str]):
+    with SessionLocal() as db:
+        result = db.scalars(_export_query(fields).execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for icon in result:
+            yield export_row(icon, fields)
+
+
+def export_ndjson(fields: list[str]):
+    for row in _stream_icons(fields):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def export_csv(fields: list[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(fields)
+    yield flush()
+    for row in _stream_icons(fields):
+        # Lists (saints) become one "a; b; c" cell
+        writer.writerow("; ".join(v) if isinstance(v, list) else v for v in row.values())
+        yield flush()
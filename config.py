@@ -1,11 +1,67 @@
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY")
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Checked when database.py creates the engines, so config stays importable
+DATABASE_URL = os.getenv("DATABASE_URL", "")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Connection pools. Request handlers share the async engine, so its pool is
+# what bounds request concurrency; ingest workers, exports and other
+# background jobs use the smaller sync engine.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", 5))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", 5))
+
 CLOUD_NAME = os.getenv("CLOUD_NAME")
 CLOUD_KEY = os.getenv("CLOUD_KEY")
 CLOUD_SECRET = os.getenv("CLOUD_SECRET")
 CLOUDINARY_URL = os.getenv("CLOUDINARY_URL")
+
+# Rendered Discord icon cards: in-memory LRU backed by an on-disk store
+CARD_CACHE_DIR = os.getenv("CARD_CACHE_DIR", ".cache/cards")
+CARD_CACHE_MEMORY_BYTES = int(os.getenv("CARD_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+CARD_CACHE_DISK_BYTES = int(os.getenv("CARD_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+# Where uploaded icons and their derivatives are stored: "cloudinary" or "local"
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "cloudinary")
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_URL = os.getenv("MEDIA_URL", "/media")
+
+# Uploads are staged on local disk and finished by a bounded pool of workers
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", ".cache/uploads")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 2))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 4))
+
+# Rendered pages for anonymous visitors: "memory" (per process) or "redis"
+# (a local service shared by all workers, needs the redis package)
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")
+PAGE_CACHE_URL = os.getenv("PAGE_CACHE_URL", "redis://localhost:6379/0")
+PAGE_CACHE_MEMORY_BYTES = int(os.getenv("PAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 30))
+PAGE_CACHE_STALE = int(os.getenv("PAGE_CACHE_STALE", 300))
+
+# Metrics on /metrics (Prometheus text format). Set METRICS_TOKEN to require
+# "Authorization: Bearer <token>" from the scraper.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Answer "X-Profile: 1" request headers with a Server-Timing breakdown
+METRICS_PROFILING = os.getenv("METRICS_PROFILING", "false").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with the route that issued them
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.5))
+
+# Where the Discord bot runs: "embedded" in one web worker or "off" (run
+# `python botworker.py` separately). See botworker.py.
+BOT_MODE = os.getenv("BOT_MODE", "embedded")
+BOT_LOCK_FILE = os.getenv("BOT_LOCK_FILE", ".cache/bot.lock")
+BOT_LOCK_RETRY = int(os.getenv("BOT_LOCK_RETRY", 30))
+
+# Trending ranking: a candle or comment counts half as much after this long.
+# Run `python manage.py rebuild-rankings` after changing it.
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 48))
+
+# Uploads whose perceptual hash differs from an existing icon's in at most
+# this many of 64 bits are flagged as duplicates (see duplicates.py)
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", 6))
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from sqlalchemy import delete, func, select, update
+from models import Comment, Icon, candles
+from page_cache import icon_tag, invalidate_on_commit
+from queries import insert_or_ignore
+from rankings import CANDLE_WEIGHT, COMMENT_WEIGHT, EPOCH, trend_points
+
+
+# Shift an icon's candle counter inside the caller's transaction and return the new value.
+# Both adjust_* functions also bump Icon.activity_at for HTTP cache validators,
+# move the trending score by the event's weight at `at` (when the candle was
+# lit or the comment written; default now) and drop the cached pages showing
+# the icon once the transaction commits.
+def adjust_candle_count(db, icon_id: int, delta: int, at: datetime | None = None) -> int | None:
+    invalidate_on_commit(db, icon_tag(icon_id))
+    return db.execute(
+        update(Icon)
+        .where(Icon.id == icon_id)
+        .values(
+            candle_count=Icon.candle_count + delta,
+            trending_score=Icon.trending_score + delta * trend_points(CANDLE_WEIGHT, at),
+            activity_at=func.now(),
+        )
+        .returning(Icon.candle_count)
+    ).scalar()
+
+
+# Shift an icon's comment counter inside the caller's transaction and return the new value
+def adjust_comment_count(db, icon_id: int, delta: int, at: datetime | None = None) -> int | None:
+    invalidate_on_commit(db, icon_tag(icon_id))
+    return db.execute(
+        update(Icon)
+        .where(Icon.id == icon_id)
+        .values(
+            comment_count=Icon.comment_count + delta,
+            trending_score=Icon.trending_score + delta * trend_points(COMMENT_WEIGHT, at),
+            activity_at=func.now(),
+        )
+        .returning(Icon.comment_count)
+    ).scalar()
+
+
+# Flip a user's candle on an icon with one conditional DELETE or INSERT on
+# candles (never loading icon.venerators) and move the counter by however many
+# rows actually changed, so concurrent clicks can't skew it.
+# Returns (lit, count); count is None if the icon doesn't exist.
+def toggle_candle(db, user_id: int, icon_id: int) -> tuple[bool, int | None]:
+    key = (candles.c.icon_id == icon_id, candles.c.user_id == user_id)
+    extinguished = db.execute(delete(candles).where(*key).returning(candles.c.lit_at)).first()
+    if extinguished is not None:
+        # Candles lit before lit_at existed were ranked as lit at the epoch
+        return False, adjust_candle_count(db, icon_id, -1, extinguished.lit_at or EPOCH)
+
+    now = datetime.now(timezone.utc)
+    inserted = db.execute(
+        insert_or_ignore(db.get_bind(), candles, ["icon_id", "user_id"]).values(icon_id=icon_id, user_id=user_id, lit_at=now)
+    ).rowcount
+    return True, adjust_candle_count(db, icon_id, 1 if inserted else 0, now)
+
+
+# Rebuild the counters from the candles and comments tables.
+# Repairs drift and backfills databases that predate the counter columns.
+def recount_icons(bind, icon_ids: list[int] | None = None) -> int:
+    candle_total = (
+        select(func.count())
+        .select_from(candles)
+        .where(candles.c.icon_id == Icon.id)
+        .scalar_subquery()
+    )
+    comment_total = (
+        select(func.count(Comment.id))
+        .where(Comment.icon_id == Icon.id)
+        .scalar_subquery()
+    )
+
+    stmt = update(Icon).values(candle_count=candle_total, comment_count=comment_total)
+    if icon_ids:
+        stmt = stmt.where(Icon.id.in_(icon_ids))
+    return bind.execute(stmt).rowcount
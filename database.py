@@ -1,14 +1,69 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
-from config import DATABASE_URL
+from metrics import TimedAsyncQueuePool, TimedQueuePool, instrument_engine
+from config import (
+    DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+    DB_SYNC_MAX_OVERFLOW, DB_SYNC_POOL_SIZE,
+)
+
+# Two engines on the same database:
+#   async_engine  request handlers (see dependencies.get_db); they run the
+#                 ORM helpers through AsyncSession.run_sync, so every query
+#                 awaits the async driver instead of blocking the event loop
+#   engine        background threads (ingest workers, exports, page cache
+#                 refreshes), manage.py and migrations
+
+# Async driver for each sync database URL scheme
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS[parsed.get_backend_name()]).render_as_string(hide_password=False)
+
+
+if not DATABASE_URL:
+    raise RuntimeError("DATABASE_URL is not set")
+
+# SQLite is used for local and test runs; only PostgreSQL understands sslmode
+connect_args = {"sslmode": "require"} if DATABASE_URL.startswith("postgresql") else {}
+async_connect_args = {"ssl": "require"} if DATABASE_URL.startswith("postgresql") else {}
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"sslmode": "require"}, 
+    connect_args=connect_args, 
+    poolclass=TimedQueuePool,
+    pool_logging_name="sync",
     pool_pre_ping=True, 
-    pool_size=10, 
-    max_overflow=20,
-    pool_timeout=30
+    pool_size=DB_SYNC_POOL_SIZE,
+    max_overflow=DB_SYNC_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE
+)
+
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    connect_args=async_connect_args,
+    poolclass=TimedAsyncQueuePool,
+    pool_logging_name="async",
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE
 )
 
+instrument_engine(engine, "sync", DB_SYNC_POOL_SIZE + DB_SYNC_MAX_OVERFLOW)
+instrument_engine(async_engine.sync_engine, "async", DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+# Objects stay readable after commit: a lazy refresh outside run_sync would
+# need I/O the event loop can't do synchronously
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
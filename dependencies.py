@@ -1,19 +1,64 @@
 from fastapi import Request, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from cache import TTLCache
+from database import AsyncSessionLocal
 from models import User
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Logged-in users are resolved at most once per request (memoized on
+# request.state) and served from a short-lived process cache across requests.
+# Cached users are detached snapshots; each request gets its own copy merged
+# into its session without a query, so handlers can still modify and commit it.
+#
+# Handlers are async and get an AsyncSession. The ORM helpers they share with
+# the background workers take a plain Session, so handlers call them (and
+# render their templates) inside `await db.run_sync(fn, ...)`: fn receives a
+# Session whose queries go through the async driver, and lazy loads during
+# rendering still work.
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 4096
+
+_users = TTLCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+_UNSET = object()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
+def _load_user(db: Session, user_id: int) -> User | None:
+    cached = _users.get(user_id)
+    if cached is not None:
+        return db.merge(cached, load=False)
+
+    user = db.query(User).options(joinedload(User.mod_rank)).filter(User.id == user_id).first()
+    if not user:
         return None
-    return db.query(User).filter(User.id == int(user_id)).first()
 
+    # Keep a detached snapshot for later requests and hand back a session-bound copy
+    db.expunge(user)
+    if user.mod_rank is not None:
+        db.expunge(user.mod_rank)
+    _users.put(user_id, user)
+    return db.merge(user, load=False)
+
+def get_current_user(request: Request, db: Session):
+    user = getattr(request.state, "current_user", _UNSET)
+    if user is not _UNSET:
+        return user
+
+    user_id = request.session.get("user_id")
+    user = _load_user(db, int(user_id)) if user_id else None
+    request.state.current_user = user
+    return user
+
+# get_current_user for async handlers that need the user before entering run_sync
+async def current_user(request: Request, db: AsyncSession):
+    user = getattr(request.state, "current_user", _UNSET)
+    if user is not _UNSET:
+        return user
+    return await db.run_sync(lambda session: get_current_user(request, session))
+
+# Call after committing any change to a user or their rank
+def invalidate_user(user_id: int):
+    _users.invalidate(user_id)
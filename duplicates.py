@@ -0,0 +1,119 @@
+import threading
+import time
+from sqlalchemy import select
+from config import DUPLICATE_MAX_DISTANCE
+from models import Icon
+
+# Near-duplicate detection for uploads, on the perceptual hashes stored in
+# Icon.image_hash (images.image_hash).
+#
+# Two images are near-duplicates when their hashes differ in at most
+# DUPLICATE_MAX_DISTANCE bits. HashIndex is a multi-index hash table: each
+# hash is cut into DUPLICATE_MAX_DISTANCE + 1 chunks, and each chunk is a key
+# in its own table. Hashes that differ in at most that many bits agree exactly
+# on at least one chunk, so a lookup only compares against icons sharing a
+# chunk with the query instead of scanning the catalog.
+#
+# Each process keeps its own index, loaded on first use. Before every lookup
+# it adds icons with ids past the newest one it has seen, which covers uploads
+# made through other workers; a full reload every INDEX_MAX_AGE seconds picks
+# up backfilled hashes and anything else that was missed. Matches are read
+# back from the database, so deleted icons drop out without any invalidation.
+
+HASH_BITS = 64
+_MASK = (1 << HASH_BITS) - 1
+
+# Seconds before the process-wide index is rebuilt from the database
+INDEX_MAX_AGE = 600
+
+# Most similar icons reported for one upload
+MAX_MATCHES = 6
+
+
+def hash_distance(a: int, b: int) -> int:
+    return ((a ^ b) & _MASK).bit_count()
+
+
+class HashIndex:
+    def __init__(self, max_distance: int = DUPLICATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        self._bounds = [(HASH_BITS * i // chunks, HASH_BITS * (i + 1) // chunks) for i in range(chunks)]
+        self._tables: list[dict[int, set[int]]] = [{} for _ in self._bounds]
+        self._hashes: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _chunks(self, value: int):
+        value &= _MASK
+        for start, end in self._bounds:
+            yield value >> start & ((1 << (end - start)) - 1)
+
+    def add(self, icon_id: int, value: int):
+        self.discard(icon_id)
+        self._hashes[icon_id] = value
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, set()).add(icon_id)
+
+    def discard(self, icon_id: int):
+        value = self._hashes.pop(icon_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table[chunk]
+            bucket.discard(icon_id)
+            if not bucket:
+                del table[chunk]
+
+    # (distance, icon_id) for every indexed hash within max_distance bits,
+    # closest first
+    def near(self, value: int) -> list[tuple[int, int]]:
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            candidates.update(table.get(chunk, ()))
+        found = ((hash_distance(value, self._hashes[icon_id]), icon_id) for icon_id in candidates)
+        return sorted(match for match in found if match[0] <= self.max_distance)
+
+
+# The process-wide index, kept in step with the icons table
+class DuplicateFinder:
+    def __init__(self):
+        self._index = HashIndex()
+        self._last_id = 0
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _sync(self, db):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > INDEX_MAX_AGE:
+            self._index = HashIndex()
+            self._last_id = 0
+            self._loaded_at = time.monotonic()
+
+        rows = db.execute(
+            select(Icon.id, Icon.image_hash)
+            .where(Icon.id > self._last_id, Icon.image_hash.is_not(None))
+            .order_by(Icon.id)
+        )
+        for icon_id, value in rows:
+            self._index.add(icon_id, value)
+            self._last_id = icon_id
+
+    # Existing icons that look like an image with hash `value`, closest first.
+    # Failed uploads are skipped; unfinished ones count, so quick repeats are caught.
+    def find(self, db, value: int) -> list[Icon]:
+        with self._lock:
+            self._sync(db)
+            matches = self._index.near(value)[:MAX_MATCHES]
+        if not matches:
+            return []
+
+        icons = {icon.id: icon for icon in db.query(Icon).filter(Icon.id.in_([icon_id for _, icon_id in matches]))}
+        with self._lock:
+            for _, icon_id in matches:
+                if icon_id not in icons:
+                    self._index.discard(icon_id)
+        return [icons[icon_id] for _, icon_id in matches if icon_id in icons and icons[icon_id].status != "failed"]
+
+
+duplicate_finder = DuplicateFinder()
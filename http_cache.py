@@ -0,0 +1,122 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
+from models import ChangeStamp, Comment, Icon, User
+from queries import insert_or_ignore
+from reference import reference
+
+# Conditional GET support (ETag / Last-Modified / 304) for pages and API responses.
+# Validators come from cheap change stamps rather than the rendered output, so
+# a revalidation is answered before the page's real queries run:
+#   Icon.updated_at   edits to the icon itself
+#   Icon.activity_at  candles and comments (bumped with the counters)
+#   User.renamed_at   display-name changes, for pages showing that user
+#   icon_neighbors    an icon page's related icons (related.related_stamps)
+#   change_stamps     icon deletes, which leave no row behind, for listings
+# Each page only includes the stamps of what it shows, so a write elsewhere
+# on the site leaves its clients' copies valid.
+
+PUBLIC_MAX_AGE = 60
+
+ICON_DELETED = "icon_deleted"
+
+
+# Record that a stamped event happened (default: now), inside the caller's transaction
+def touch_stamp(db, name: str, at: datetime | None = None):
+    changed_at = at if at is not None else func.now()
+    if not db.execute(update(ChangeStamp).where(ChangeStamp.name == name).values(changed_at=changed_at)).rowcount:
+        db.execute(insert_or_ignore(db.get_bind(), ChangeStamp, ["name"]).values(name=name, changed_at=changed_at))
+
+
+# (updated_at, activity_at, status, uploader_renamed_at, commenters_renamed_at)
+# of one icon by primary key, or None. The last two cover the names its page
+# shows: the uploader's, and those of everyone who commented.
+def icon_stamps(db, icon_id: int):
+    uploader = aliased(User)
+    commenters = (
+        select(func.max(User.renamed_at)).join(Comment, Comment.user_id == User.id)
+        .where(Comment.icon_id == Icon.id).scalar_subquery()
+    )
+    return db.execute(
+        select(
+            Icon.updated_at, Icon.activity_at, Icon.status,
+            uploader.renamed_at.label("uploader_renamed_at"), commenters.label("commenters_renamed_at"),
+        )
+        .outerjoin(uploader, uploader.id == Icon.user_id)
+        .where(Icon.id == icon_id)
+    ).first()
+
+
+# Newest change across the whole catalog, for listing pages. Each max() is
+# answered from an index, and the deletion stamp is a primary-key lookup.
+def catalog_stamps(db) -> tuple:
+    deleted = select(ChangeStamp.changed_at).where(ChangeStamp.name == ICON_DELETED).scalar_subquery()
+    return tuple(db.execute(select(func.max(Icon.id), func.max(Icon.updated_at), func.max(Icon.activity_at), deleted)).first())
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+# Newest datetime among stamps, looking one level into (name, changed_at) pairs
+def latest(*stamps) -> datetime | None:
+    flat = [v for s in stamps for v in (s if isinstance(s, tuple) else (s,))]
+    values = [_as_utc(v) for v in flat if isinstance(v, datetime)]
+    return max(values) if values else None
+
+
+# Weak validator over everything that shapes the response. The viewer is part
+# of it because pages embed their name and their own candles.
+def make_etag(request: Request, *parts, user=None) -> str:
+    viewer = (user.id, user.display_name) if user else None
+    raw = repr((request.url.path, str(request.query_params), reference.traditions(), viewer, parts))
+    return f'W/"{hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same validator
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def _headers(etag: str, last_modified: datetime | None, user) -> dict:
+    headers = {
+        "ETag": etag,
+        # Logged-in pages are personal; anonymous ones may sit in shared caches briefly
+        "Cache-Control": "private, no-cache" if user else f"public, max-age={PUBLIC_MAX_AGE}",
+        "Vary": "Cookie",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(microsecond=0), usegmt=True)
+    return headers
+
+
+# A 304 if the client's copy is current, else None. If-None-Match wins over
+# If-Modified-Since when both are sent (RFC 9110 13.2.2).
+def not_modified(request: Request, etag: str, last_modified: datetime | None = None, user=None) -> Response | None:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, etag)
+    else:
+        fresh = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and last_modified is not None:
+            try:
+                fresh = last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                fresh = False
+
+    if not fresh:
+        return None
+    return Response(status_code=304, headers=_headers(etag, last_modified, user))
+
+
+# Attach validators and the caching policy to a full response
+def cache_headers(response: Response, etag: str, last_modified: datetime | None = None, user=None) -> Response:
+    response.headers.update(_headers(etag, last_modified, user))
+    return response
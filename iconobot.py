@@ -1,67 +1,162 @@
 import discord
 from discord.ext import commands
 from PIL import Image, ImageDraw, ImageFont
-import requests
+import aiohttp
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 import os
+import time
+from urllib.parse import urlparse
+import metrics
+from card_cache import card_cache, card_key
+from images import read_image
+from services import fetch_icon_metadata
+
+# Shared HTTP client for source images: connections are pooled and reused across commands
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+HTTP_CONNECTION_LIMIT = 20
+
+# Card rendering is CPU bound Pillow work, so it runs off the event loop
+# (shared with FastAPI) on a small bounded pool
+RENDER_WORKERS = 2
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="card-render")
+
+
+COMMAND_SECONDS = metrics.Histogram("bot_command_duration_seconds", "Discord command latency", ("command",))
+CARD_SECONDS = metrics.Histogram("bot_card_render_seconds", "Icon card cache misses by stage", ("stage",))
+
+
+class IconBot(commands.Bot):
+    web: aiohttp.ClientSession | None = None
+
+    async def setup_hook(self):
+        self.web = aiohttp.ClientSession(
+            timeout=HTTP_TIMEOUT,
+            connector=aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT, ttl_dns_cache=300),
+        )
+
+    async def close(self):
+        if self.web is not None:
+            await self.web.close()
+        await super().close()
+
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = IconBot(command_prefix="!", intents=intents)
+
+
+# Time every command; after_invoke runs whether or not the command failed
+@bot.before_invoke
+async def start_timer(ctx):
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_duration(ctx):
+    COMMAND_SECONDS.observe(time.perf_counter() - ctx.started, ctx.command.qualified_name)
+
+# Fonts (you can replace with local .ttf fonts), read from disk on the first render
+@functools.cache
+def card_fonts() -> tuple:
+    title = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 28)
+    text = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
+    return title, text
 
-BASE_URL = "https://iconostasis.onrender.com"
 
-# Fonts (you can replace with local .ttf fonts)
-TITLE_FONT = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 28)
-TEXT_FONT = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
+# Source image bytes for a card. Local storage and pending uploads carry
+# site-relative URLs (/media/..., /static/...), which are read from disk on a
+# worker thread; only absolute URLs are downloaded.
+async def fetch_image(url: str) -> bytes:
+    if not urlparse(url).scheme:
+        return await asyncio.to_thread(read_image, url)
+    async with bot.web.get(url) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+# Metadata render_card draws, which the card's cache key is built from
+CARD_FIELDS = ("title", "saints", "tradition", "century", "region", "iconographer", "uploader", "card_image_url", "image_url")
+
+
+# Compose the 800x400 card and encode it as PNG. Runs in render_executor.
+def render_card(data: dict, image_bytes: bytes) -> BytesIO:
+    # Create base image
+    width, height = 800, 400
+    title_font, text_font = card_fonts()
+    card = Image.new("RGBA", (width, height), (30, 30, 30, 255))  # dark bg
+    draw = ImageDraw.Draw(card)
+
+    # Load icon image
+    icon_img = Image.open(BytesIO(image_bytes)).convert("RGBA")
+    icon_img = icon_img.resize((200, 200))
+    card.paste(icon_img, (50, 100), icon_img)
+
+    # Title
+    draw.text((270, 50), data["title"], font=title_font, fill=(255, 215, 0))
+
+    # Metadata
+    meta_y = 100
+    spacing = 30
+    metadata = [
+        f"Saint(s): {', '.join(data.get('saints', [])) or 'None'}",
+        f"Tradition: {data.get('tradition', 'Unknown')}",
+        f"Century: {data.get('century', 'Unknown')}",
+        f"Region: {data.get('region', 'Unknown')}",
+        f"Iconographer: {data.get('iconographer', 'Unknown')}",
+        f"Uploaded by: {data.get('uploader','Unknown')}"
+    ]
+    for i, line in enumerate(metadata):
+        draw.text((270, meta_y + i*spacing), line, font=text_font, fill=(255, 255, 255))
+
+    # Save to bytes
+    buffer = BytesIO()
+    card.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
 
 @bot.command()
 async def icon(ctx, icon_id: int):
     try:
-        # Fetch icon JSON
-        resp = requests.get(f"{BASE_URL}/api/icon/{icon_id}")
-        if resp.status_code != 200:
+        # Read metadata in-process rather than through the public API
+        data = await fetch_icon_metadata(icon_id)
+        if data is None:
             await ctx.send(f"Icon ID {icon_id} not found.")
             return
-        data = resp.json()
-
-        # Create base image
-        width, height = 800, 400
-        card = Image.new("RGBA", (width, height), (30, 30, 30, 255))  # dark bg
-        draw = ImageDraw.Draw(card)
-
-        # Load icon image
-        icon_resp = requests.get(data["image_url"])
-        icon_img = Image.open(BytesIO(icon_resp.content)).convert("RGBA")
-        icon_img = icon_img.resize((200, 200))
-        card.paste(icon_img, (50, 100), icon_img)
-
-        # Title
-        draw.text((270, 50), data["title"], font=TITLE_FONT, fill=(255, 215, 0))
-
-        # Metadata
-        meta_y = 100
-        spacing = 30
-        metadata = [
-            f"Saint(s): {', '.join(data.get('saints', [])) or 'None'}",
-            f"Tradition: {data.get('tradition', 'Unknown')}",
-            f"Century: {data.get('century', 'Unknown')}",
-            f"Region: {data.get('region', 'Unknown')}",
-            f"Iconographer: {data.get('iconographer', 'Unknown')}",
-            f"Uploaded by: {data.get('uploader','Unknown')}"
-        ]
-        for i, line in enumerate(metadata):
-            draw.text((270, meta_y + i*spacing), line, font=TEXT_FONT, fill=(255, 255, 255))
-
-        # Save to bytes
-        buffer = BytesIO()
-        card.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        # Send as Discord file
-        await ctx.send(file=discord.File(fp=buffer, filename=f"icon_{icon_id}.png"))
 
+        # Only runs on a cache miss; concurrent misses for the same card share it
+        async def render() -> bytes:
+            # The card only shows a 200x200 copy, so fetch the small derivative
+            started = time.perf_counter()
+            image_bytes = await fetch_image(data.get("card_image_url") or data["image_url"])
+            fetched = time.perf_counter()
+            CARD_SECONDS.observe(fetched - started, "fetch")
+
+            loop = asyncio.get_running_loop()
+            buffer = await loop.run_in_executor(render_executor, render_card, data, image_bytes)
+            CARD_SECONDS.observe(time.perf_counter() - fetched, "render")
+            return buffer.getvalue()
+
+        png = await card_cache.get_or_render(card_key(icon_id, {field: data.get(field) for field in CARD_FIELDS}), render)
+
+        # Send as Discord file; related icons aren't on the card, so its cache
+        # key doesn't depend on them
+        related = ", ".join(f"{other['title']} (#{other['id']})" for other in data.get("related", ()))
+        await ctx.send(
+            content=f"Related: {related}" if related else None,
+            file=discord.File(fp=BytesIO(png), filename=f"icon_{icon_id}.png"),
+        )
+
+    except asyncio.TimeoutError:
+        await ctx.send(f"Timed out fetching icon {icon_id}, please try again.")
     except Exception as e:
         await ctx.send(f"Error generating icon card: {e}")
 
 
+@bot.command()
+async def cardstats(ctx):
+    stats = card_cache.stats()
+    await ctx.send("Card cache: " + ", ".join(f"{name}={value}" for name, value in stats.items()))
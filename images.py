@@ -0,0 +1,187 @@
+import hashlib
+import os
+import urllib.request
+from io import BytesIO
+from urllib.parse import unquote, urlparse
+from PIL import Image, ImageOps
+from config import IMAGE_STORAGE, MEDIA_DIR, MEDIA_URL
+
+# Responsive derivatives for uploaded icons.
+# Every upload is stored once at full size plus a few downscaled copies in WebP
+# and JPEG, so listings never ship the original to a 300px card. The URLs end
+# up in Icon.derivatives, keyed by derivative name:
+#   {"thumb": {"width": 400, "height": 533, "webp": url, "jpeg": url}, ...}
+
+# Longest edge of each derivative, in pixels. Smaller originals are never upscaled.
+DERIVATIVES = {
+    "card": 256,     # bot card source (pasted at 200x200)
+    "thumb": 480,    # grid cards on home, profile and settings
+    "detail": 1200,  # icon detail page
+}
+
+FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    if fmt == "jpeg" and img.mode != "RGB":
+        # JPEG has no alpha; flatten onto white like most viewers would
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A") if "A" in img.getbands() else None)
+        img = background
+    buffer = BytesIO()
+    img.save(buffer, **FORMATS[fmt])
+    return buffer.getvalue()
+
+
+# Downscale and encode every derivative. Returns {name: (width, height, {fmt: bytes})}.
+def render_derivatives(image_bytes: bytes) -> dict:
+    with Image.open(BytesIO(image_bytes)) as original:
+        # Phone photos are often stored sideways with an EXIF rotation flag
+        source = ImageOps.exif_transpose(original)
+        if source.mode not in ("RGB", "RGBA"):
+            source = source.convert("RGBA" if "transparency" in source.info or "A" in source.getbands() else "RGB")
+
+        rendered = {}
+        for name, edge in DERIVATIVES.items():
+            img = source.copy()
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            rendered[name] = (img.width, img.height, {fmt: _encode(img, fmt) for fmt in FORMATS})
+        return rendered
+
+
+# Side of the grid image_hash compares, giving a 64-bit hash
+HASH_SIZE = 8
+
+
+# Perceptual difference hash (dHash): each bit says whether a pixel of a tiny
+# grayscale copy is brighter than its right neighbour, so resizing,
+# recompression and light edits flip few bits. Returned as a signed 64-bit
+# integer to fit a BIGINT column (see duplicates.py).
+def image_hash(image_bytes: bytes) -> int:
+    width = HASH_SIZE + 1
+    with Image.open(BytesIO(image_bytes)) as original:
+        # Lets JPEGs decode at a fraction of full size; only a few pixels are kept
+        original.draft("L", (width * 8, HASH_SIZE * 8))
+        small = ImageOps.exif_transpose(original).convert("L").resize((width, HASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = row * width + col
+            value = value << 1 | (pixels[left] > pixels[left + 1])
+    return value - (1 << 64) if value >> 63 else value
+
+
+class CloudinaryStorage:
+    def __init__(self):
+        # The SDK is slow to import and unused with local storage, so it is
+        # loaded (and configured) when the first upload needs it
+        import cloudinary.uploader
+        import cloudinary_config  # noqa: F401
+
+        self.uploader = cloudinary.uploader
+
+    # Cloudinary public ids carry no extension, and thumb.webp and thumb.jpeg
+    # must not share one: the format goes into the id ("icons/<digest>/thumb-webp")
+    @staticmethod
+    def public_id(key: str) -> str:
+        base, ext = os.path.splitext(key)
+        return f"{base}-{ext[1:]}" if ext else base
+
+    def save(self, key: str, data: bytes, content_type: str) -> str:
+        public_id = self.public_id(key)
+        result = self.uploader.upload(BytesIO(data), public_id=public_id, overwrite=True, resource_type="image")
+        return result["secure_url"]
+
+
+# Writes under MEDIA_DIR, served by the app at MEDIA_URL (see index.py).
+# Meant for local development, tests and offline use.
+class LocalStorage:
+    def __init__(self, directory: str, url_prefix: str):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def save(self, key: str, data: bytes, content_type: str) -> str:
+        path = os.path.join(self.directory, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return f"{self.url_prefix}/{key}"
+
+
+# Site-relative URL prefixes and the directories behind them (see index.py)
+LOCAL_URL_DIRS = {
+    MEDIA_URL.rstrip("/"): MEDIA_DIR,
+    "/static": "static",
+}
+
+
+# Bytes behind an image URL stored on an icon. Site-relative URLs (local
+# storage, bundled static images) are read from disk, since there is no host
+# to fetch them from; only absolute URLs are downloaded.
+def read_image(url: str, timeout: float = 30) -> bytes:
+    parsed = urlparse(url)
+    if parsed.scheme:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.read()
+
+    path = unquote(parsed.path)
+    for prefix, directory in LOCAL_URL_DIRS.items():
+        if path.startswith(prefix + "/"):
+            parts = path[len(prefix) + 1:].split("/")
+            if ".." in parts:
+                break
+            with open(os.path.join(directory, *parts), "rb") as f:
+                return f.read()
+    raise ValueError(f"Not a stored image URL: {url}")
+
+
+STORAGE_BACKENDS = {
+    "cloudinary": CloudinaryStorage,
+    "local": lambda: LocalStorage(MEDIA_DIR, MEDIA_URL),
+}
+
+_storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = STORAGE_BACKENDS[IMAGE_STORAGE]()
+    return _storage
+
+
+# Store the derivatives of an already-stored original and return the
+# Icon.derivatives mapping. Keys are content addressed, so re-running this for
+# the same image overwrites the same objects.
+def store_derivatives(image_bytes: bytes, storage=None) -> dict:
+    storage = storage or get_storage()
+    digest = hashlib.sha256(image_bytes).hexdigest()[:24]
+
+    derivatives = {}
+    for name, (width, height, encoded) in render_derivatives(image_bytes).items():
+        entry = {"width": width, "height": height}
+        for fmt, data in encoded.items():
+            entry[fmt] = storage.save(f"icons/{digest}/{name}.{fmt}", data, CONTENT_TYPES[fmt])
+        derivatives[name] = entry
+    return derivatives
+
+
+# Store an uploaded image in full plus its derivatives.
+# Returns (original_url, derivatives) for the new Icon row.
+def store_icon_image(image_bytes: bytes, storage=None) -> tuple[str, dict]:
+    storage = storage or get_storage()
+    digest = hashlib.sha256(image_bytes).hexdigest()[:24]
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        fmt = (img.format or "jpeg").lower()
+    original_url = storage.save(f"icons/{digest}/original.{fmt}", image_bytes, f"image/{fmt}")
+    return original_url, store_derivatives(image_bytes, storage)
@@ -1,50 +1,73 @@
 import os
-import cloudinary
-import cloudinary_config
-import database
-import dependencies
-import iconobot
 import asyncio
+import logging
+import time
+import botworker
+import database
+import ingest
+import metrics
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Depends, Query, Form
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from sqlalchemy import create_engine, inspect, text
-from sqlalchemy.orm import Session, sessionmaker
-from models import Base, Icon, ModRank, Saint, Tradition, User
-from routes import users, icons, home, auth
+from config import IMAGE_STORAGE, MEDIA_DIR, MEDIA_URL, METRICS_TOKEN
+from reference import reference
+from routes import users, icons, home, auth, search, catalog
+
+# The web app. Nothing slow happens at import: the Discord bot (discord.py and
+# its fonts) and the Cloudinary SDK are loaded only when first needed, and the
+# bot runs in at most one process per host (see botworker.py).
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = metrics.Gauge("web_startup_seconds", "Time the app's startup (lifespan) took")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    task = asyncio.create_task(iconobot.bot.start(os.getenv("DISCORD_BOT_TOKEN")))
-    
+    started = time.perf_counter()
+    await asyncio.to_thread(reference.refresh)
+    refresher = asyncio.create_task(reference.keep_fresh())
+    await ingest.ingest_queue.start()
+    bot = botworker.start_embedded()
+    STARTUP_SECONDS.set(round(time.perf_counter() - started, 3))
+    logger.info("Started in %.2fs", time.perf_counter() - started)
+
     yield
-    
+
     # Shutdown logic:
-    await iconobot.bot.close()
-    task.cancel()
+    await ingest.ingest_queue.stop()
+    await botworker.stop_embedded(bot)
+    refresher.cancel()
+    await database.async_engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
         SessionMiddleware,
         secret_key=os.getenv("SECRET_KEY")
 )
-
-templates = Jinja2Templates(directory="templates")
+# Outermost, so its timings include session handling
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(users.router)
 app.include_router(icons.router)
 app.include_router(home.router)
 app.include_router(auth.router)
+app.include_router(search.router)
+app.include_router(catalog.router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
-
-@app.on_event("startup")
-def start_bot() -> None:
-    iconobot.bot.run(os.getenv("DISCORD_BOT_TOKEN"))
+if IMAGE_STORAGE == "local":
+    app.mount(MEDIA_URL, StaticFiles(directory=MEDIA_DIR, check_dir=False), name="media")
 
 @app.api_route("/health", methods=["GET", "HEAD"])
 def health_check():
         return {"status": "ok"}
+
+# Prometheus scrape target; open unless METRICS_TOKEN is set
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
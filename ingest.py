@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, or_, update
+from config import UPLOAD_MAX_ATTEMPTS, UPLOAD_STAGING_DIR, UPLOAD_WORKERS
+from database import SessionLocal
+from images import image_hash, store_icon_image
+from models import Icon
+from saints import resolve_saint_ids, set_icon_saints
+from search import reindex_icon
+from services import invalidate_icon
+
+# Background upload ingestion.
+# POST /upload streams the file into UPLOAD_STAGING_DIR, inserts the icon as
+# "pending" and returns. A fixed number of workers then push the staged file
+# to image storage, generate derivatives and mark the icon "ready". Failed
+# attempts are retried with exponential backoff; after UPLOAD_MAX_ATTEMPTS the
+# icon is marked "failed" and the staged file is kept for inspection.
+#
+# With `uvicorn --workers N` every process requeues the same leftover uploads
+# on startup, so an attempt first claims its icon: one conditional UPDATE moves
+# it from "pending" to "processing", and only the process whose UPDATE matched
+# goes on. A claim older than CLAIM_TIMEOUT (its process died mid-upload) can
+# be taken over. Failed attempts hand the icon back to "pending" for a retry.
+# Each claim counts an attempt on the icon row, so the limit holds however
+# many processes have tried it.
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+RETRY_BASE_DELAY = 2
+
+# Longest an attempt may hold its claim before another process may take over
+CLAIM_TIMEOUT = timedelta(minutes=15)
+
+# Shown for icons whose image hasn't been stored yet
+PENDING_IMAGE_URL = "/static/images/favicon.ico"
+
+
+def staged_path(icon_id: int) -> str:
+    return os.path.join(UPLOAD_STAGING_DIR, f"{icon_id}.upload")
+
+
+# Copy an UploadFile to a temporary staging file without reading it into memory
+async def stage_upload(upload) -> str:
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_STAGING_DIR, f"{uuid.uuid4().hex}.tmp")
+    try:
+        with open(path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        discard(path)
+        raise
+    return path
+
+
+# Perceptual hash of a staged upload, or None if Pillow can't read it (the
+# ingest worker reports unreadable images when it gets to them)
+def hash_staged(path: str) -> int | None:
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    try:
+        return image_hash(image_bytes)
+    except Exception:
+        return None
+
+
+def discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Insert the pending icon and claim the staged file for it
+def create_pending_icon(db, temp_path: str, user_id: int, fields: dict, saint_names: list[str]) -> Icon:
+    icon = Icon(**fields, image_url=PENDING_IMAGE_URL, status="pending", user_id=user_id)
+    db.add(icon)
+    db.flush()
+    set_icon_saints(db, icon, resolve_saint_ids(db, saint_names))
+    os.replace(temp_path, staged_path(icon.id))
+    try:
+        db.commit()
+    except BaseException:
+        discard(staged_path(icon.id))
+        raise
+    # Reload now so callers on the event loop never trigger a lazy refresh
+    db.refresh(icon)
+    return icon
+
+
+# Conditions under which an icon's upload may be (re)claimed
+def _claimable():
+    stale = datetime.now(timezone.utc) - CLAIM_TIMEOUT
+    return or_(Icon.status == "pending", (Icon.status == "processing") & (Icon.claimed_at < stale))
+
+
+# Atomically take an icon's upload for this attempt; False if it is done,
+# deleted or being processed elsewhere
+def claim_upload(db, icon_id: int) -> bool:
+    claimed = db.execute(
+        update(Icon).where(Icon.id == icon_id, _claimable())
+        .values(status="processing", claimed_at=datetime.now(timezone.utc), upload_attempts=Icon.upload_attempts + 1)
+    ).rowcount
+    db.commit()
+    return bool(claimed)
+
+
+def release_upload(icon_id: int):
+    with SessionLocal() as db:
+        db.execute(update(Icon).where(Icon.id == icon_id, Icon.status == "processing").values(status="pending", claimed_at=None))
+        db.commit()
+
+
+# One attempt at finishing an upload. Runs on a worker thread.
+def process_upload(icon_id: int):
+    path = staged_path(icon_id)
+    with SessionLocal() as db:
+        if not claim_upload(db, icon_id):
+            if db.get(Icon, icon_id) is None:
+                # Deleted while queued
+                discard(path)
+            # Otherwise finished or still in progress elsewhere, which owns the file
+            return
+
+        try:
+            finish_upload(db, icon_id, path)
+        except BaseException:
+            db.rollback()
+            release_upload(icon_id)
+            raise
+
+    invalidate_icon(icon_id)
+    discard(path)
+
+
+# Store the claimed icon's image and publish it
+def finish_upload(db, icon_id: int, path: str):
+    icon = db.get(Icon, icon_id)
+    if icon is None:
+        # Deleted since it was claimed
+        return
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    image_url, derivatives = store_icon_image(image_bytes)
+
+    if icon.image_hash is None:
+        # Uploads are normally hashed on arrival, see upload_icon
+        icon.image_hash = image_hash(image_bytes)
+    icon.image_url = image_url
+    icon.derivatives = derivatives
+    icon.status = "ready"
+    icon.processing_error = None
+    icon.claimed_at = None
+    icon.updated_at = func.now()
+    # Only ready icons are searchable
+    reindex_icon(db, icon)
+    db.commit()
+
+
+# Attempts made at an icon's upload by any process
+def upload_attempts(icon_id: int) -> int:
+    with SessionLocal() as db:
+        return db.query(Icon.upload_attempts).filter(Icon.id == icon_id).scalar() or 0
+
+
+# Give up on an upload, unless another process has finished it meanwhile
+def mark_failed(icon_id: int, error: str):
+    with SessionLocal() as db:
+        db.execute(
+            update(Icon).where(Icon.id == icon_id, Icon.status != "ready")
+            .values(status="failed", processing_error=error, claimed_at=None)
+        )
+        db.commit()
+    invalidate_icon(icon_id)
+
+
+# Uploads left unfinished: never claimed, or claimed by a process that died
+def claimable_icon_ids() -> list[int]:
+    with SessionLocal() as db:
+        return [row.id for row in db.query(Icon.id).filter(_claimable()).order_by(Icon.id)]
+
+
+class IngestQueue:
+    def __init__(self, workers: int, max_attempts: int):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    # Start the workers and pick up uploads a previous run left unfinished
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        for icon_id in await asyncio.to_thread(claimable_icon_ids):
+            if os.path.exists(staged_path(icon_id)):
+                self.submit(icon_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, icon_id: int):
+        self._queue.put_nowait(icon_id)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _work(self):
+        while True:
+            icon_id = await self._queue.get()
+            try:
+                await self._attempt(icon_id)
+            finally:
+                self._queue.task_done()
+
+    async def _attempt(self, icon_id: int):
+        try:
+            await asyncio.to_thread(process_upload, icon_id)
+        except Exception as e:
+            attempt = await asyncio.to_thread(upload_attempts, icon_id)
+            if attempt >= self.max_attempts:
+                logger.exception("Upload for icon %s failed after %s attempts", icon_id, attempt)
+                await asyncio.to_thread(mark_failed, icon_id, str(e))
+                return
+            # Requeue later without holding a worker slot while waiting
+            delay = RETRY_BASE_DELAY ** attempt
+            logger.warning("Upload for icon %s failed (attempt %s), retrying in %ss: %s", icon_id, attempt, delay, e)
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, icon_id)
+
+
+ingest_queue = IngestQueue(UPLOAD_WORKERS, UPLOAD_MAX_ATTEMPTS)
@@ -0,0 +1,149 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import database
+from counters import recount_icons
+from images import image_hash, read_image, store_derivatives
+from migrations import migrate
+from models import Icon
+from page_cache import page_cache
+from rankings import rebuild_trending
+from related import refresh_related
+from search import rebuild_index
+
+# Maintenance commands, e.g. `python manage.py recount`
+
+HASH_BATCH_SIZE = 100
+
+
+def cmd_migrate(args):
+    migrate(database.engine)
+    print("Schema is up to date")
+
+
+def cmd_recount(args):
+    with database.engine.begin() as conn:
+        updated = recount_icons(conn, args.icon_ids or None)
+    print(f"Recounted candles and comments for {updated} icon(s)")
+
+
+def cmd_reindex_search(args):
+    with database.SessionLocal() as db:
+        indexed = rebuild_index(db)
+        db.commit()
+    print(f"Indexed {indexed} icon(s) for search")
+
+
+def cmd_rebuild_rankings(args):
+    with database.engine.begin() as conn:
+        scored = rebuild_trending(conn)
+    page_cache.clear()
+    print(f"Rebuilt trending scores for {scored} icon(s)")
+
+
+# Meant to run from cron, e.g. every few minutes plus a nightly --full (see
+# related.py); without --full only lists that may have changed are recomputed
+def cmd_related(args):
+    with database.SessionLocal() as db:
+        stats = refresh_related(db, full=args.full)
+    print(
+        f"Refreshed related icons for {stats['refreshed']} of {stats['icons']} icon(s) "
+        f"({stats['changed']} changed, {stats['neighbors']} neighbors stored, {stats['purged']} removed)"
+    )
+
+
+# Generate derivatives for icons uploaded before the pipeline existed
+def cmd_derivatives(args):
+    with database.SessionLocal() as db:
+        query = db.query(Icon).order_by(Icon.id)
+        if args.icon_ids:
+            query = query.filter(Icon.id.in_(args.icon_ids))
+        elif not args.all:
+            query = query.filter(Icon.derivatives.is_(None))
+
+        processed = 0
+        for icon in query.all():
+            try:
+                icon.derivatives = store_derivatives(read_image(icon.image_url))
+            except Exception as e:
+                print(f"Icon {icon.id}: {e}")
+                continue
+            # Commit as we go so an interrupted run keeps its progress
+            db.commit()
+            processed += 1
+    print(f"Generated derivatives for {processed} icon(s)")
+
+
+def _fetch_image_hash(icon: Icon) -> int:
+    # The small card copy hashes like the original for a fraction of the download
+    return image_hash(read_image(icon.image_variant("card")))
+
+
+# Hash the existing catalog for duplicate detection (see duplicates.py).
+# Images are fetched a few at a time; progress is committed per batch.
+def cmd_hash_images(args):
+    with database.SessionLocal() as db:
+        query = db.query(Icon).filter(Icon.status == "ready").order_by(Icon.id)
+        if args.icon_ids:
+            query = query.filter(Icon.id.in_(args.icon_ids))
+        elif not args.all:
+            query = query.filter(Icon.image_hash.is_(None))
+        icons = query.all()
+
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for start in range(0, len(icons), HASH_BATCH_SIZE):
+                batch = icons[start:start + HASH_BATCH_SIZE]
+                futures = [pool.submit(_fetch_image_hash, icon) for icon in batch]
+                for icon, future in zip(batch, futures):
+                    try:
+                        icon.image_hash = future.result()
+                    except Exception as e:
+                        print(f"Icon {icon.id}: {e}")
+                        continue
+                    hashed += 1
+                db.commit()
+    print(f"Hashed {hashed} of {len(icons)} icon(s)")
+
+
+COMMANDS = {
+    "migrate": cmd_migrate,
+    "recount": cmd_recount,
+    "reindex-search": cmd_reindex_search,
+    "derivatives": cmd_derivatives,
+    "rebuild-rankings": cmd_rebuild_rankings,
+    "related": cmd_related,
+    "hash-images": cmd_hash_images,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Iconostasis maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="Create missing tables and apply schema upgrades")
+
+    recount = subparsers.add_parser("recount", help="Rebuild candle and comment counters")
+    recount.add_argument("icon_ids", nargs="*", type=int, help="Only these icons (default: all)")
+
+    subparsers.add_parser("reindex-search", help="Rebuild the full-text search index")
+
+    derivatives = subparsers.add_parser("derivatives", help="Generate missing thumbnail and responsive images")
+    derivatives.add_argument("icon_ids", nargs="*", type=int, help="Only these icons (default: those without derivatives)")
+    derivatives.add_argument("--all", action="store_true", help="Regenerate for every icon")
+
+    subparsers.add_parser("rebuild-rankings", help="Recompute trending scores from candle and comment history")
+
+    related = subparsers.add_parser("related", help="Refresh precomputed related icons")
+    related.add_argument("--full", action="store_true", help="Recompute every icon instead of only changed ones")
+
+    hash_images = subparsers.add_parser("hash-images", help="Compute perceptual hashes for duplicate detection")
+    hash_images.add_argument("icon_ids", nargs="*", type=int, help="Only these icons (default: those without a hash)")
+    hash_images.add_argument("--all", action="store_true", help="Rehash every icon")
+    hash_images.add_argument("--workers", type=int, default=8, help="Images fetched at once")
+
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
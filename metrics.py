@@ -0,0 +1,310 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from config import METRICS_PROFILING, SLOW_QUERY_SECONDS
+
+# In-process metrics in the Prometheus text format, served on /metrics.
+#
+# MetricsMiddleware times every HTTP request and keeps a RequestStats for it
+# in a context variable. The SQLAlchemy events installed by instrument_engine
+# add each statement's count and duration to the current request's stats; the
+# context reaches run_sync greenlets and threadpool calls, and statements run
+# outside any request (ingest workers, exports) are still counted per engine.
+# Statements slower than SLOW_QUERY_SECONDS are logged with the route (or
+# thread) that issued them.
+#
+# With METRICS_PROFILING on, a request sent with "X-Profile: 1" gets a
+# Server-Timing header breaking down its own time: total, database time and
+# statement count, and time spent waiting for a pooled connection.
+#
+# Metric objects are module-level and safe to update from any thread. Values
+# owned by other modules (pool state, cache counters) are read at scrape time
+# through a `collect` callable instead of being copied in.
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "iconostasis_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Longest statement text written to the slow query log
+SLOW_QUERY_TEXT = 500
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        # Optional callable returning {label values tuple: value} at scrape time
+        self.collect = collect
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self):
+        if self.collect is not None:
+            return self.collect().items()
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def add(self, amount: float, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    # Per label set: [count in each bucket..., count in +Inf, sum]
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = (*self.labels, "le")
+        for labels, series in self._samples():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, (*labels, bound))} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+# Every registered metric in the Prometheus text exposition format
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            logger.exception("Could not collect %s", metric.name)
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route, method and status", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL statements per request", ("method", "route"))
+REQUEST_STATEMENTS = Histogram("http_request_db_statements", "SQL statements per request", ("method", "route"), STATEMENT_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled")
+
+STATEMENTS = Counter("db_statements_total", "SQL statements executed", ("engine",))
+STATEMENT_SECONDS = Histogram("db_statement_duration_seconds", "SQL statement latency", ("engine",))
+SLOW_STATEMENTS = Counter("db_slow_statements_total", "SQL statements slower than SLOW_QUERY_SECONDS", ("engine", "route"))
+CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time to get a connection from the pool", ("engine",), WAIT_BUCKETS)
+CHECKOUT_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Pool checkouts that gave up after DB_POOL_TIMEOUT", ("engine",))
+
+REQUESTS_IN_PROGRESS.set(0)
+
+
+# What one HTTP request has spent so far
+class RequestStats:
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    # The matched route template ("/icon/{icon_id}") once routing has run;
+    # mounts (static files, media) are labelled with their mount point
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        if route is not None:
+            return route.path
+        if self.scope.get("endpoint") is not None:
+            return self.scope.get("root_path") or "/"
+        return "unmatched"
+
+    def server_timing(self) -> str:
+        return ", ".join((
+            f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}",
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.statements} statements"',
+            f"pool;dur={self.pool_wait_seconds * 1000:.1f}",
+        ))
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        profile = METRICS_PROFILING and (b"x-profile", b"1") in scope["headers"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", stats.server_timing().encode())]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.add(1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_PROGRESS.add(-1)
+            _current.reset(token)
+            method, route = scope["method"], stats.route
+            REQUESTS.inc(method, route, str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - stats.started, method, route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, method, route)
+            REQUEST_STATEMENTS.observe(stats.statements, method, route)
+
+
+# Pools that time each checkout, including waiting for a free connection and
+# opening (and pre-pinging) it. Labelled by the engine's pool_logging_name.
+class _TimedCheckout:
+    def connect(self):
+        name = self.logging_name or "default"
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            CHECKOUT_TIMEOUTS.inc(name)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            CHECKOUT_WAIT.observe(waited, name)
+            stats = _current.get()
+            if stats is not None:
+                stats.pool_wait_seconds += waited
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+# Engines registered by instrument_engine: name -> (engine, capacity)
+POOLS: dict = {}
+
+
+# Count and time every statement run on `engine` (a sync Engine; pass
+# async_engine.sync_engine for the async one), and export its pool's state.
+# `capacity` is pool_size + max_overflow, the most connections it will open.
+def instrument_engine(engine, name: str, capacity: int):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        _record(conn, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        if context.connection is not None and context.statement is not None:
+            _record(context.connection, context.statement)
+
+    def _record(conn, statement: str):
+        started = conn.info.get("statement_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        STATEMENTS.inc(name)
+        STATEMENT_SECONDS.observe(elapsed, name)
+
+        stats = _current.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+        if elapsed >= SLOW_QUERY_SECONDS:
+            route = stats.route if stats is not None else threading.current_thread().name
+            SLOW_STATEMENTS.inc(name, route)
+            logger.warning("Slow statement (%.0f ms, %s engine) from %s: %s", elapsed * 1000, name, route, " ".join(statement.split())[:SLOW_QUERY_TEXT])
+
+    POOLS[name] = (engine, capacity)
+
+
+def _pool_connections() -> dict:
+    values = {}
+    for name, (engine, capacity) in POOLS.items():
+        pool = engine.pool
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+POOL_CONNECTIONS = Gauge("db_pool_connections", "Pooled connections by state", ("engine", "state"), collect=_pool_connections)
+POOL_CAPACITY = Gauge(
+    "db_pool_capacity", "Most connections the pool will open (pool_size + max_overflow)", ("engine",),
+    collect=lambda: {(name,): capacity for name, (engine, capacity) in POOLS.items()},
+)
+POOL_SATURATION = Gauge(
+    "db_pool_saturation", "Share of the pool's capacity checked out", ("engine",),
+    collect=lambda: {(name,): round(engine.pool.checkedout() / capacity, 3) for name, (engine, capacity) in POOLS.items() if capacity},
+)
@@ -0,0 +1,200 @@
+from sqlalchemy import JSON, BigInteger, DateTime, Double, inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.orm import Session
+from counters import recount_icons
+from models import Base, Icon
+from rankings import rebuild_trending
+from saints import invalidate_saints, normalize_saint_name
+from search import get_search_backend, rebuild_index
+
+# Schema upgrades for databases created before a model change.
+# Fresh databases get everything from Base.metadata.create_all, so every step
+# below must be idempotent and only add what an older schema is missing.
+
+
+def _has_column(conn, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def add_icon_counters(conn):
+    added = False
+    for column in ("candle_count", "comment_count"):
+        if not _has_column(conn, "icons", column):
+            conn.execute(text(f"ALTER TABLE icons ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+            added = True
+
+    if added:
+        recount_icons(conn)
+
+
+def add_icon_updated_at(conn):
+    if _has_column(conn, "icons", "updated_at"):
+        return
+    # SQLite refuses non-constant defaults in ADD COLUMN, so backfill separately
+    column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE icons ADD COLUMN updated_at {column_type}"))
+    conn.execute(text("UPDATE icons SET updated_at = CURRENT_TIMESTAMP"))
+
+
+def add_icon_activity_at(conn):
+    if _has_column(conn, "icons", "activity_at"):
+        return
+    column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE icons ADD COLUMN activity_at {column_type}"))
+    conn.execute(text("UPDATE icons SET activity_at = updated_at"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_icons_activity_at ON icons (activity_at)"))
+
+
+def add_icon_derivatives(conn):
+    if not _has_column(conn, "icons", "derivatives"):
+        column_type = JSON().compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE icons ADD COLUMN derivatives {column_type}"))
+
+
+def add_icon_status(conn):
+    if not _has_column(conn, "icons", "status"):
+        conn.execute(text("ALTER TABLE icons ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'ready'"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_icons_status ON icons (status)"))
+    if not _has_column(conn, "icons", "processing_error"):
+        conn.execute(text("ALTER TABLE icons ADD COLUMN processing_error TEXT"))
+    if not _has_column(conn, "icons", "claimed_at"):
+        column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE icons ADD COLUMN claimed_at {column_type}"))
+    if not _has_column(conn, "icons", "upload_attempts"):
+        conn.execute(text("ALTER TABLE icons ADD COLUMN upload_attempts INTEGER NOT NULL DEFAULT 0"))
+
+
+# Backfill normalized saint names, folding saints that only differ by case or
+# spacing into the oldest one, then enforce uniqueness
+def add_saint_normalized_name(conn):
+    added = not _has_column(conn, "saints", "normalized_name")
+    if added:
+        conn.execute(text("ALTER TABLE saints ADD COLUMN normalized_name VARCHAR(255)"))
+
+    keep = {}
+    for saint_id, name in conn.execute(text("SELECT id, name FROM saints WHERE normalized_name IS NULL ORDER BY id")):
+        key = normalize_saint_name(name)
+        if key not in keep:
+            keep[key] = conn.execute(
+                text("SELECT id FROM saints WHERE normalized_name = :key"), {"key": key}
+            ).scalar()
+        if keep[key] is None:
+            keep[key] = saint_id
+            conn.execute(text("UPDATE saints SET normalized_name = :key WHERE id = :id"), {"key": key, "id": saint_id})
+            continue
+
+        params = {"keep": keep[key], "dup": saint_id}
+        conn.execute(text("""
+            INSERT INTO icon_saints (icon_id, saint_id)
+            SELECT icon_id, :keep FROM icon_saints
+            WHERE saint_id = :dup
+              AND icon_id NOT IN (SELECT icon_id FROM icon_saints WHERE saint_id = :keep)
+        """), params)
+        conn.execute(text("DELETE FROM icon_saints WHERE saint_id = :dup"), params)
+        conn.execute(text("DELETE FROM saints WHERE id = :dup"), params)
+
+    # Fresh databases already get the constraint from the model
+    if added:
+        conn.execute(text("CREATE UNIQUE INDEX ix_saints_normalized_name ON saints (normalized_name)"))
+
+
+# Secondary indexes for profile pages and per-icon comment lookups.
+# Names match what Base.metadata.create_all generates for fresh databases.
+SECONDARY_INDEXES = {
+    "ix_icons_user_id_id": "icons (user_id, id)",
+    "ix_icons_tradition_id": "icons (tradition_id)",
+    "ix_icons_updated_at_id": "icons (updated_at, id)",
+    "ix_comments_icon_id_created_at_id": "comments (icon_id, created_at, id)",
+    "ix_comments_user_id": "comments (user_id)",
+    "ix_candles_user_id_icon_id": "candles (user_id, icon_id)",
+}
+
+
+# Superseded by a wider index that covers the same lookups
+OBSOLETE_INDEXES = ("ix_comments_icon_id",)
+
+
+def add_secondary_indexes(conn):
+    for name, columns in SECONDARY_INDEXES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}"))
+    for name in OBSOLETE_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+RANKING_INDEXES = {
+    "ix_icons_trending_score_id": "icons (trending_score, id)",
+    "ix_icons_candle_count_id": "icons (candle_count, id)",
+    "ix_icons_tradition_id_trending_score_id": "icons (tradition_id, trending_score, id)",
+    "ix_icons_tradition_id_candle_count_id": "icons (tradition_id, candle_count, id)",
+}
+
+
+def add_rankings(conn):
+    if not _has_column(conn, "candles", "lit_at"):
+        # Existing candles keep a NULL lit_at: when they were lit is unknown
+        column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE candles ADD COLUMN lit_at {column_type}"))
+
+    added = not _has_column(conn, "icons", "trending_score")
+    if added:
+        column_type = Double().compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE icons ADD COLUMN trending_score {column_type} NOT NULL DEFAULT 0"))
+    for name, columns in RANKING_INDEXES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}"))
+
+    if added:
+        rebuild_trending(conn)
+
+
+# Existing icons are hashed by `python manage.py hash-images`
+def add_icon_image_hash(conn):
+    if not _has_column(conn, "icons", "image_hash"):
+        column_type = BigInteger().compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE icons ADD COLUMN image_hash {column_type}"))
+
+
+def add_user_renamed_at(conn):
+    if not _has_column(conn, "users", "renamed_at"):
+        column_type = DateTime(timezone=True).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE users ADD COLUMN renamed_at {column_type}"))
+
+
+# The icon_deletions table itself comes from create_all; icons deleted before
+# it existed never get a tombstone. The index is on an expression, which the
+# inspector doesn't report, so it is created with IF NOT EXISTS.
+def add_catalog_sync_index(conn):
+    index = next(i for i in Icon.__table__.indexes if i.name == "ix_icons_changed_at_id")
+    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def create_search_index(conn):
+    get_search_backend(conn).create_schema(conn)
+    if conn.execute(text("SELECT 1 FROM icon_search LIMIT 1")).first() is None:
+        rebuild_index(Session(bind=conn))
+
+
+# Steps that add columns come before create_search_index, which loads whole
+# Icon rows through the ORM and so needs every mapped column to exist
+MIGRATIONS = [
+    add_icon_counters,
+    add_icon_updated_at,
+    add_icon_derivatives,
+    add_icon_status,
+    add_saint_normalized_name,
+    add_secondary_indexes,
+    add_icon_activity_at,
+    add_rankings,
+    add_icon_image_hash,
+    add_user_renamed_at,
+    add_catalog_sync_index,
+    create_search_index,
+]
+
+
+def migrate(engine):
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for step in MIGRATIONS:
+            step(conn)
+    # add_saint_normalized_name may have merged saints away
+    invalidate_saints()
@@ -1,8 +1,17 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text, ForeignKey, Table, DateTime, func
+from sqlalchemy import JSON, BigInteger, Boolean, Column, Double, Index, Integer, String, Text, ForeignKey, Table, DateTime, case, func
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
 
+# Timestamps written with func.now(). SQLite keeps them as CURRENT_TIMESTAMP
+# text ("YYYY-MM-DD HH:MM:SS"); bound values (keyset cursors) are written the
+# same way there, or a row would never compare equal to its own timestamp.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(timezone=True, storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 # Many-to-many relationship table between icons and saints
 icon_saints = Table(
     "icon_saints",
@@ -15,7 +24,11 @@ candles = Table(
     "candles",
     Base.metadata,
     Column("icon_id", Integer, ForeignKey("icons.id"), primary_key=True),
-    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True)
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    # Lets rankings.py take back exactly what lighting the candle added
+    Column("lit_at", Timestamp, server_default=func.now()),
+    # The primary key serves icon -> users lookups; this serves a user's venerated icons
+    Index("ix_candles_user_id_icon_id", "user_id", "icon_id")
 )
 
 class Tradition(Base):
@@ -27,6 +40,8 @@ class Saint(Base):
     __tablename__ = "saints"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
+    # saints.normalize_saint_name(name); the unique key used to match form input
+    normalized_name = Column(String(255), unique=True)
     feast_day = Column(String(50))
 
     icons = relationship("Icon", secondary=icon_saints, back_populates="saints")
@@ -40,8 +55,29 @@ class Icon(Base):
     region = Column(String(100))
     iconographer = Column(String(255))
     description = Column(Text)
+    # Denormalized so listings never have to touch candles/comments just to count them
+    candle_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Time-decayed activity, maintained with the counters (see rankings.py)
+    trending_score = Column(Double, nullable=False, default=0, server_default="0")
+    # Bumped explicitly by edits to the icon itself (not by candles or comments)
+    updated_at = Column(Timestamp, server_default=func.now())
+    # Bumped with the counters whenever a candle or comment changes
+    activity_at = Column(Timestamp, server_default=func.now(), index=True)
+    # Downscaled copies of image_url, see images.py. Null for icons not yet processed.
+    derivatives = Column(JSON)
+    # "pending" until an upload worker claims it ("processing", see ingest.py),
+    # then "ready" once the image is stored (or "failed")
+    status = Column(String(20), nullable=False, default="ready", server_default="ready", index=True)
+    processing_error = Column(Text)
+    # When the current "processing" claim was taken
+    claimed_at = Column(DateTime(timezone=True))
+    # Claims taken so far, counted here so every process enforces UPLOAD_MAX_ATTEMPTS
+    upload_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Perceptual hash of the uploaded image (images.image_hash), for duplicate detection
+    image_hash = Column(BigInteger)
 
-    tradition_id = Column(Integer, ForeignKey("traditions.id"))
+    tradition_id = Column(Integer, ForeignKey("traditions.id"), index=True)
     tradition = relationship("Tradition")
     user_id = Column(Integer, ForeignKey("users.id"))
     creator = relationship("User", back_populates="icons")
@@ -49,7 +85,44 @@ class Icon(Base):
 
     venerators = relationship("User", secondary=candles, back_populates="candled_icons")
     saints = relationship("Saint", secondary=icon_saints, back_populates="icons")
-    
+
+    __table_args__ = (
+        # A user's uploads, newest first, without a sort
+        Index("ix_icons_user_id_id", "user_id", "id"),
+        # Incremental catalog sync (GET /api/icons?updated_since=...)
+        Index("ix_icons_updated_at_id", "updated_at", "id"),
+        # Trending and most venerated rankings, overall and per tradition
+        Index("ix_icons_trending_score_id", "trending_score", "id"),
+        Index("ix_icons_candle_count_id", "candle_count", "id"),
+        Index("ix_icons_tradition_id_trending_score_id", "tradition_id", "trending_score", "id"),
+        Index("ix_icons_tradition_id_candle_count_id", "tradition_id", "candle_count", "id"),
+    )
+
+    # URL of one derivative, falling back to the original when it's missing
+    def image_variant(self, name: str, fmt: str = "jpeg") -> str:
+        entry = (self.derivatives or {}).get(name)
+        return entry[fmt] if entry and entry.get(fmt) else self.image_url
+
+    # `srcset` attribute value over every derivative in one format ("" if none)
+    def image_srcset(self, fmt: str = "jpeg") -> str:
+        entries = sorted((self.derivatives or {}).values(), key=lambda e: e["width"])
+        return ", ".join(f"{e[fmt]} {e['width']}w" for e in entries if e.get(fmt))
+
+
+# Last change the catalog sync feed shows (see catalog.py): edits move
+# updated_at, candles and comments move activity_at along with the counts
+icon_changed_at = case((Icon.activity_at > Icon.updated_at, Icon.activity_at), else_=Icon.updated_at)
+Index("ix_icons_changed_at_id", icon_changed_at, Icon.id)
+
+# Icons deleted, with when, so sync clients can drop their copies
+icon_deletions = Table(
+    "icon_deletions",
+    Base.metadata,
+    Column("icon_id", Integer, primary_key=True),
+    Column("deleted_at", Timestamp, nullable=False, server_default=func.now()),
+    Index("ix_icon_deletions_deleted_at_icon_id", "deleted_at", "icon_id")
+)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
@@ -57,6 +130,8 @@ class User(Base):
     display_name = Column(String, nullable=False)
     email = Column(String, nullable=False)
     hashed_pw = Column(String(255), nullable=False)
+    # Last display-name change, for the validators of pages that show it (see http_cache.py)
+    renamed_at = Column(Timestamp)
     mod_rank_id = Column(Integer, ForeignKey("mod_ranks.id"), nullable=False)
     # Relationships
     icons = relationship("Icon", back_populates="creator")
@@ -73,14 +148,38 @@ class ModRank(Base):
     description = Column(Text, nullable=False)
     users = relationship("User", back_populates="mod_rank")
 
+# Each icon's most similar icons, best first, precomputed by related.py.
+# Derived data with no foreign keys: deleting an icon never waits on it, and
+# readers join icons and skip neighbors that are gone or no longer ready.
+icon_neighbors = Table(
+    "icon_neighbors",
+    Base.metadata,
+    Column("icon_id", Integer, primary_key=True),
+    Column("rank", Integer, primary_key=True),
+    Column("neighbor_id", Integer, nullable=False),
+    Column("score", Double, nullable=False),
+    # Finds the lists that mention an icon when it changes
+    Index("ix_icon_neighbors_neighbor_id", "neighbor_id")
+)
+
+# Last time something happened that leaves no stamp on any icon row
+# (see http_cache.py); one row per kind of event
+class ChangeStamp(Base):
+    __tablename__ = "change_stamps"
+    name = Column(String(50), primary_key=True)
+    changed_at = Column(DateTime(timezone=True), nullable=False)
+
 class Comment(Base):
     __tablename__ = "comments"
     id = Column(Integer, primary_key=True)
     text = Column(Text, nullable=False)
     # Foreign Keys
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     icon_id = Column(Integer, ForeignKey("icons.id"))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+
+    # An icon's thread newest first; also serves plain icon_id lookups
+    __table_args__ = (Index("ix_comments_icon_id_created_at_id", "icon_id", "created_at", "id"),)
     # Relationships
     author = relationship("User", back_populates="comments")
     icon = relationship("Icon", back_populates="comments")
@@ -0,0 +1,338 @@
+import asyncio
+import base64
+import json
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import metrics
+from card_cache import MemoryLRU
+from config import PAGE_CACHE_BACKEND, PAGE_CACHE_MEMORY_BYTES, PAGE_CACHE_STALE, PAGE_CACHE_TTL, PAGE_CACHE_URL
+from database import AsyncSessionLocal
+from http_cache import not_modified
+
+# Rendered-response cache for anonymous traffic (the home feed and icon pages).
+# Entries are keyed on the path plus the handler's normalized parameters and
+# carry tags naming what they show: "icon:<id>" for every icon on the page,
+# "user:<id>" for every user named on it and "catalog" for listings whose
+# membership can change.
+#
+# Invalidation bumps a global sequence number and stamps each tag with it. An
+# entry remembers the sequence read *before* it was rendered and is discarded
+# once any of its tags carries a newer one, so a write that races a render can
+# never be hidden by it.
+#
+# Within PAGE_CACHE_TTL an entry is served as is; for PAGE_CACHE_STALE seconds
+# after that it is still served while one background render replaces it.
+# Concurrent misses for the same key in a process share a single render.
+# Lookups and renders happen on the event loop; invalidation may come from
+# any thread (ingest workers commit on their own).
+#
+# Entries are stored as JSON with the body base64-encoded. The Redis service
+# may be shared, so nothing read back from it is ever unpickled.
+
+logger = logging.getLogger(__name__)
+
+ALL_TAG = "all"
+CATALOG_TAG = "catalog"
+
+# How long a request waits on another request's render before doing its own
+RENDER_WAIT = 10
+
+# Response headers worth replaying from the cache
+STORED_HEADERS = ("content-type", "etag", "last-modified", "cache-control", "vary")
+
+
+def icon_tag(icon_id: int) -> str:
+    return f"icon:{icon_id}"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+# Cache key for a page: its path plus the parameters the handler actually uses,
+# sorted, with unset values dropped. Unknown query parameters never reach the
+# key, so they can't be used to fill the cache with copies of one page.
+def page_key(request: Request, **params) -> str:
+    used = sorted((name, value) for name, value in params.items() if value not in (None, ""))
+    return f"{request.url.path}?{urlencode(used)}"
+
+
+# Default backend: entries in a byte-bounded LRU, tag stamps in a dict
+class MemoryBackend:
+    errors = ()
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.entries = MemoryLRU(max_bytes)
+        self._tags: dict[str, int] = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        return self.entries.get(key)
+
+    def put(self, key: str, data: bytes, ttl: float):
+        self.entries.put(key, data)
+
+    def sequence(self) -> int:
+        return self._sequence
+
+    def newest(self, tags) -> int:
+        with self._lock:
+            return max((self._tags.get(tag, 0) for tag in tags), default=0)
+
+    def bump(self, tags):
+        with self._lock:
+            self._sequence += 1
+            for tag in tags:
+                self._tags[tag] = self._sequence
+
+
+# A Redis (or Redis-compatible) service on the host, shared by every worker
+# process so an invalidation in one is seen by all
+class RedisBackend:
+    PREFIX = "pages:"
+    blocking = True
+
+    # Stamp every tag with one fresh sequence number atomically, so concurrent
+    # bumps can't leave a tag holding the older of two numbers
+    BUMP_SCRIPT = """
+    local sequence = redis.call('INCR', KEYS[1])
+    for i = 2, #KEYS do
+        redis.call('SET', KEYS[i], sequence)
+    end
+    return sequence
+    """
+
+    def __init__(self, url: str):
+        # Optional dependency, only needed when this backend is configured
+        import redis
+
+        self.errors = (redis.RedisError,)
+        self.client = redis.Redis.from_url(url)
+        self._bump = self.client.register_script(self.BUMP_SCRIPT)
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(f"{self.PREFIX}page:{key}")
+
+    def put(self, key: str, data: bytes, ttl: float):
+        self.client.set(f"{self.PREFIX}page:{key}", data, ex=max(1, int(ttl)))
+
+    def sequence(self) -> int:
+        return int(self.client.get(f"{self.PREFIX}sequence") or 0)
+
+    def newest(self, tags) -> int:
+        values = self.client.mget([f"{self.PREFIX}tag:{tag}" for tag in tags])
+        return max((int(v) for v in values if v is not None), default=0)
+
+    def bump(self, tags):
+        self._bump(keys=[f"{self.PREFIX}sequence", *(f"{self.PREFIX}tag:{tag}" for tag in tags)])
+
+
+def _dump_entry(entry: dict) -> bytes:
+    return json.dumps({**entry, "body": base64.b64encode(entry["body"]).decode("ascii")}).encode()
+
+
+# The entry stored as `data`, or None if it can't be read (e.g. written by an
+# older version)
+def _load_entry(data: bytes) -> dict | None:
+    try:
+        entry = json.loads(data)
+        entry["body"] = base64.b64decode(entry["body"], validate=True)
+    except (ValueError, TypeError, KeyError):
+        return None
+    return entry
+
+
+class PageCache:
+    def __init__(self, backend, ttl: float, stale: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._refreshes: set[asyncio.Task] = set()
+        self.counters = {"hits": 0, "stale_hits": 0, "shared_renders": 0, "misses": 0, "refreshes": 0, "backend_errors": 0}
+
+    # Memory lookups run inline; a network backend is called off the event loop
+    async def _io(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    # The stored entry for `key` if no tag on it has been invalidated since
+    async def _load(self, key: str) -> dict | None:
+        data = await self._io(self.backend.get, key)
+        if data is None:
+            return None
+        entry = _load_entry(data)
+        if entry is None:
+            return None
+        if await self._io(self.backend.newest, entry["tags"]) > entry["sequence"]:
+            return None
+        return entry
+
+    # Await `render(db)` -> (response, tags) and store a successful result
+    async def _render(self, key: str, render, db) -> Response:
+        try:
+            sequence = await self._io(self.backend.sequence)
+        except self.backend.errors:
+            sequence = None
+        response, tags = await render(db)
+        if response.status_code == 200 and sequence is not None:
+            entry = {
+                "sequence": sequence,
+                "stored_at": time.time(),
+                "tags": (ALL_TAG, *tags),
+                "headers": {k: v for k, v in response.headers.items() if k in STORED_HEADERS},
+                "body": bytes(response.body),
+            }
+            try:
+                await self._io(self.backend.put, key, _dump_entry(entry), self.ttl + self.stale)
+            except self.backend.errors as e:
+                self.counters["backend_errors"] += 1
+                logger.warning("Could not store %s in the page cache: %s", key, e)
+        return response
+
+    def _respond(self, request: Request, entry: dict, state: str) -> Response:
+        headers = entry["headers"]
+        last_modified = parsedate_to_datetime(headers["last-modified"]) if "last-modified" in headers else None
+        response = None
+        if "etag" in headers:
+            response = not_modified(request, headers["etag"], last_modified)
+        if response is None:
+            response = Response(content=entry["body"], headers=headers)
+        response.headers["X-Cache"] = state
+        return response
+
+    def _refresh_in_background(self, key: str, render):
+        if key in self._inflight:
+            return
+        done = self._inflight[key] = asyncio.get_running_loop().create_future()
+        self.counters["refreshes"] += 1
+
+        async def refresh():
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self._render(key, render, db)
+            except Exception:
+                logger.exception("Background render of %s failed", key)
+            finally:
+                del self._inflight[key]
+                done.set_result(None)
+
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    # Serve `key` from the cache, rendering it with `await render(db)` when
+    # needed. `render` must build the page for an anonymous viewer and may be
+    # called later from a background task with its own session.
+    async def serve(self, request: Request, key: str, render, db) -> Response:
+        try:
+            entry = await self._load(key)
+        except self.backend.errors as e:
+            self.counters["backend_errors"] += 1
+            logger.warning("Page cache unavailable, rendering %s directly: %s", key, e)
+            return (await render(db))[0]
+
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age <= self.ttl:
+                self.counters["hits"] += 1
+                return self._respond(request, entry, "HIT")
+            if age <= self.ttl + self.stale:
+                self.counters["stale_hits"] += 1
+                self._refresh_in_background(key, render)
+                return self._respond(request, entry, "STALE")
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters["shared_renders"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), RENDER_WAIT)
+                entry = await self._load(key)
+            except (asyncio.TimeoutError, *self.backend.errors):
+                entry = None
+            if entry is not None:
+                return self._respond(request, entry, "HIT")
+            # The other render failed or is too slow; do our own without storing
+            return (await render(db))[0]
+
+        self.counters["misses"] += 1
+        done = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self._render(key, render, db)
+        finally:
+            del self._inflight[key]
+            done.set_result(None)
+        response.headers["X-Cache"] = "MISS"
+        return response
+
+    # Drop every entry carrying any of `tags`. Safe to call from any thread;
+    # with the redis backend it is one round trip to the local service, which
+    # commits on the event loop (after_commit below) hand to a worker thread.
+    def invalidate(self, *tags: str):
+        if self.backend.blocking:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                loop.run_in_executor(None, self._bump, tags)
+                return
+        self._bump(tags)
+
+    def _bump(self, tags):
+        try:
+            self.backend.bump(tags)
+        except self.backend.errors as e:
+            self.counters["backend_errors"] += 1
+            logger.warning("Page cache invalidation of %s failed: %s", tags, e)
+
+    def clear(self):
+        self.invalidate(ALL_TAG)
+
+    def stats(self) -> dict:
+        lookups = sum(self.counters[k] for k in ("hits", "stale_hits", "shared_renders", "misses"))
+        return {
+            **self.counters,
+            "hit_ratio": round((lookups - self.counters["misses"]) / lookups, 3) if lookups else None,
+            "inflight": len(self._inflight),
+        }
+
+
+BACKENDS = {
+    "memory": lambda: MemoryBackend(PAGE_CACHE_MEMORY_BYTES),
+    "redis": lambda: RedisBackend(PAGE_CACHE_URL),
+}
+
+page_cache = PageCache(BACKENDS[PAGE_CACHE_BACKEND](), PAGE_CACHE_TTL, PAGE_CACHE_STALE)
+
+metrics.Counter(
+    "page_cache_events_total", "Page cache lookups, refreshes and backend errors", ("event",),
+    collect=lambda: {(name,): value for name, value in page_cache.counters.items()},
+)
+
+
+# Invalidate `tags` once the session's transaction commits, for writes made
+# deep inside a transaction (counters) where the caller owns the commit
+def invalidate_on_commit(db: Session, *tags: str):
+    db.info.setdefault("page_cache_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    tags = session.info.pop("page_cache_tags", None)
+    if tags:
+        page_cache.invalidate(*tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted(session):
+    session.info.pop("page_cache_tags", None)
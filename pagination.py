@@ -0,0 +1,62 @@
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+# Keep client supplied page sizes within sane bounds
+def clamp_page_size(limit: int | None) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# Fetch one newest-first page of `query` keyed on a unique, indexed integer column.
+# Rows strictly below `before` are returned, so page N costs the same as page 1.
+# Returns the rows and the cursor for the next page (None on the last page).
+def keyset_page(query, column, before: int | None, limit: int):
+    if before is not None:
+        query = query.filter(column < before)
+
+    # One extra row tells us whether another page exists without a COUNT(*)
+    rows = query.order_by(column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], column.key)
+
+
+# Opaque cursor holding a row's sort value and id
+def encode_cursor(value, row_id: int) -> str:
+    raw = f"{value.isoformat() if isinstance(value, datetime) else repr(value)}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# (sort value, id) from encode_cursor, the value parsed as `value_type`.
+# Raises ValueError for anything that isn't such a cursor.
+def decode_cursor(cursor: str, value_type) -> tuple:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    value, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+    parse = datetime.fromisoformat if value_type is datetime else value_type
+    return parse(value), int(row_id)
+
+
+# Like keyset_page, but newest-first on a non-unique column (e.g. a timestamp
+# or a score) with the unique id column as tie-breaker, matching an index on
+# (..., sort, id). The cursor carries the last row's sort value as well as its
+# id, so a page starts where the previous one ended even if that row's value
+# has changed or the row is gone since. Malformed cursors raise ValueError.
+def keyset_page_by(query, sort_column, id_column, before: str | None, limit: int):
+    if before is not None:
+        value, row_id = decode_cursor(before, sort_column.type.python_type)
+        query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < row_id)))
+
+    rows = query.order_by(sort_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], sort_column.key), getattr(rows[-1], id_column.key))
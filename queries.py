@@ -0,0 +1,72 @@
+from sqlalchemy import exists, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, selectinload
+from models import Comment, Icon, candles
+from pagination import keyset_page_by
+
+# Loader options for the icon views, so each endpoint issues a fixed
+# number of statements instead of lazy-loading relationships in templates.
+# Many-to-one relationships are joined into the main query; collections are
+# fetched with one SELECT ... IN per relationship. Traditions come from the
+# in-memory reference data instead (see reference.py).
+
+# /icon/{id} and the metadata behind /api/icon/{id} and the bot: saints and
+# uploader (the page's comments are paged separately)
+ICON_DETAIL = (
+    joinedload(Icon.creator),
+    selectinload(Icon.saints),
+)
+
+
+def load_icon(db, icon_id: int, profile=(), ready_only: bool = False) -> Icon | None:
+    query = db.query(Icon).options(*profile).filter(Icon.id == icon_id)
+    return (query.filter(Icon.status == "ready") if ready_only else query).first()
+
+
+# Icons a user uploaded, for keyset_page on Icon.id (served by ix_icons_user_id_id)
+def user_uploads(db, user_id: int, ready_only: bool = True):
+    query = db.query(Icon).filter(Icon.user_id == user_id)
+    return query.filter(Icon.status == "ready") if ready_only else query
+
+
+# Icons a user lit a candle for, for keyset_page on Icon.id (served by ix_candles_user_id_icon_id)
+def user_venerated(db, user_id: int):
+    return (
+        db.query(Icon)
+        .join(candles, candles.c.icon_id == Icon.id)
+        .filter(candles.c.user_id == user_id, Icon.status == "ready")
+    )
+
+
+# One newest-first page of an icon's comments with their authors, keyed on
+# ix_comments_icon_id_created_at_id
+def comment_page(db, icon_id: int, before: str | None, limit: int):
+    query = db.query(Comment).options(joinedload(Comment.author)).filter(Comment.icon_id == icon_id)
+    return keyset_page_by(query, Comment.created_at, Comment.id, before, limit)
+
+
+# Primary-key probe on candles instead of loading icon.venerators
+def has_venerated(db, user_id: int, icon_id: int) -> bool:
+    return db.query(
+        exists().where(candles.c.icon_id == icon_id, candles.c.user_id == user_id)
+    ).scalar()
+
+
+# Which of `icon_ids` the user has lit a candle for, in one query
+def venerated_among(db, user_id: int, icon_ids) -> set[int]:
+    if not icon_ids:
+        return set()
+    return set(db.execute(
+        select(candles.c.icon_id).where(candles.c.user_id == user_id, candles.c.icon_id.in_(icon_ids))
+    ).scalars())
+
+
+INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+# INSERT ... ON CONFLICT DO NOTHING on the columns of a unique key
+def insert_or_ignore(bind, table, index_elements: list[str]):
+    return INSERTS[bind.dialect.name](table).on_conflict_do_nothing(index_elements=index_elements)
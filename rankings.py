@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, select
+from config import TRENDING_HALF_LIFE_HOURS
+from models import Comment, Icon, candles
+from pagination import keyset_page, keyset_page_by
+
+# Icon rankings, kept current by the counter updates in counters.py instead of
+# being recomputed from candles and comments:
+#   trending   activity with exponential time decay; a candle or comment
+#              counts half as much after every TRENDING_HALF_LIFE_HOURS
+#   venerated  all-time candles (Icon.candle_count)
+#
+# Decaying every score as time passes would rewrite the whole table. Instead
+# an event at time t adds weight * 2 ** ((t - EPOCH) / half-life) to
+# Icon.trending_score. Later events weigh exponentially more, which orders
+# icons exactly as decaying all earlier ones would, and each event is a single
+# additive UPDATE. Reversals (an extinguished candle, a deleted comment)
+# subtract what their event added at its own time; candles remember when they
+# were lit for that.
+#
+# Stored scores double every half-life after EPOCH and a double holds about
+# 1000 doublings (over five years at 48 hours). Move EPOCH forward and run
+# `python manage.py rebuild-rankings` well before then, and after changing the
+# half-life or weights.
+#
+# Both rankings are read from (score, id) indexes, overall and per tradition,
+# one keyset page at a time.
+
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+CANDLE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+
+# Orders offered by the home feed and the ranking API
+SORTS = ("newest", "trending", "venerated")
+
+_HALF_LIFE_SECONDS = TRENDING_HALF_LIFE_HOURS * 3600
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; they are stored in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+# What an event of `weight` at `at` (default: now) adds to trending_score
+def trend_points(weight: float, at: datetime | None = None) -> float:
+    at = _as_utc(at) if at is not None else datetime.now(timezone.utc)
+    return weight * 2 ** ((at - EPOCH).total_seconds() / _HALF_LIFE_SECONDS)
+
+
+# A stored trending_score decayed to now, in candles lit just now
+def current_trend(score: float) -> float:
+    return score / trend_points(1.0)
+
+
+def clean_sort(sort: str | None) -> str:
+    return sort if sort in SORTS else "newest"
+
+
+# One page of `query` (already filtered) in the given order. Newest-first
+# cursors are the last icon's id; ranked ones also carry its score (see
+# pagination.keyset_page_by). Raises ValueError for a malformed cursor.
+def ranked_page(query, sort: str, before: str | None, limit: int):
+    if sort == "trending":
+        return keyset_page_by(query, Icon.trending_score, Icon.id, before, limit)
+    if sort == "venerated":
+        return keyset_page_by(query, Icon.candle_count, Icon.id, before, limit)
+    return keyset_page(query, Icon.id, int(before) if before is not None else None, limit)
+
+
+# Recompute every trending score from candle and comment history. Candles lit
+# before lit_at existed count as lit at EPOCH, i.e. hardly at all.
+def rebuild_trending(bind, batch_size: int = 1000) -> int:
+    scores: dict[int, float] = {}
+    for icon_id, lit_at in bind.execute(select(candles.c.icon_id, candles.c.lit_at)):
+        scores[icon_id] = scores.get(icon_id, 0.0) + trend_points(CANDLE_WEIGHT, lit_at or EPOCH)
+    for icon_id, created_at in bind.execute(select(Comment.icon_id, Comment.created_at)):
+        scores[icon_id] = scores.get(icon_id, 0.0) + trend_points(COMMENT_WEIGHT, created_at or EPOCH)
+
+    table = Icon.__table__
+    bind.execute(table.update().values(trending_score=0))
+    stmt = table.update().where(table.c.id == bindparam("icon_id")).values(trending_score=bindparam("score"))
+    rows = [{"icon_id": icon_id, "score": score} for icon_id, score in scores.items()]
+    for start in range(0, len(rows), batch_size):
+        bind.execute(stmt, rows[start:start + batch_size])
+    return len(rows)
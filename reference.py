@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from database import SessionLocal
+from models import ModRank, Tradition
+
+# In-memory snapshot of small, rarely changing lookup tables (traditions and
+# mod ranks) so page renders don't query them. Loaded in the app lifespan,
+# reloaded after admin writes via refresh(), and at most REFERENCE_MAX_AGE
+# seconds stale for writes made by another process (e.g. manage.py).
+# Every reload bumps `version`, which callers can use to key derived caches.
+# In the web process keep_fresh() reloads ahead of expiry on a worker thread.
+#
+# Lookups made on an event loop thread (handlers, including the ORM helpers
+# they run through AsyncSession.run_sync, and the bot) never reload there:
+# that would block every request on a sync database call and on this lock.
+# They serve the snapshot they have and start the reload on a worker thread,
+# so at worst one lookup sees stale data. Lookups on other threads reload
+# inline as before.
+#
+# A lookup for an unknown id or name may mean a row was added since the last
+# load, so it reloads, but at most once per MISS_RELOAD_INTERVAL: a dangling
+# tradition_id (SQLite doesn't enforce the foreign key) is looked up for every
+# row rendered, and must not turn each of those into a reload. Rows added in
+# between are picked up by that later reload or by keep_fresh().
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_MAX_AGE = 300
+
+# Shortest time between two reloads caused by lookup misses
+MISS_RELOAD_INTERVAL = 30
+
+
+@dataclass(frozen=True, slots=True)
+class TraditionRef:
+    id: int
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class ModRankRef:
+    id: int
+    name: str
+    description: str
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    version: int
+    loaded_at: float
+    traditions: tuple[TraditionRef, ...]
+    traditions_by_id: dict
+    mod_ranks: tuple[ModRankRef, ...]
+    mod_ranks_by_name: dict
+
+
+# Served on the event loop before the first load has finished
+EMPTY = Snapshot(
+    version=0, loaded_at=float("-inf"), traditions=(), traditions_by_id={}, mod_ranks=(), mod_ranks_by_name={},
+)
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ReferenceData:
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._snapshot: Snapshot | None = None
+        self._lock = threading.Lock()
+        self._reloading = False
+
+    def _build(self, db, version: int) -> Snapshot:
+        traditions = tuple(TraditionRef(t.id, t.name) for t in db.query(Tradition).order_by(Tradition.id))
+        mod_ranks = tuple(ModRankRef(r.id, r.name, r.description) for r in db.query(ModRank).order_by(ModRank.id))
+        return Snapshot(
+            version=version,
+            loaded_at=time.monotonic(),
+            traditions=traditions,
+            traditions_by_id={t.id: t for t in traditions},
+            mod_ranks=mod_ranks,
+            mod_ranks_by_name={r.name: r for r in mod_ranks},
+        )
+
+    # Reload from the database, using `db` if given (e.g. right after an admin
+    # write). With `min_age`, a snapshot younger than that is kept instead, so
+    # concurrent callers share one reload.
+    def refresh(self, db=None, min_age: float | None = None) -> Snapshot:
+        with self._lock:
+            snapshot = self._snapshot
+            if min_age is not None and snapshot is not None and time.monotonic() - snapshot.loaded_at < min_age:
+                return snapshot
+            version = self._snapshot.version + 1 if self._snapshot else 1
+            if db is not None:
+                self._snapshot = self._build(db, version)
+            else:
+                with SessionLocal() as own_db:
+                    self._snapshot = self._build(own_db, version)
+            return self._snapshot
+
+    async def keep_fresh(self):
+        while True:
+            await asyncio.sleep(self.max_age / 2)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                logger.exception("Reloading reference data failed")
+
+    # Reload on a worker thread, from the event loop; one at a time
+    def _refresh_in_background(self, min_age: float):
+        if self._reloading:
+            return
+        self._reloading = True
+
+        def reload():
+            try:
+                self.refresh(min_age=min_age)
+            except Exception:
+                logger.exception("Reloading reference data failed")
+            finally:
+                self._reloading = False
+
+        asyncio.get_running_loop().run_in_executor(None, reload)
+
+    # Reload unless one happened within `min_age`, without blocking an event loop
+    def _reload(self, min_age: float) -> Snapshot:
+        if not _on_event_loop():
+            return self.refresh(min_age=min_age)
+        self._refresh_in_background(min_age)
+        return self._snapshot or EMPTY
+
+    def snapshot(self) -> Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > self.max_age:
+            snapshot = self._reload(self.max_age)
+        return snapshot
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def traditions(self) -> tuple[TraditionRef, ...]:
+        return self.snapshot().traditions
+
+    # After a lookup miss: a reload, unless there was one very recently
+    def _reload_for_miss(self) -> Snapshot:
+        return self._reload(MISS_RELOAD_INTERVAL)
+
+    # Icons reference traditions by foreign key, so an unknown id usually means
+    # one was added since the last load
+    def tradition(self, tradition_id: int | None) -> TraditionRef | None:
+        if tradition_id is None:
+            return None
+        tradition = self.snapshot().traditions_by_id.get(tradition_id)
+        if tradition is None:
+            tradition = self._reload_for_miss().traditions_by_id.get(tradition_id)
+        return tradition
+
+    def tradition_name(self, tradition_id: int | None, default: str = "Unknown") -> str:
+        tradition = self.tradition(tradition_id)
+        return tradition.name if tradition else default
+
+    def mod_rank(self, name: str) -> ModRankRef | None:
+        rank = self.snapshot().mod_ranks_by_name.get(name)
+        if rank is None:
+            rank = self._reload_for_miss().mod_ranks_by_name.get(name)
+        return rank
+
+
+reference = ReferenceData(REFERENCE_MAX_AGE)
@@ -0,0 +1,201 @@
+from datetime import timedelta
+from sqlalchemy import delete, func, insert, select
+from http_cache import latest, touch_stamp
+from models import ChangeStamp, Icon, candles, icon_neighbors, icon_saints
+from page_cache import icon_tag, page_cache
+
+# "Related icons", precomputed by an offline job (`python manage.py related`)
+# into icon_neighbors so pages, the API and the bot read them with one
+# primary-key range lookup.
+#
+# Each ready icon is a sparse vector over the users who lit a candle for it
+# and the saints it depicts. A user or saint shared by many icons says little
+# about any two of them, so columns are weighted down by how many icons use
+# them (1 / log(2 + icons)), and saints carry SAINT_WEIGHT on top. Rows are
+# L2-normalized, so one sparse product gives cosine similarity, and each icon
+# keeps its NEIGHBORS best matches scoring at least MIN_SCORE.
+#
+# Runs are incremental. The job stores the newest icon stamp it has seen
+# (updated_at for edits and saint changes, activity_at for candles) in the
+# RELATED_ICONS change stamp. Next time only icons stamped since then (less
+# RESCAN) are "changed", and only these lists are recomputed:
+#   - the changed icons' own lists
+#   - lists naming a changed icon or one that was deleted or unpublished
+#   - lists a changed icon now scores high enough to enter (at least their
+#     lowest stored score, or MIN_SCORE while they have room)
+# Column weights also drift as users and saints gain icons, which moves
+# scores between icons that did not change themselves. Only lists recomputed
+# for the reasons above pick that up, so run with `--full` now and then (e.g.
+# nightly) to recompute everything.
+# Icon pages put the related icons they show in their ETags (related_stamps),
+# so only pages whose list changed revalidate after a run.
+
+RELATED_ICONS = "related_icons"
+
+NEIGHBORS = 12
+SAINT_WEIGHT = 2.0
+MIN_SCORE = 0.05
+
+# Writes take their timestamp before they commit, so one can become visible
+# after a run that already saw newer stamps. Icons stamped this long before
+# the last run are looked at again.
+RESCAN = timedelta(minutes=5)
+
+# Related icons shown on an icon page and in its metadata
+SHOWN = 6
+
+# Lists recomputed per similarity product and write
+CHUNK_SIZE = 256
+
+# Invalidating more icon pages than this clears the page cache instead
+MAX_INVALIDATED_TAGS = 1000
+
+
+# An icon's related icons, best first, skipping any no longer ready
+def related_icons(db, icon_id: int, limit: int = SHOWN) -> list[Icon]:
+    return (
+        db.query(Icon)
+        .join(icon_neighbors, icon_neighbors.c.neighbor_id == Icon.id)
+        .filter(icon_neighbors.c.icon_id == icon_id, Icon.status == "ready")
+        .order_by(icon_neighbors.c.rank)
+        .limit(limit)
+        .all()
+    )
+
+
+# (id, updated_at) of the related icons an icon's page shows, for its validators
+def related_stamps(db, icon_id: int, limit: int = SHOWN) -> tuple:
+    rows = db.execute(
+        select(Icon.id, Icon.updated_at)
+        .join(icon_neighbors, icon_neighbors.c.neighbor_id == Icon.id)
+        .where(icon_neighbors.c.icon_id == icon_id, Icon.status == "ready")
+        .order_by(icon_neighbors.c.rank)
+        .limit(limit)
+    )
+    return tuple(tuple(row) for row in rows)
+
+
+# Column index and weight for each (row, feature) pair
+def _weighted_columns(np, rows, features):
+    if not len(rows):
+        return np.zeros(0, dtype=np.int64), np.zeros(0), 0
+    _, columns, uses = np.unique(features, return_inverse=True, return_counts=True)
+    return columns, 1 / np.log(2 + uses[columns]), len(uses)
+
+
+# L2-normalized icon x (users + saints) CSR matrix, rows numbered by `position`
+def _feature_matrix(db, np, sparse, position: dict):
+    blocks = []
+    for table, feature, weight in ((candles, candles.c.user_id, 1.0), (icon_saints, icon_saints.c.saint_id, SAINT_WEIGHT)):
+        pairs = [(position[icon_id], value) for icon_id, value in db.execute(select(table.c.icon_id, feature)) if icon_id in position]
+        rows = np.array([row for row, _ in pairs], dtype=np.int64)
+        columns, weights, width = _weighted_columns(np, rows, np.array([value for _, value in pairs], dtype=np.int64))
+        blocks.append((rows, columns, weights * weight, width))
+
+    offset, rows, columns, weights = 0, [], [], []
+    for block_rows, block_columns, block_weights, width in blocks:
+        rows.append(block_rows)
+        columns.append(block_columns + offset)
+        weights.append(block_weights)
+        offset += width
+
+    matrix = sparse.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(len(position), offset),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (sparse.diags(scale) @ matrix).tocsr()
+
+
+# Icons whose stored lists name any of `icon_ids`
+def _lists_naming(db, icon_ids: list[int]) -> set[int]:
+    found = set()
+    for start in range(0, len(icon_ids), CHUNK_SIZE):
+        found.update(db.execute(
+            select(icon_neighbors.c.icon_id).where(icon_neighbors.c.neighbor_id.in_(icon_ids[start:start + CHUNK_SIZE])).distinct()
+        ).scalars())
+    return found
+
+
+# Positions of icons that at least one changed icon would now enter the list of
+def _entered(db, np, matrix, changed: list[int], position: dict):
+    floor = np.full(matrix.shape[0], MIN_SCORE)
+    room = np.ones(matrix.shape[0], dtype=bool)
+    for icon_id, lowest, count in db.execute(
+        select(icon_neighbors.c.icon_id, func.min(icon_neighbors.c.score), func.count()).group_by(icon_neighbors.c.icon_id)
+    ):
+        if icon_id in position and count >= NEIGHBORS:
+            floor[position[icon_id]] = max(lowest, MIN_SCORE)
+            room[position[icon_id]] = False
+
+    best = np.zeros(matrix.shape[0])
+    for start in range(0, len(changed), CHUNK_SIZE):
+        scores = matrix[changed[start:start + CHUNK_SIZE]] @ matrix.T
+        best = np.maximum(best, scores.max(axis=0).toarray().ravel())
+    best[changed] = 0
+    return set(np.flatnonzero((best >= floor) | (room & (best >= MIN_SCORE))).tolist())
+
+
+# Recompute stale related-icon lists (all of them with full=True) and commit.
+# Returns counts for the caller to report.
+def refresh_related(db, full: bool = False) -> dict:
+    # Only this job needs NumPy/SciPy; the web app just reads icon_neighbors
+    import numpy as np
+    from scipy import sparse
+
+    since = None if full else db.execute(select(ChangeStamp.changed_at).where(ChangeStamp.name == RELATED_ICONS)).scalar()
+    since = latest(since)
+
+    stamps = db.execute(select(Icon.id, Icon.updated_at, Icon.activity_at).where(Icon.status == "ready").order_by(Icon.id)).all()
+    ids = np.array([row.id for row in stamps], dtype=np.int64)
+    position = {icon_id: i for i, icon_id in enumerate(ids.tolist())}
+    changed_at = [latest(row.updated_at, row.activity_at) for row in stamps]
+    watermark = latest(*changed_at)
+
+    # Lists of deleted or unpublished icons go, and lists naming them are stale
+    ready = select(Icon.id).where(Icon.status == "ready")
+    purged = db.execute(delete(icon_neighbors).where(icon_neighbors.c.icon_id.not_in(ready))).rowcount
+    stale = set(db.execute(select(icon_neighbors.c.icon_id).where(icon_neighbors.c.neighbor_id.not_in(ready)).distinct()).scalars())
+
+    cutoff = since - RESCAN if since is not None else None
+    changed = [i for i, at in enumerate(changed_at) if cutoff is None or at is None or at >= cutoff]
+    affected = set(changed) | {position[icon_id] for icon_id in stale if icon_id in position}
+    matrix = _feature_matrix(db, np, sparse, position) if len(ids) else None
+
+    if since is not None and changed:
+        affected.update(_entered(db, np, matrix, changed, position))
+        affected.update(position[icon_id] for icon_id in _lists_naming(db, ids[changed].tolist()) if icon_id in position)
+
+    order = sorted(affected)
+    stored = 0
+    for start in range(0, len(order), CHUNK_SIZE):
+        chunk = order[start:start + CHUNK_SIZE]
+        scores = (matrix[chunk] @ matrix.T).tocsr()
+        batch = []
+        for offset, row in enumerate(chunk):
+            lo, hi = scores.indptr[offset], scores.indptr[offset + 1]
+            columns, values = scores.indices[lo:hi], scores.data[lo:hi]
+            keep = (columns != row) & (values >= MIN_SCORE)
+            columns, values = columns[keep], values[keep]
+            # Best score first, lower id first among ties
+            best = np.lexsort((ids[columns], -values))[:NEIGHBORS]
+            batch.extend(
+                {"icon_id": int(ids[row]), "rank": rank, "neighbor_id": int(ids[columns[i]]), "score": float(values[i])}
+                for rank, i in enumerate(best)
+            )
+        db.execute(delete(icon_neighbors).where(icon_neighbors.c.icon_id.in_(ids[chunk].tolist())))
+        if batch:
+            db.execute(insert(icon_neighbors), batch)
+        stored += len(batch)
+
+    if watermark is not None and watermark != since:
+        touch_stamp(db, RELATED_ICONS, watermark)
+    db.commit()
+
+    if len(affected) > MAX_INVALIDATED_TAGS:
+        page_cache.clear()
+    elif affected:
+        page_cache.invalidate(*(icon_tag(int(ids[row])) for row in affected))
+
+    return {"icons": len(ids), "changed": len(changed), "refreshed": len(affected), "neighbors": stored, "purged": purged}
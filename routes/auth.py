@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Request, Form, status, Depends
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 import bcrypt
 from dependencies import get_db, get_current_user
-from models import ModRank, User
+from models import User
+from reference import reference
 from fastapi.templating import Jinja2Templates
 
 router = APIRouter()
@@ -14,16 +17,17 @@ DEFAULT_MOD_RANK_NAME = "Catechumen"
 
 #Render the login form
 @router.get("/login")
-def login_form(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+async def login_form(request: Request):
+    return templates.TemplateResponse(request, "login.html")
 
 #Handle login form submission
 @router.post("/login")
-def login_user(request: Request, db: Session = Depends(get_db), username: str = Form(...), password: str = Form(...)):
-    user = db.query(User).filter(User.username == username).first()
+async def login_user(request: Request, db: AsyncSession = Depends(get_db), username: str = Form(...), password: str = Form(...)):
+    user = await db.scalar(select(User).where(User.username == username))
     
-    if not user or not bcrypt.checkpw(password.encode("utf-8"), user.hashed_pw.encode("utf-8")):
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"}, status_code=401)
+    # bcrypt is deliberately slow, so it runs on the threadpool rather than the event loop
+    if not user or not await run_in_threadpool(bcrypt.checkpw, password.encode("utf-8"), user.hashed_pw.encode("utf-8")):
+        return templates.TemplateResponse(request, "login.html", {"error": "Invalid credentials"}, status_code=401)
 
     request.session["user_id"] = user.id
     return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
@@ -31,29 +35,32 @@ def login_user(request: Request, db: Session = Depends(get_db), username: str =
 
 #Render the signup form
 @router.get("/signup")
-def signup_form(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request})
+async def signup_form(request: Request):
+    return templates.TemplateResponse(request, "signup.html")
 
 
 #Handle signup form submission
 @router.post("/signup")
-def signup_user(request: Request, db: Session = Depends(get_db), username: str = Form(...), displayname: str = Form(...), email: str = Form(...), password: str = Form(...)):
+async def signup_user(request: Request, db: AsyncSession = Depends(get_db), username: str = Form(...), displayname: str = Form(...), email: str = Form(...), password: str = Form(...)):
     import re
     if not re.fullmatch("^[a-zA-Z0-9_]*$", username):
-        return templates.TemplateResponse("signup.html", {"request": request, "error": "Username must be alphanumeric"})
+        return templates.TemplateResponse(request, "signup.html", {"error": "Username must be alphanumeric"})
 
-    if db.query(User).filter(User.username == username).first():
-        return templates.TemplateResponse("signup.html", {"request": request, "error": "Username already taken"}, status_code=409)
+    if await db.scalar(select(User.id).where(User.username == username)):
+        return templates.TemplateResponse(request, "signup.html", {"error": "Username already taken"}, status_code=409)
 
-    default_rank = db.query(ModRank).filter(ModRank.name == DEFAULT_MOD_RANK_NAME).first()
+    # On a worker thread a missing rank is reloaded before giving up, which
+    # lookups on the event loop don't wait for (see reference.py)
+    default_rank = await run_in_threadpool(reference.mod_rank, DEFAULT_MOD_RANK_NAME)
     if not default_rank:
         return templates.TemplateResponse(
+            request,
             "signup.html",
-            {"request": request, "error": "Signup is temporarily unavailable. Please try again shortly."},
+            {"error": "Signup is temporarily unavailable. Please try again shortly."},
             status_code=503,
         )
 
-    hashed_pw = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    hashed_pw = (await run_in_threadpool(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())).decode("utf-8")
     new_user = User(
         username=username,
         display_name=displayname,
@@ -62,11 +69,11 @@ def signup_user(request: Request, db: Session = Depends(get_db), username: str =
         mod_rank_id=default_rank.id,
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return RedirectResponse("/login", status_code=302)
 
 #Handle logout
 @router.get("/logout")
-def logout(request: Request):
+async def logout(request: Request):
     request.session.clear()
     return RedirectResponse("/", status_code=303)
@@ -0,0 +1,70 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from catalog import changed_since, export_csv, export_ndjson, export_row, parse_fields
+from dependencies import get_db
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, clamp_page_size
+from services import get_icons_metadata
+
+router = APIRouter()
+
+EXPORT_FORMATS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+}
+
+
+# Batched lookup (?ids=3,1,2) or incremental sync (?updated_since=<ISO 8601>&after=<cursor>).
+# Sync pages are ordered oldest change first, with the ids of deleted icons in
+# "deleted"; keep passing next_cursor until it is null, then start the next
+# sync from that page's synced_until.
+@router.get("/api/icons")
+async def icons_api(db: AsyncSession = Depends(get_db), ids: str = Query(None), updated_since: datetime = Query(None), after: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE), fields: str = Query(None)):
+    if ids is not None:
+        try:
+            icon_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+        except ValueError:
+            return JSONResponse({"error": "ids must be comma separated integers"}, status_code=422)
+        if len(icon_ids) > MAX_PAGE_SIZE:
+            return JSONResponse({"error": f"At most {MAX_PAGE_SIZE} ids per request"}, status_code=422)
+        return {"icons": await db.run_sync(get_icons_metadata, icon_ids)}
+
+    try:
+        selected = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    def page(db):
+        icons, deleted, next_cursor, synced_until = changed_since(db, updated_since, after, clamp_page_size(limit))
+        return {
+            "icons": [export_row(icon, selected) for icon in icons],
+            "deleted": deleted,
+            "next_cursor": next_cursor,
+            "synced_until": synced_until.isoformat() if synced_until else None,
+        }
+
+    try:
+        return await db.run_sync(page)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=422)
+
+
+# Whole catalog as NDJSON (default) or CSV, streamed in constant memory.
+# ?fields=id,title,... picks columns; see catalog.EXPORT_FIELDS.
+# The generators read through the sync engine, which Starlette iterates on its
+# threadpool, so a long export never holds the event loop.
+@router.get("/api/icons/export")
+async def export_api(format: str = Query("ndjson"), fields: str = Query(None)):
+    if format not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}, status_code=422)
+    try:
+        selected = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+
+    generate, media_type = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        generate(selected),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="icons.{format}"'}
+    )
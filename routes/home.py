@@ -1,47 +1,132 @@
-from fastapi import APIRouter, Request, Query, Depends
+from fastapi import APIRouter, Request, Query, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.templating import Jinja2Templates
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from dependencies import get_db, get_current_user, HTMLResponse, RedirectResponse
+from dependencies import current_user, get_db, get_current_user, HTMLResponse, RedirectResponse
 from models import Icon, Saint, Tradition, User, Comment
+from counters import adjust_comment_count
+from http_cache import cache_headers, catalog_stamps, latest, make_etag, not_modified
+from page_cache import CATALOG_TAG, icon_tag, page_cache, page_key
+from pagination import DEFAULT_PAGE_SIZE, clamp_page_size
+from queries import venerated_among
+from rankings import clean_sort, current_trend, ranked_page
+from reference import reference
+from search import filter_field
+from services import icon_card
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
-# Home page with optional filters for saint, tradition, century, and region
-@router.get("/", response_class=HTMLResponse)
-def home(request: Request, db: Session = Depends(get_db), saint: str = Query(None), tradition_id: int = Query(0), century: str = Query(None), region: str = Query(None)):
-    query = db.query(Icon)
-    user = get_current_user(request, db)
-
+# Apply the sidebar filters shared by the HTML feed and its JSON variant.
+# Text filters are answered from the search index rather than ILIKE scans.
+def filter_icons(db: Session, query, saint: str = None, tradition_id: int = 0, century: str = None, region: str = None):
+    query = query.filter(Icon.status == "ready")
     if tradition_id > 0:
         query = query.filter(Icon.tradition_id == tradition_id)
     if saint:
-        query = query.join(Icon.saints).filter(Saint.name.ilike(f"%{saint}%"))
+        query = filter_field(db, query, "saints", saint)
     if century:
-        query = query.filter(Icon.century.ilike(f"%{century}%"))
+        query = filter_field(db, query, "century", century)
     if region:
-        query = query.filter(Icon.region.ilike(f"%{region}%"))
+        query = filter_field(db, query, "region", region)
+    return query
 
-    icons = query.all()
-    traditions = db.query(Tradition).all()
+# Listing pages are invalidated by catalog changes and by any icon they show
+def _listing_tags(icons) -> tuple:
+    return (CATALOG_TAG, *(icon_tag(icon.id) for icon in icons))
 
-    return templates.TemplateResponse("index.html", {
-        "request": request,
+def _home_page(db: Session, request: Request, user, filters: dict, sort: str, before: str | None, limit: int, stamps=None):
+    stamps = stamps or catalog_stamps(db)
+    query = filter_icons(db, db.query(Icon), **filters)
+    icons, next_cursor = ranked_page(query, sort, before, limit)
+    traditions = reference.traditions()
+    venerated = venerated_among(db, user.id, [icon.id for icon in icons]) if user else set()
+
+    response = templates.TemplateResponse(request, "index.html", {
         "user": user,
         "icons": icons,
+        "venerated": venerated,
         "traditions": traditions,
-        "selected_tradition": str(tradition_id),
-        "saint": saint or "",
-        "century": century or "",
-        "region": region or ""
+        "selected_tradition": str(filters["tradition_id"]),
+        "saint": filters["saint"] or "",
+        "century": filters["century"] or "",
+        "region": filters["region"] or "",
+        "sort": sort,
+        "next_cursor": next_cursor,
+        "next_url": f"?{request.url.include_query_params(before=next_cursor).query}" if next_cursor else None
     })
+    response = cache_headers(response, make_etag(request, *stamps, user=user), latest(*stamps), user)
+    return response, _listing_tags(icons)
 
-@router.post("/comment/{comment_id}/delete")
-def delete_comment(
-    comment_id: int, 
-    request: Request, 
-    db: Session = Depends(get_db)
-):
+def _member_home(db: Session, request: Request, user, filters: dict, sort: str, before: str | None, limit: int):
+    stamps = catalog_stamps(db)
+    cached = not_modified(request, make_etag(request, *stamps, user=user), latest(*stamps), user)
+    if cached:
+        return cached
+    return _home_page(db, request, user, filters, sort, before, limit, stamps)[0]
+
+# Home page with optional filters for saint, tradition, century, and region,
+# newest first or sorted by a ranking (see rankings.py)
+@router.get("/", response_class=HTMLResponse)
+async def home(request: Request, db: AsyncSession = Depends(get_db), saint: str = Query(None), tradition_id: int = Query(0), century: str = Query(None), region: str = Query(None), sort: str = Query("newest"), before: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE)):
+    filters = {"saint": saint, "tradition_id": tradition_id, "century": century, "region": region}
+    sort = clean_sort(sort)
+    limit = clamp_page_size(limit)
+    user = await current_user(request, db)
+
+    # Anonymous visitors all see the same page, so it comes from the page cache
+    try:
+        if user is None:
+            key = page_key(request, **filters, sort=sort, before=before, limit=limit)
+            return await page_cache.serve(request, key, lambda db: db.run_sync(_home_page, request, None, filters, sort, before, limit), db)
+        return await db.run_sync(_member_home, request, user, filters, sort, before, limit)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+def _feed_page(db: Session, request: Request, filters: dict, sort: str, before: str | None, limit: int, trend: bool = False):
+    stamps = catalog_stamps(db)
+    query = filter_icons(db, db.query(Icon), **filters)
+    icons, next_cursor = ranked_page(query, sort, before, limit)
+
+    cards = [icon_card(icon) for icon in icons]
+    if trend:
+        for card, icon in zip(cards, icons):
+            card["trending"] = round(current_trend(icon.trending_score), 3)
+
+    response = cache_headers(JSONResponse({
+        "icons": cards,
+        "next_cursor": next_cursor
+    }), make_etag(request, *stamps), latest(*stamps))
+    return response, _listing_tags(icons)
+
+# JSON page of the home feed for infinite scroll. Nothing in it depends on the
+# viewer, so every request is served through the page cache.
+@router.get("/api/feed")
+async def feed_api(request: Request, db: AsyncSession = Depends(get_db), saint: str = Query(None), tradition_id: int = Query(0), century: str = Query(None), region: str = Query(None), sort: str = Query("newest"), before: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE)):
+    filters = {"saint": saint, "tradition_id": tradition_id, "century": century, "region": region}
+    sort = clean_sort(sort)
+    limit = clamp_page_size(limit)
+    key = page_key(request, **filters, sort=sort, before=before, limit=limit)
+    try:
+        return await page_cache.serve(request, key, lambda db: db.run_sync(_feed_page, request, filters, sort, before, limit), db)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=422)
+
+# Trending (default) or most venerated icons, overall or in one tradition.
+# Each card carries its current trending score in candles lit just now.
+@router.get("/api/trending")
+async def trending_api(request: Request, db: AsyncSession = Depends(get_db), tradition_id: int = Query(0), sort: str = Query("trending"), before: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE)):
+    filters = {"saint": None, "tradition_id": tradition_id, "century": None, "region": None}
+    sort = "venerated" if sort == "venerated" else "trending"
+    limit = clamp_page_size(limit)
+    key = page_key(request, tradition_id=tradition_id, sort=sort, before=before, limit=limit)
+    try:
+        return await page_cache.serve(request, key, lambda db: db.run_sync(_feed_page, request, filters, sort, before, limit, True), db)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=422)
+
+def _delete_comment(db: Session, request: Request, comment_id: int):
     user = get_current_user(request, db)
     if not user:
         raise HTTPException(status_code=401)
@@ -57,6 +142,15 @@ def delete_comment(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     db.delete(comment)
+    adjust_comment_count(db, target_icon_id, -1, comment.created_at)
     db.commit()
     
-    return RedirectResponse(url=f"/icon/{target_icon_id}", status_code=303)
\ No newline at end of file
+    return RedirectResponse(url=f"/icon/{target_icon_id}", status_code=303)
+
+@router.post("/comment/{comment_id}/delete")
+async def delete_comment(
+    comment_id: int, 
+    request: Request, 
+    db: AsyncSession = Depends(get_db)
+):
+    return await db.run_sync(_delete_comment, request, comment_id)
\ No newline at end of file
@@ -1,73 +1,142 @@
-from fastapi import APIRouter, Request, Depends, Form, Query, File, UploadFile
+import asyncio
+from fastapi import APIRouter, Request, Depends, Form, Query, File, UploadFile, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
-import cloudinary
-import cloudinary.uploader
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from dependencies import get_db, get_current_user, HTMLResponse
+from dependencies import current_user, get_db, get_current_user, HTMLResponse
 from models import Icon, Saint, Tradition, User, Comment
+from catalog import record_deletion
+from counters import adjust_comment_count, toggle_candle
+from pagination import MAX_PAGE_SIZE, clamp_page_size
+from queries import ICON_DETAIL, comment_page, has_venerated, load_icon, venerated_among
+from http_cache import ICON_DELETED, cache_headers, icon_stamps, latest, make_etag, not_modified, touch_stamp
+from page_cache import icon_tag, page_cache, page_key, user_tag
+from duplicates import duplicate_finder
+from ingest import create_pending_icon, discard, hash_staged, ingest_queue, stage_upload
+from reference import reference
+from related import related_icons, related_stamps
+from saints import parse_saint_names, resolve_saint_ids, set_icon_saints
+from search import reindex_icon, remove_icon
+from services import get_icon_metadata, invalidate_icon
 
 
 templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
+COMMENT_PAGE_SIZE = 20
+IMAGE_REDIRECT_MAX_AGE = 3600
+# What the status endpoint reports to anyone but the uploader and moderators
+UPLOAD_FAILED_MESSAGE = "Image processing failed"
 
-# Display details for a specific icon
-@router.get("/icon/{icon_id}", response_class=HTMLResponse)
-def icon_detail(request: Request, icon_id: int, db: Session = Depends(get_db)):
-    icon = db.query(Icon).filter(Icon.id == icon_id).first()
-    if not icon:
-        return HTMLResponse(content="Icon not found", status_code=404)
-    
-    user = get_current_user(request, db)
-    return templates.TemplateResponse("icon.html", {
-        "request": request,
+
+def _icon_page(db: Session, request: Request, user, icon_id: int, validators, comments_before: str | None):
+    icon = load_icon(db, icon_id, ICON_DETAIL)
+    comments, comments_cursor = comment_page(db, icon.id, comments_before, COMMENT_PAGE_SIZE)
+    related = related_icons(db, icon.id)
+    response = templates.TemplateResponse(request, "icon.html", {
         "user": user,
         "icon": icon,
-        "uploader_name": db.query(User).filter(User.id == icon.user_id).first().display_name    
+        "comments": comments,
+        "comments_cursor": comments_cursor,
+        "tradition": reference.tradition(icon.tradition_id),
+        "venerated": bool(user) and has_venerated(db, user.id, icon.id),
+        "uploader_name": icon.creator.display_name,
+        "related": related
     })
+    # Related icons' titles and images are on the page too, and so are the
+    # names of the uploader and the commenters shown
+    users = {icon.user_id, *(comment.user_id for comment in comments)}
+    tags = (icon_tag(icon_id), *(icon_tag(other.id) for other in related), *(user_tag(u) for u in users if u is not None))
+    return cache_headers(response, *validators, user), tags
+
+# (etag, last_modified) for an icon page, or None if the icon doesn't exist
+def _icon_validators(db: Session, request: Request, user, icon_id: int):
+    stamps = icon_stamps(db, icon_id)
+    if not stamps:
+        return None
+    related = related_stamps(db, icon_id)
+    return make_etag(request, *stamps, related, user=user), latest(*stamps, *related)
+
+def _anonymous_icon_page(db: Session, request: Request, icon_id: int, comments_before: str | None):
+    validators = _icon_validators(db, request, None, icon_id)
+    if validators is None:
+        return HTMLResponse(content="Icon not found", status_code=404), ()
+    return _icon_page(db, request, None, icon_id, validators, comments_before)
+
+def _member_icon_page(db: Session, request: Request, user, icon_id: int, comments_before: str | None):
+    # Revalidations are answered from the stamps before loading anything else
+    validators = _icon_validators(db, request, user, icon_id)
+    if validators is None:
+        return HTMLResponse(content="Icon not found", status_code=404)
+    cached = not_modified(request, *validators, user)
+    if cached:
+        return cached
+    return _icon_page(db, request, user, icon_id, validators, comments_before)[0]
 
-# FastAPI JSON endpoint for bot
+# Display details for a specific icon
+@router.get("/icon/{icon_id}", response_class=HTMLResponse)
+async def icon_detail(request: Request, icon_id: int, db: AsyncSession = Depends(get_db), comments_before: str = Query(None)):
+    user = await current_user(request, db)
+
+    # Anonymous visitors are served from the page cache
+    try:
+        if user is None:
+            key = page_key(request, comments_before=comments_before)
+            return await page_cache.serve(request, key, lambda db: db.run_sync(_anonymous_icon_page, request, icon_id, comments_before), db)
+        return await db.run_sync(_member_icon_page, request, user, icon_id, comments_before)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+def _icon_api(db: Session, request: Request, icon_id: int):
+    stamps = icon_stamps(db, icon_id)
+    # Pending and failed uploads aren't published
+    if not stamps or stamps.status != "ready":
+        return JSONResponse({"error": "Not found"}, status_code=404)
+
+    # Candles and comments aren't part of the payload, so activity_at isn't
+    # either; of the users, only the uploader is
+    related = related_stamps(db, icon_id)
+    etag = make_etag(request, stamps.updated_at, stamps.status, stamps.uploader_renamed_at, related)
+    last_modified = latest(stamps.updated_at, stamps.uploader_renamed_at, *related)
+    cached = not_modified(request, etag, last_modified)
+    if cached:
+        return cached
+
+    data = get_icon_metadata(db, icon_id)
+    if data is None:
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    return cache_headers(JSONResponse(data), etag, last_modified)
+
+# JSON metadata for one icon (the bot reads the same data in-process)
 @router.get("/api/icon/{icon_id}")
-def icon_api(icon_id: int, db: Session = Depends(get_db)):
-    icon = db.query(Icon).filter(Icon.id == icon_id).first()
-    if not icon:
-        return {"error": "Not found"}, 404
-    
-    return {
-        "title": icon.title,
-        "saints": [s.name for s in icon.saints],
-        "tradition": icon.tradition.name,
-        "century": icon.century,
-        "region": icon.region,
-        "iconographer": icon.iconographer or "Unknown",
-        "uploader": db.query(User).filter(User.id == icon.user_id).first().display_name,
-        "image_url": icon.image_url,
-        "description": icon.description
-    }
-
+async def icon_api(request: Request, icon_id: int, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_icon_api, request, icon_id)
 
 
-@router.get("/icon/{icon_id}/image")
-def serve_icon_image(icon_id: int, db: Session = Depends(get_db)):
+def _serve_icon_image(db: Session, icon_id: int):
     icon = db.query(Icon).filter(Icon.id == icon_id).first()
     if not icon:
         return JSONResponse({"error": "Icon not found"}, status_code=404)
-    
-    return RedirectResponse(url=icon.image_url)
 
-@router.post("/icon/{icon_id}/delete")
-def delete_icon(
-    icon_id: int, 
-    db: Session = Depends(get_db), 
-    request: Request = None # Needed to get session user
-    ):
+    response = RedirectResponse(url=icon.image_url)
+    # Stored images are content addressed, so the target only changes while pending
+    response.headers["Cache-Control"] = f"public, max-age={IMAGE_REDIRECT_MAX_AGE}" if icon.status == "ready" else "no-cache"
+    return response
+
+@router.get("/icon/{icon_id}/image")
+async def serve_icon_image(icon_id: int, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_serve_icon_image, icon_id)
+
+def _delete_icon(db: Session, request: Request, icon_id: int):
     user = get_current_user(request, db)
     if not user:
         raise HTTPException(status_code=401)
 
     icon = db.query(Icon).filter(Icon.id == icon_id).first()
-    
+
     if not icon:
         raise HTTPException(status_code=404)
 
@@ -75,12 +144,23 @@ def delete_icon(
     if icon.user_id != user.id and not user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    remove_icon(db, icon.id)
+    record_deletion(db, icon.id)
     db.delete(icon)
+    touch_stamp(db, ICON_DELETED)
     db.commit()
+    invalidate_icon(icon_id)
     return {"status": "success"}
 
-@router.get("/icon/{icon_id}/edit", response_class=HTMLResponse)
-def edit_icon_form(request: Request, icon_id: int, db: Session = Depends(get_db)):
+@router.post("/icon/{icon_id}/delete")
+async def delete_icon(
+    icon_id: int,
+    db: AsyncSession = Depends(get_db),
+    request: Request = None # Needed to get session user
+    ):
+    return await db.run_sync(_delete_icon, request, icon_id)
+
+def _edit_icon_form(db: Session, request: Request, icon_id: int):
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
@@ -93,21 +173,18 @@ def edit_icon_form(request: Request, icon_id: int, db: Session = Depends(get_db)
     if icon.user_id != user.id and not user.is_admin:
         return HTMLResponse(content="Not authorized", status_code=403)
 
-    traditions = db.query(Tradition).all()
-    return templates.TemplateResponse("edit_icon.html", {
-        "request": request,
+    traditions = reference.traditions()
+    return templates.TemplateResponse(request, "edit_icon.html", {
         "user": user,
         "icon": icon,
         "traditions": traditions
     })
-    
-@router.post("/icon/{icon_id}/comment")
-async def add_comment(
-    icon_id: int, 
-    request: Request, 
-    text: str = Form(...), 
-    db: Session = Depends(get_db)
-):
+
+@router.get("/icon/{icon_id}/edit", response_class=HTMLResponse)
+async def edit_icon_form(request: Request, icon_id: int, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_edit_icon_form, request, icon_id)
+
+def _add_comment(db: Session, request: Request, icon_id: int, text: str):
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
@@ -117,46 +194,98 @@ async def add_comment(
         user_id=user.id,
         icon_id=icon_id
     )
-    
+
     db.add(new_comment)
+    if adjust_comment_count(db, icon_id, 1) is None:
+        db.rollback()
+        return HTMLResponse(content="Icon not found", status_code=404)
     db.commit()
-    
-    # Redirect back to the icon page to see the new comment
-    return RedirectResponse(url=f"/icon/{icon_id}", status_code=303)
 
-@router.post("/icon/{icon_id}/venerate")
-async def toggle_veneration(icon_id: int, request: Request, db: Session = Depends(get_db)):
+    # Without JavaScript the form posts normally; send the browser back to the icon
+    if request.headers.get("x-requested-with") != "fetch":
+        return RedirectResponse(url=f"/icon/{icon_id}", status_code=303)
+
+    # The script prepends just the new comment to the thread
+    db.refresh(new_comment)
+    return templates.TemplateResponse(request, "_comment.html", {
+        "user": user,
+        "comment": new_comment
+    }, status_code=201)
+
+@router.post("/icon/{icon_id}/comment")
+async def add_comment(
+    icon_id: int,
+    request: Request,
+    text: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
+    return await db.run_sync(_add_comment, request, icon_id, text)
+
+def _comments_api(db: Session, request: Request, icon_id: int, before: str | None, limit: int):
+    user = get_current_user(request, db)
+    comments, next_cursor = comment_page(db, icon_id, before, clamp_page_size(limit))
+
+    return {
+        "comments": [{
+            "id": comment.id,
+            "text": comment.text,
+            "created_at": comment.created_at.isoformat() if comment.created_at else None,
+            "author": {"username": comment.author.username, "display_name": comment.author.display_name},
+            "can_manage": bool(user) and (user.id == comment.user_id or getattr(user, "is_admin", False))
+        } for comment in comments],
+        "next_cursor": next_cursor
+    }
+
+# Older pages of an icon's comments, newest first, for the "Older reflections" button
+@router.get("/api/icon/{icon_id}/comments")
+async def comments_api(request: Request, icon_id: int, db: AsyncSession = Depends(get_db), before: str = Query(None), limit: int = Query(COMMENT_PAGE_SIZE)):
+    try:
+        return await db.run_sync(_comments_api, request, icon_id, before, limit)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=422)
+
+def _toggle_veneration(db: Session, request: Request, icon_id: int):
     user = get_current_user(request, db)
     if not user:
         return JSONResponse({"error": "Login required"}, status_code=401)
 
-    icon = db.query(Icon).filter(Icon.id == icon_id).first()
-    if not icon:
+    try:
+        lit, count = toggle_candle(db, user.id, icon_id)
+    except IntegrityError:
+        # Candle foreign key on a missing icon (databases that enforce it)
+        count = None
+    if count is None:
+        db.rollback()
         return JSONResponse({"error": "Icon not found"}, status_code=404)
 
-    if user in icon.venerators:
-        icon.venerators.remove(user)
-        action = "unlit"
-    else:
-        icon.venerators.append(user)
-        action = "lit"
-
     db.commit()
-    return {"action": action, "count": len(icon.venerators)}
+    return {"action": "lit" if lit else "unlit", "count": count}
 
-@router.post("/icon/{icon_id}/edit", response_class=HTMLResponse)
-def edit_icon(
-    request: Request,
-    icon_id: int,
-    db: Session = Depends(get_db),
-    title: str = Form(...),
-    century: str = Form(None),
-    region: str = Form(None),
-    iconographer: str = Form(None),
-    description: str = Form(None),
-    saints: str = Form(None),  # Comma-separated saint names
-    tradition_id: int = Form(...)
-):
+@router.post("/icon/{icon_id}/venerate")
+async def toggle_veneration(icon_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_toggle_veneration, request, icon_id)
+
+
+def _venerated_api(db: Session, request: Request, ids: str):
+    user = get_current_user(request, db)
+    if not user:
+        return JSONResponse({"error": "Login required"}, status_code=401)
+
+    try:
+        icon_ids = {int(i) for i in ids.split(",") if i.strip()}
+    except ValueError:
+        return JSONResponse({"error": "ids must be comma separated integers"}, status_code=422)
+    if len(icon_ids) > MAX_PAGE_SIZE:
+        return JSONResponse({"error": f"At most {MAX_PAGE_SIZE} ids per request"}, status_code=422)
+
+    return {"venerated": sorted(venerated_among(db, user.id, icon_ids), reverse=True)}
+
+# Which icons on a grid page the current user has lit a candle for, e.g. ?ids=3,2,1
+@router.get("/api/venerated")
+async def venerated_api(request: Request, db: AsyncSession = Depends(get_db), ids: str = Query("")):
+    return await db.run_sync(_venerated_api, request, ids)
+
+def _edit_icon(db: Session, request: Request, icon_id: int, fields: dict, saints: str | None):
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
@@ -169,50 +298,72 @@ def edit_icon(
     if icon.user_id != user.id and not user.is_admin:
         return HTMLResponse(content="Not authorized", status_code=403)
 
-    icon.title = title
-    icon.century = century
-    icon.region = region
-    icon.iconographer = iconographer
-    icon.description = description
-    icon.tradition_id = tradition_id
+    for name, value in fields.items():
+        setattr(icon, name, value)
+    icon.updated_at = func.now()
 
+    db.flush()
     if saints is not None:
-        saint_names = [s.strip() for s in saints.split(",")]
-        new_saints = []
-        for name in saint_names:
-            saint = db.query(Saint).filter(Saint.name == name).first()
-            if not saint:
-                saint = Saint(name=name)
-                db.add(saint)
-                db.commit()
-            new_saints.append(saint)
-        icon.saints = new_saints
+        set_icon_saints(db, icon, resolve_saint_ids(db, parse_saint_names(saints)))
 
+    # Pending uploads are indexed by the ingest worker once their image is stored
+    if icon.status == "ready":
+        reindex_icon(db, icon)
     db.commit()
-    
+    invalidate_icon(icon_id)
+
     return RedirectResponse(url=f"/icon/{icon_id}", status_code=303)
 
+@router.post("/icon/{icon_id}/edit", response_class=HTMLResponse)
+async def edit_icon(
+    request: Request,
+    icon_id: int,
+    db: AsyncSession = Depends(get_db),
+    title: str = Form(...),
+    century: str = Form(None),
+    region: str = Form(None),
+    iconographer: str = Form(None),
+    description: str = Form(None),
+    saints: str = Form(None),  # Comma-separated saint names
+    tradition_id: int = Form(...)
+):
+    fields = {
+        "title": title,
+        "century": century,
+        "region": region,
+        "iconographer": iconographer,
+        "description": description,
+        "tradition_id": tradition_id,
+    }
+    return await db.run_sync(_edit_icon, request, icon_id, fields, saints)
+
 
-#Render the icon upload form
-@router.get("/upload", response_class=HTMLResponse)
-def upload_form(request: Request, db: Session = Depends(get_db)):
+def _upload_form(db: Session, request: Request):
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
-    
-    traditions = db.query(Tradition).all()
-    return templates.TemplateResponse("upload.html", {
-        "request": request,
+
+    traditions = reference.traditions()
+    return templates.TemplateResponse(request, "upload.html", {
         "user": user,
-        "traditions": traditions
+        "traditions": traditions,
+        "form": {}
     })
 
+#Render the icon upload form
+@router.get("/upload", response_class=HTMLResponse)
+async def upload_form(request: Request, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_upload_form, request)
+
 
-#Handle icon upload form submission
+#Handle icon upload form submission.
+#The image is only staged here; ingest workers store it and flip the icon to "ready".
+#Images that look like an existing icon are sent back to the uploader first,
+#unless they confirm it is a different icon.
 @router.post("/upload", response_class=HTMLResponse)
-def upload_icon(
+async def upload_icon(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     title: str = Form(...),
     century: str = Form(None),
     region: str = Form(None),
@@ -220,43 +371,71 @@ def upload_icon(
     description: str = Form(None),
     saints: str = Form(None),  # Comma-separated saint names
     tradition_id: int = Form(...),
-    image_file: UploadFile = File(...)
+    image_file: UploadFile = File(...),
+    allow_duplicate: bool = Form(False)
 ):
-    user = get_current_user(request, db)
+    user = await current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=303)
-    
-    image_file.file.seek(0)
-    upload_result = cloudinary.uploader.upload(image_file.file)
-    image_url = upload_result["secure_url"]
-    
-    # Create new icon
-    new_icon = Icon(
-        title=title,
-        image_url=image_url,
-        century=century,
-        region=region,
-        iconographer=iconographer,
-        description=description,
-        tradition_id=tradition_id,
-        user_id=user.id
-    )
-    
-    if saints:
-        saint_names = [s.strip() for s in saints.split(",")]
-        for name in saint_names:
-            saint = db.query(Saint).filter(Saint.name == name).first()
-            if not saint:
-                saint = Saint(name=name)
-                db.add(saint)
-                db.commit()
-            new_icon.saints.append(saint)
-
-    db.add(new_icon)
-    db.commit()
-    
-    return templates.TemplateResponse("upload_success.html", {
-        "request": request,
+
+    temp_path = await stage_upload(image_file)
+    fields = {
+        "title": title,
+        "century": century,
+        "region": region,
+        "iconographer": iconographer,
+        "description": description,
+        "tradition_id": tradition_id,
+    }
+    try:
+        fields["image_hash"] = await asyncio.to_thread(hash_staged, temp_path)
+        duplicates = []
+        if fields["image_hash"] is not None and not allow_duplicate:
+            duplicates = await db.run_sync(duplicate_finder.find, fields["image_hash"])
+        if duplicates:
+            # Nothing has left the server yet; the form comes back filled in
+            discard(temp_path)
+            traditions = reference.traditions()
+            return templates.TemplateResponse(request, "upload.html", {
+                "user": user,
+                "traditions": traditions,
+                "form": {**fields, "saints": saints},
+                "duplicates": duplicates
+            }, status_code=409)
+
+        new_icon = await db.run_sync(create_pending_icon, temp_path, user.id, fields, parse_saint_names(saints))
+    except BaseException:
+        discard(temp_path)
+        raise
+    ingest_queue.submit(new_icon.id)
+
+    return templates.TemplateResponse(request, "upload_success.html", {
         "user": user,
         "icon": new_icon
     })
+
+
+def _icon_status(db: Session, request: Request, icon_id: int):
+    icon = db.query(Icon).filter(Icon.id == icon_id).first()
+    if not icon:
+        return JSONResponse({"error": "Not found"}, status_code=404)
+
+    # Processing errors can name storage internals, so only the uploader and
+    # moderators see them
+    error = icon.processing_error
+    if error:
+        user = get_current_user(request, db)
+        if not user or (user.id != icon.user_id and not getattr(user, "is_admin", False)):
+            error = UPLOAD_FAILED_MESSAGE
+
+    return {
+        "status": icon.status,
+        "error": error,
+        "attempts": icon.upload_attempts,
+        "image_url": icon.image_variant("thumb") if icon.status == "ready" else None
+    }
+
+# Processing state of an upload, polled by the upload confirmation page
+@router.get("/api/icon/{icon_id}/status")
+async def icon_status(request: Request, icon_id: int, db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(_icon_status, request, icon_id)
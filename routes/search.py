@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dependencies import get_db
+from models import Icon
+from search import search_icons
+
+router = APIRouter()
+
+AUTOCOMPLETE_LIMIT = 8
+
+
+def _search(db: Session, q: str, limit: int, autocomplete: bool):
+    hits, corrected = search_icons(db, q, max(limit, 1), prefix=autocomplete)
+
+    icons = {}
+    if hits:
+        icons = {icon.id: icon for icon in db.query(Icon).filter(Icon.id.in_([icon_id for icon_id, _ in hits]))}
+
+    results = []
+    for icon_id, score in hits:
+        icon = icons.get(icon_id)
+        if not icon:
+            continue
+        if autocomplete:
+            results.append({"id": icon.id, "title": icon.title})
+        else:
+            results.append({
+                "id": icon.id,
+                "title": icon.title,
+                "image_url": icon.image_url,
+                "century": icon.century,
+                "region": icon.region,
+                "candle_count": icon.candle_count,
+                "comment_count": icon.comment_count,
+                "score": round(score, 4)
+            })
+
+    return {"query": q, "corrected_query": corrected, "results": results}
+
+
+# Ranked search across title, saints, region, century, iconographer and description.
+# With autocomplete=true the last word is treated as a prefix and only titles are returned.
+@router.get("/api/search")
+async def search_api(db: AsyncSession = Depends(get_db), q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20), autocomplete: bool = Query(False)):
+    if autocomplete:
+        limit = min(limit, AUTOCOMPLETE_LIMIT)
+    return await db.run_sync(_search, q, limit, autocomplete)
@@ -1,56 +1,108 @@
-from fastapi import APIRouter, Request, Form, Depends
+from fastapi import APIRouter, Request, Form, Depends, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from dependencies import get_db, get_current_user, Session
+from fastapi.responses import HTMLResponse, JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
+from dependencies import get_db, get_current_user, invalidate_user, Session
+from page_cache import page_cache, user_tag
 from models import User, Icon
+from pagination import DEFAULT_PAGE_SIZE, clamp_page_size, keyset_page
+from queries import user_uploads, user_venerated
+from services import icon_card, invalidate_uploader
 
 templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
-# Display user profile with their uploaded icons
-@router.get("/user/{username}", response_class=HTMLResponse)
-def user_profile(request: Request, username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+def _profile_user(request: Request, db: Session, username: str):
+    current_user = get_current_user(request, db)
+    # Viewing your own profile needs no second User lookup
+    if current_user and current_user.username == username:
+        return current_user, current_user
+    return current_user, db.query(User).filter(User.username == username).first()
+
+def _user_profile(db: Session, request: Request, username: str, uploads_before: int, venerated_before: int):
+    current_user, user = _profile_user(request, db, username)
     if not user:
         return HTMLResponse(content="User not found", status_code=404)
+
+    icons, uploads_cursor = keyset_page(user_uploads(db, user.id), Icon.id, uploads_before, DEFAULT_PAGE_SIZE)
+    venerated_icons, venerated_cursor = keyset_page(user_venerated(db, user.id), Icon.id, venerated_before, DEFAULT_PAGE_SIZE)
     
-    venerated_icons = db.query(Icon).filter(Icon.venerators.any(id=user.id)).all()
-    icons = db.query(Icon).filter(Icon.user_id == user.id).all()
-    current_user = get_current_user(request, db)
-    
-    
-    return templates.TemplateResponse("profile.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "profile.html", {
         "user": current_user,
         "profile_user": user,
         "icons": icons,
-        "venerated_icons": venerated_icons
+        "uploads_cursor": uploads_cursor,
+        "venerated_icons": venerated_icons,
+        "venerated_cursor": venerated_cursor
     })
-    
-#Settings page for each user
-@router.get("/settings", response_class=HTMLResponse)
-def user_settings(request: Request, db: Session = Depends(get_db)):
+
+# Display user profile with the first page of their uploads and venerated icons
+@router.get("/user/{username}", response_class=HTMLResponse)
+async def user_profile(request: Request, username: str, db: AsyncSession = Depends(get_db), uploads_before: int = Query(None), venerated_before: int = Query(None)):
+    return await db.run_sync(_user_profile, request, username, uploads_before, venerated_before)
+
+def _user_uploads_api(db: Session, request: Request, username: str, before: int, limit: int):
+    _, user = _profile_user(request, db, username)
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+
+    icons, next_cursor = keyset_page(user_uploads(db, user.id), Icon.id, before, clamp_page_size(limit))
+    return {"icons": [icon_card(icon) for icon in icons], "next_cursor": next_cursor}
+
+# JSON pages of a profile's uploads for the "Load more" button
+@router.get("/api/user/{username}/uploads")
+async def user_uploads_api(request: Request, username: str, db: AsyncSession = Depends(get_db), before: int = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE)):
+    return await db.run_sync(_user_uploads_api, request, username, before, limit)
+
+def _user_venerated_api(db: Session, request: Request, username: str, before: int, limit: int):
+    _, user = _profile_user(request, db, username)
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+
+    icons, next_cursor = keyset_page(user_venerated(db, user.id), Icon.id, before, clamp_page_size(limit))
+    return {"icons": [icon_card(icon) for icon in icons], "next_cursor": next_cursor}
+
+# JSON pages of a profile's venerated icons for the "Load more" button
+@router.get("/api/user/{username}/venerated")
+async def user_venerated_api(request: Request, username: str, db: AsyncSession = Depends(get_db), before: int = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE)):
+    return await db.run_sync(_user_venerated_api, request, username, before, limit)
+
+def _user_settings(db: Session, request: Request, before: int):
     user = get_current_user(request, db)
     if not user:
         return HTMLResponse(content="Unauthorized", status_code=401)
     
-    return templates.TemplateResponse("settings.html", {
-        "request": request,
+    icons, next_cursor = keyset_page(user_uploads(db, user.id, ready_only=False), Icon.id, before, DEFAULT_PAGE_SIZE)
+    return templates.TemplateResponse(request, "settings.html", {
         "user": user,
-        "icons": db.query(Icon).filter(Icon.user_id == user.id).all() # Show user's icons in settings
+        "icons": icons,
+        "next_cursor": next_cursor
     })
-    
-@router.post("/settings/edit/display_name", response_class=HTMLResponse)
-def edit_display_name(request: Request, db: Session = Depends(get_db), new_display_name: str = Form(...)):
+
+#Settings page for each user, with their uploads (including ones still processing) a page at a time
+@router.get("/settings", response_class=HTMLResponse)
+async def user_settings(request: Request, db: AsyncSession = Depends(get_db), before: int = Query(None)):
+    return await db.run_sync(_user_settings, request, before)
+
+def _edit_display_name(db: Session, request: Request, new_display_name: str):
     user = get_current_user(request, db)
     if not user:
         return HTMLResponse(content="Unauthorized", status_code=401)
     
     user.display_name = new_display_name
+    # Only pages naming them (their uploads and icons they commented on)
+    # revalidate; see http_cache.icon_stamps
+    user.renamed_at = func.now()
     db.commit()
-    return templates.TemplateResponse("settings.html", {
-        "request": request,
+    invalidate_user(user.id)
+    invalidate_uploader(db, user.id)
+    page_cache.invalidate(user_tag(user.id))
+    return templates.TemplateResponse(request, "settings.html", {
         "user": user,
         "message": "Display name updated successfully"
     })
-    
+
+@router.post("/settings/edit/display_name", response_class=HTMLResponse)
+async def edit_display_name(request: Request, db: AsyncSession = Depends(get_db), new_display_name: str = Form(...)):
+    return await db.run_sync(_edit_display_name, request, new_display_name)
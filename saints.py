@@ -0,0 +1,92 @@
+import threading
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+from models import Saint, icon_saints
+from queries import insert_or_ignore
+
+# Saint name resolution for the upload and edit forms.
+# Names are matched on a normalized form (trimmed, inner whitespace collapsed,
+# case folded) that carries a unique constraint, so "St. George" and
+# "st.  george" are one saint. A whole list resolves in one IN query; missing
+# names are inserted in one ON CONFLICT DO NOTHING statement so concurrent
+# uploads naming the same new saint can't create duplicates.
+# A process-wide normalized-name -> id map skips the query entirely when every
+# name is already known. Ids only enter it once their transaction commits.
+# The app never renames or deletes saints, so entries stay valid; the one
+# thing that does, the migration folding duplicate names together, clears the
+# map when it runs (other running processes need a restart after it).
+
+_ids: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def normalize_saint_name(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+# Split the comma separated form field, dropping blanks and repeats (first spelling wins)
+def parse_saint_names(raw: str | None) -> list[str]:
+    names = {}
+    for name in (raw or "").split(","):
+        name = " ".join(name.split())
+        if name:
+            names.setdefault(normalize_saint_name(name), name)
+    return list(names.values())
+
+
+def _lookup(db: Session, keys) -> dict[str, int]:
+    rows = db.execute(select(Saint.normalized_name, Saint.id).where(Saint.normalized_name.in_(keys)))
+    return {key: saint_id for key, saint_id in rows}
+
+
+# Ids for `names` in the same order, creating saints that don't exist yet
+# inside the caller's transaction
+def resolve_saint_ids(db: Session, names: list[str]) -> list[int]:
+    spelled = {normalize_saint_name(name): name for name in reversed(names)}
+    keys = [normalize_saint_name(name) for name in names]
+
+    with _lock:
+        found = {key: _ids[key] for key in spelled if key in _ids}
+    missing = [key for key in spelled if key not in found]
+
+    if missing:
+        looked_up = _lookup(db, missing)
+        new = [key for key in missing if key not in looked_up]
+        if new:
+            db.execute(
+                insert_or_ignore(db.get_bind(), Saint, ["normalized_name"]),
+                [{"name": spelled[key], "normalized_name": key} for key in new],
+            )
+            # Picks up rows a concurrent transaction committed first as well as ours
+            looked_up.update(_lookup(db, new))
+        found.update(looked_up)
+        db.info.setdefault("resolved_saints", {}).update(looked_up)
+
+    return list(dict.fromkeys(found[key] for key in keys))
+
+
+# Replace an icon's saints with `saint_ids` without loading either side of the relationship
+def set_icon_saints(db: Session, icon, saint_ids: list[int]):
+    db.execute(delete(icon_saints).where(icon_saints.c.icon_id == icon.id))
+    if saint_ids:
+        db.execute(insert(icon_saints), [{"icon_id": icon.id, "saint_id": saint_id} for saint_id in saint_ids])
+    db.expire(icon, ["saints"])
+
+
+# Forget every cached id, after saints were merged or deleted
+def invalidate_saints():
+    with _lock:
+        _ids.clear()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_resolved(session):
+    resolved = session.info.pop("resolved_saints", None)
+    if resolved:
+        with _lock:
+            _ids.update(resolved)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_resolved(session):
+    session.info.pop("resolved_saints", None)
@@ -0,0 +1,261 @@
+import difflib
+import re
+from sqlalchemy import Column, Integer, MetaData, Table, Text, bindparam, select, text
+from sqlalchemy.orm import Session, selectinload
+from models import Icon
+
+# Ranked full-text search over icons.
+# Each icon is denormalized into an `icon_search` row (title, saint names, region,
+# century, iconographer, description) that the write paths keep current through
+# reindex_icon()/remove_icon(). PostgreSQL indexes it with a weighted tsvector
+# plus pg_trgm, SQLite (local and test runs) with an FTS5 virtual table.
+# The table lives outside Base.metadata because its DDL is dialect specific.
+
+SEARCH_FIELDS = ("title", "saints", "region", "century", "iconographer", "description")
+
+# Sidebar filters that are answered from the search index instead of ILIKE scans
+FILTER_FIELDS = ("saints", "century", "region")
+
+MAX_RESULTS = 50
+
+
+def _terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query.lower())
+
+
+# Flatten an icon (with saints loaded) into the indexed fields
+def icon_document(icon: Icon) -> dict:
+    return {
+        "icon_id": icon.id,
+        "title": icon.title or "",
+        "saints": ", ".join(s.name for s in icon.saints),
+        "region": icon.region or "",
+        "century": icon.century or "",
+        "iconographer": icon.iconographer or "",
+        "description": icon.description or "",
+    }
+
+
+class PostgresSearch:
+    # tsvector for ranked matching, trigram GIN indexes so the sidebar's
+    # substring filters and typo-tolerant matching can use an index
+    table = Table(
+        "icon_search",
+        MetaData(),
+        Column("icon_id", Integer, primary_key=True),
+        *(Column(field, Text) for field in SEARCH_FIELDS),
+        Column("keywords", Text),
+    )
+
+    def create_schema(self, conn):
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS icon_search (
+                icon_id INTEGER PRIMARY KEY REFERENCES icons(id) ON DELETE CASCADE,
+                title TEXT, saints TEXT, region TEXT, century TEXT,
+                iconographer TEXT, description TEXT,
+                keywords TEXT,
+                document TSVECTOR
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_icon_search_document ON icon_search USING gin (document)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_icon_search_keywords_trgm ON icon_search USING gin (keywords gin_trgm_ops)"))
+        for field in FILTER_FIELDS:
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_icon_search_{field}_trgm ON icon_search USING gin ({field} gin_trgm_ops)"
+            ))
+
+    def index_icon(self, conn, doc: dict):
+        keywords = " ".join(doc[f] for f in ("title", "saints", "region", "century", "iconographer"))
+        conn.execute(text("""
+            INSERT INTO icon_search (icon_id, title, saints, region, century, iconographer, description, keywords, document)
+            VALUES (
+                :icon_id, :title, :saints, :region, :century, :iconographer, :description, :keywords,
+                setweight(to_tsvector('simple', :title), 'A') ||
+                setweight(to_tsvector('simple', :saints), 'A') ||
+                setweight(to_tsvector('simple', :region || ' ' || :century || ' ' || :iconographer), 'B') ||
+                setweight(to_tsvector('simple', :description), 'C')
+            )
+            ON CONFLICT (icon_id) DO UPDATE SET
+                title = EXCLUDED.title, saints = EXCLUDED.saints, region = EXCLUDED.region,
+                century = EXCLUDED.century, iconographer = EXCLUDED.iconographer,
+                description = EXCLUDED.description, keywords = EXCLUDED.keywords,
+                document = EXCLUDED.document
+        """), {**doc, "keywords": keywords})
+
+    def remove_icon(self, conn, icon_id: int):
+        conn.execute(text("DELETE FROM icon_search WHERE icon_id = :icon_id"), {"icon_id": icon_id})
+
+    # Substring match served by the field's trigram index
+    def filter_ids(self, field: str, value: str):
+        column = self.table.c[field]
+        return select(self.table.c.icon_id).where(column.icontains(value, autoescape=True))
+
+    # Returns (icon_id, score) pairs and the corrected query (never corrected here:
+    # trigram word similarity already matches misspelt words in the same pass)
+    def search(self, conn, query: str, limit: int, prefix: bool = False):
+        terms = _terms(query)
+        if not terms:
+            return [], None
+
+        tsquery = " & ".join(terms)
+        if prefix:
+            tsquery += ":*"
+
+        rows = conn.execute(text("""
+            SELECT icon_id, ts_rank_cd(document, q) + word_similarity(:raw, keywords) AS score
+            FROM icon_search, to_tsquery('simple', :tsquery) AS q
+            WHERE document @@ q OR :raw <% keywords
+            ORDER BY score DESC, icon_id DESC
+            LIMIT :limit
+        """), {"tsquery": tsquery, "raw": " ".join(terms), "limit": limit}).all()
+        return [(row.icon_id, float(row.score)) for row in rows], None
+
+
+class SqliteSearch:
+    # FTS5 table keyed by rowid = icons.id, plus an fts5vocab view of its terms
+    # that typo correction draws candidate spellings from
+    table = Table(
+        "icon_search",
+        MetaData(),
+        Column("rowid", Integer, primary_key=True),
+        *(Column(field, Text) for field in SEARCH_FIELDS),
+    )
+
+    # bm25 column weights, in SEARCH_FIELDS order
+    WEIGHTS = (10.0, 10.0, 4.0, 4.0, 4.0, 1.0)
+
+    def create_schema(self, conn):
+        conn.execute(text(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS icon_search USING fts5(
+                {", ".join(SEARCH_FIELDS)},
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """))
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS icon_search_vocab USING fts5vocab(icon_search, 'row')"))
+
+    def index_icon(self, conn, doc: dict):
+        self.remove_icon(conn, doc["icon_id"])
+        conn.execute(text(f"""
+            INSERT INTO icon_search (rowid, {", ".join(SEARCH_FIELDS)})
+            VALUES (:icon_id, {", ".join(":" + f for f in SEARCH_FIELDS)})
+        """), doc)
+
+    def remove_icon(self, conn, icon_id: int):
+        conn.execute(text("DELETE FROM icon_search WHERE rowid = :icon_id"), {"icon_id": icon_id})
+
+    @staticmethod
+    def _match(terms: list[str], prefix: bool) -> str:
+        phrases = [f'"{t}"' for t in terms]
+        if prefix:
+            phrases[-1] += "*"
+        return " AND ".join(phrases)
+
+    # Every word of the filter must start a word of the field, e.g. "byz" -> "Byzantium"
+    def filter_ids(self, field: str, value: str):
+        terms = _terms(value)
+        if not terms:
+            return select(self.table.c.rowid)
+        match = " AND ".join(f'"{t}"*' for t in terms)
+        return select(self.table.c.rowid).where(self.table.c[field].op("MATCH")(bindparam(None, match)))
+
+    def _ranked(self, conn, terms: list[str], limit: int, prefix: bool):
+        weights = ", ".join(str(w) for w in self.WEIGHTS)
+        rows = conn.execute(text(f"""
+            SELECT rowid AS icon_id, -bm25(icon_search, {weights}) AS score
+            FROM icon_search
+            WHERE icon_search MATCH :match
+            ORDER BY score DESC, icon_id DESC
+            LIMIT :limit
+        """), {"match": self._match(terms, prefix), "limit": limit}).all()
+        return [(row.icon_id, float(row.score)) for row in rows]
+
+    # Swap unknown words for the closest indexed term sharing their first letter
+    def _correct(self, conn, terms: list[str]) -> list[str]:
+        corrected = []
+        for term in terms:
+            known = conn.execute(
+                text("SELECT 1 FROM icon_search_vocab WHERE term = :term"), {"term": term}
+            ).first()
+            if known:
+                corrected.append(term)
+                continue
+
+            candidates = conn.execute(
+                text("SELECT term FROM icon_search_vocab WHERE term >= :lo AND term < :hi"),
+                {"lo": term[0], "hi": chr(ord(term[0]) + 1)},
+            ).scalars().all()
+            matches = difflib.get_close_matches(term, candidates, n=1, cutoff=0.7)
+            corrected.append(matches[0] if matches else term)
+        return corrected
+
+    def search(self, conn, query: str, limit: int, prefix: bool = False):
+        terms = _terms(query)
+        if not terms:
+            return [], None
+
+        hits = self._ranked(conn, terms, limit, prefix)
+        if hits:
+            return hits, None
+
+        corrected = self._correct(conn, terms)
+        if corrected == terms:
+            return [], None
+        return self._ranked(conn, corrected, limit, prefix), " ".join(corrected)
+
+
+BACKENDS = {
+    "postgresql": PostgresSearch(),
+    "sqlite": SqliteSearch(),
+}
+
+
+def get_search_backend(bind):
+    return BACKENDS[bind.dialect.name]
+
+
+# Keep the index in step with an icon inside the caller's transaction.
+# The icon must be flushed (have an id) and have its saints assigned.
+def reindex_icon(db: Session, icon: Icon):
+    get_search_backend(db.get_bind()).index_icon(db.connection(), icon_document(icon))
+
+
+def remove_icon(db: Session, icon_id: int):
+    get_search_backend(db.get_bind()).remove_icon(db.connection(), icon_id)
+
+
+# Restrict an Icon query to rows whose indexed `field` matches `value`
+def filter_field(db: Session, query, field: str, value: str):
+    backend = get_search_backend(db.get_bind())
+    return query.filter(Icon.id.in_(backend.filter_ids(field, value)))
+
+
+def search_icons(db: Session, query: str, limit: int = 20, prefix: bool = False):
+    backend = get_search_backend(db.get_bind())
+    return backend.search(db.connection(), query, min(limit, MAX_RESULTS), prefix)
+
+
+# Create the index structures and (re)build every document in batches
+def rebuild_index(db: Session, batch_size: int = 500) -> int:
+    backend = get_search_backend(db.get_bind())
+    conn = db.connection()
+    backend.create_schema(conn)
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.query(Icon)
+            .options(selectinload(Icon.saints))
+            .filter(Icon.id > last_id)
+            .order_by(Icon.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return indexed
+        for icon in batch:
+            backend.index_icon(conn, icon_document(icon))
+        indexed += len(batch)
+        last_id = batch[-1].id
@@ -0,0 +1,114 @@
+from sqlalchemy import select
+from cache import TTLCache
+from database import AsyncSessionLocal
+from models import Icon
+from page_cache import CATALOG_TAG, icon_tag, page_cache
+from queries import ICON_DETAIL, load_icon
+from reference import reference
+from related import related_icons
+
+# Read paths shared by the web routes and the Discord bot.
+# The bot reads the database directly instead of calling the public API over
+# HTTP. When it runs as its own worker (botworker.py) edits made through the
+# web app reach its metadata cache after ICON_METADATA_TTL at most.
+
+# Metadata is served slightly stale at most this long after an edit made
+# outside edit_icon/delete_icon and display-name changes (e.g. a tradition
+# renamed by hand)
+ICON_METADATA_TTL = 30
+
+_icon_metadata = TTLCache(ICON_METADATA_TTL)
+# Related icons ([{"id", "title"}]) for single-icon metadata; refreshed out of
+# process by related.py, so only the TTL expires them
+_related = TTLCache(ICON_METADATA_TTL)
+
+
+def icon_metadata(icon: Icon) -> dict:
+    return {
+        "id": icon.id,
+        "title": icon.title,
+        "saints": [s.name for s in icon.saints],
+        "tradition": reference.tradition_name(icon.tradition_id),
+        "century": icon.century,
+        "region": icon.region,
+        "iconographer": icon.iconographer or "Unknown",
+        "uploader": icon.creator.display_name,
+        "image_url": icon.image_url,
+        "card_image_url": icon.image_variant("card"),
+        "description": icon.description,
+        "updated_at": icon.updated_at.isoformat() if icon.updated_at else None
+    }
+
+
+# Card fields the infinite scroll scripts need to render a grid
+def icon_card(icon: Icon) -> dict:
+    return {
+        "id": icon.id,
+        "title": icon.title,
+        "century": icon.century,
+        "image_url": icon.image_variant("thumb"),
+        "srcset": icon.image_srcset("jpeg"),
+        "webp_srcset": icon.image_srcset("webp"),
+        "candle_count": icon.candle_count,
+        "comment_count": icon.comment_count,
+    }
+
+
+# Cached metadata for one published (ready) icon with its related icons, or None
+def get_icon_metadata(db, icon_id: int) -> dict | None:
+    data = _icon_metadata.get(icon_id)
+    if data is None:
+        icon = load_icon(db, icon_id, ICON_DETAIL, ready_only=True)
+        if not icon:
+            return None
+        data = icon_metadata(icon)
+        _icon_metadata.put(icon_id, data)
+
+    related = _related.get(icon_id)
+    if related is None:
+        related = [{"id": other.id, "title": other.title} for other in related_icons(db, icon_id)]
+        _related.put(icon_id, related)
+    return {**data, "related": related}
+
+
+# Cached metadata for many icons in request order, skipping unknown ids and
+# unpublished uploads.
+# Every miss is loaded in the same query.
+def get_icons_metadata(db, icon_ids: list[int]) -> list[dict]:
+    found = {}
+    for icon_id in icon_ids:
+        data = _icon_metadata.get(icon_id)
+        if data is not None:
+            found[icon_id] = data
+
+    missing = [icon_id for icon_id in icon_ids if icon_id not in found]
+    if missing:
+        for icon in db.query(Icon).options(*ICON_DETAIL).filter(Icon.id.in_(missing), Icon.status == "ready"):
+            found[icon.id] = icon_metadata(icon)
+            _icon_metadata.put(icon.id, found[icon.id])
+
+    return [found[icon_id] for icon_id in icon_ids if icon_id in found]
+
+
+# Same as get_icon_metadata for callers on the event loop (the bot); a miss
+# opens its own async session so the loop never blocks on the database
+async def fetch_icon_metadata(icon_id: int) -> dict | None:
+    data, related = _icon_metadata.get(icon_id), _related.get(icon_id)
+    if data is not None and related is not None:
+        return {**data, "related": related}
+
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(get_icon_metadata, icon_id)
+
+
+# Call after committing a display-name change: metadata names the uploader
+def invalidate_uploader(db, user_id: int):
+    for icon_id in db.execute(select(Icon.id).where(Icon.user_id == user_id)).scalars():
+        _icon_metadata.invalidate(icon_id)
+
+
+# Call after committing any change to an icon or its image. Listings are
+# included because edits can move an icon in or out of a filter.
+def invalidate_icon(icon_id: int):
+    _icon_metadata.invalidate(icon_id)
+    page_cache.invalidate(icon_tag(icon_id), CATALOG_TAG)
@@ -0,0 +1,119 @@
+const feed = document.getElementById('icon-feed');
+const loadMore = document.getElementById('load-more');
+let loading = false;
+
+// Keep in step with the sizes attribute on server-rendered cards
+const GRID_SIZES = '(max-width: 600px) 50vw, 300px';
+
+function buildCard(icon) {
+    const card = document.createElement('div');
+    card.className = 'icon-card';
+    card.dataset.iconId = icon.id;
+
+    const link = document.createElement('a');
+    link.href = `/icon/${icon.id}`;
+
+    // Same markup as the server-rendered cards: WebP where supported, JPEG otherwise
+    const picture = document.createElement('picture');
+    if (icon.webp_srcset) {
+        const source = document.createElement('source');
+        source.type = 'image/webp';
+        source.srcset = icon.webp_srcset;
+        source.sizes = GRID_SIZES;
+        picture.appendChild(source);
+    }
+
+    const img = document.createElement('img');
+    img.src = icon.image_url;
+    if (icon.srcset) {
+        img.srcset = icon.srcset;
+        img.sizes = GRID_SIZES;
+    }
+    img.alt = icon.title;
+    img.loading = 'lazy';
+    picture.appendChild(img);
+
+    const title = document.createElement('h3');
+    title.innerText = icon.title;
+
+    const info = document.createElement('div');
+    info.className = 'icon-info';
+    for (const [emoji, value] of [['🕯️', icon.candle_count], ['💬', icon.comment_count]]) {
+        const stat = document.createElement('div');
+        stat.className = emoji === '🕯️' ? 'icon-stat candle-stat' : 'icon-stat';
+        const label = document.createElement('span');
+        label.innerText = emoji;
+        const count = document.createElement('span');
+        count.innerText = value;
+        stat.append(label, count);
+        info.appendChild(stat);
+    }
+
+    link.append(picture, title, info);
+    card.appendChild(link);
+    return card;
+}
+
+// Light the candles the user has already lit on a freshly loaded page, in one request
+async function markVenerated(cards) {
+    if (!feed.dataset.loggedIn || cards.length === 0) {
+        return;
+    }
+    const ids = cards.map(card => card.dataset.iconId).join(',');
+    const response = await fetch(`/api/venerated?ids=${ids}`);
+    if (!response.ok) {
+        return;
+    }
+    const lit = new Set((await response.json()).venerated.map(String));
+    for (const card of cards) {
+        if (lit.has(card.dataset.iconId)) {
+            card.querySelector('.candle-stat').classList.add('candle-lit');
+        }
+    }
+}
+
+async function loadNextPage() {
+    const cursor = feed.dataset.nextCursor;
+    if (loading || !cursor) {
+        return;
+    }
+    loading = true;
+
+    // Keep the sidebar filters from the current page URL
+    const params = new URLSearchParams(window.location.search);
+    params.set('before', cursor);
+
+    try {
+        const response = await fetch(`/api/feed?${params.toString()}`);
+        if (response.ok) {
+            const data = await response.json();
+            const cards = data.icons.map(buildCard);
+            cards.forEach(card => feed.insertBefore(card, loadMore.parentElement));
+            markVenerated(cards);
+            feed.dataset.nextCursor = data.next_cursor || '';
+            if (!data.next_cursor) {
+                observer.disconnect();
+                loadMore.parentElement.remove();
+            }
+        }
+    } catch (error) {
+        console.error('Feed error:', error);
+    } finally {
+        loading = false;
+    }
+}
+
+// Without JavaScript the "Load more" link still pages through the feed
+const observer = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) {
+        loadNextPage();
+    }
+}, { rootMargin: '400px' });
+
+if (loadMore) {
+    loadMore.addEventListener('click', (e) => {
+        e.preventDefault();
+        loadNextPage();
+    });
+    observer.observe(loadMore);
+}
@@ -14,6 +14,106 @@ async function toggleCandle(iconId) {
     }
 }
 
+const commentsList = document.getElementById('comments-list');
+const olderComments = document.getElementById('older-comments');
+const commentForm = document.getElementById('comment-form');
+
+function buildComment(comment) {
+    const card = document.createElement('div');
+    card.className = 'comment-card';
+    card.id = `comment-${comment.id}`;
+
+    const header = document.createElement('div');
+    header.className = 'comment-header';
+    const author = document.createElement('a');
+    author.className = 'comment-author';
+    author.href = `/user/${comment.author.username}`;
+    author.innerText = comment.author.display_name;
+    const date = document.createElement('span');
+    date.className = 'comment-date';
+    date.innerText = new Date(comment.created_at).toLocaleDateString('en-US', { month: 'short', day: '2-digit', year: 'numeric' });
+    header.append(author, date);
+
+    const body = document.createElement('div');
+    body.className = 'comment-body';
+    body.innerText = comment.text;
+    card.append(header, body);
+
+    if (comment.can_manage) {
+        const actions = document.createElement('div');
+        actions.className = 'comment-actions';
+        const editLink = document.createElement('a');
+        editLink.className = 'action-link';
+        editLink.href = `/comment/${comment.id}/edit`;
+        editLink.innerText = 'Edit';
+        const form = document.createElement('form');
+        form.action = `/comment/${comment.id}/delete`;
+        form.method = 'POST';
+        form.onsubmit = () => confirm('Delete this reflection?');
+        const button = document.createElement('button');
+        button.type = 'submit';
+        button.className = 'action-link delete-text';
+        button.innerText = 'Delete';
+        form.appendChild(button);
+        actions.append(editLink, form);
+        card.appendChild(actions);
+    }
+    return card;
+}
+
+// Fetch the next page of older comments instead of reloading the page
+if (olderComments) {
+    let loading = false;
+    olderComments.addEventListener('click', async (e) => {
+        e.preventDefault();
+        const cursor = commentsList.dataset.nextCursor;
+        if (loading || !cursor) {
+            return;
+        }
+        loading = true;
+        try {
+            const response = await fetch(`/api/icon/${commentsList.dataset.iconId}/comments?before=${cursor}`);
+            if (response.ok) {
+                const data = await response.json();
+                data.comments.forEach(comment => commentsList.appendChild(buildComment(comment)));
+                commentsList.dataset.nextCursor = data.next_cursor || '';
+                if (!data.next_cursor) {
+                    olderComments.parentElement.remove();
+                }
+            }
+        } catch (error) {
+            console.error('Comments error:', error);
+        } finally {
+            loading = false;
+        }
+    });
+}
+
+// Post without a full page reload; the server answers with the rendered comment
+if (commentForm) {
+    commentForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        try {
+            const response = await fetch(commentForm.action, {
+                method: 'POST',
+                body: new FormData(commentForm),
+                headers: { 'X-Requested-With': 'fetch' }
+            });
+            if (response.ok) {
+                commentsList.insertAdjacentHTML('afterbegin', await response.text());
+                const count = document.getElementById('comment-count');
+                count.innerText = Number(count.innerText) + 1;
+                commentForm.reset();
+                document.getElementById('char-count').innerText = 1000;
+            } else {
+                alert('Could not post your reflection. Try again.');
+            }
+        } catch (error) {
+            console.error('Comment error:', error);
+        }
+    });
+}
+
 const commentArea = document.getElementById('comment-text');
 const charCount = document.getElementById('char-count');
 const maxLength = 1000;
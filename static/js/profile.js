@@ -0,0 +1,72 @@
+// "Load more" for the uploads and venerated grids on a profile.
+// Without JavaScript the links still page through each section.
+
+function buildProfileCard(icon) {
+    const card = document.createElement('div');
+    card.className = 'icon-card';
+
+    const link = document.createElement('a');
+    link.href = `/icon/${icon.id}`;
+
+    const picture = document.createElement('picture');
+    if (icon.webp_srcset) {
+        const source = document.createElement('source');
+        source.type = 'image/webp';
+        source.srcset = icon.webp_srcset;
+        source.sizes = '(max-width: 600px) 50vw, 300px';
+        picture.appendChild(source);
+    }
+    const img = document.createElement('img');
+    img.src = icon.image_url;
+    if (icon.srcset) {
+        img.srcset = icon.srcset;
+        img.sizes = '(max-width: 600px) 50vw, 300px';
+    }
+    img.alt = icon.title;
+    img.loading = 'lazy';
+    picture.appendChild(img);
+
+    const info = document.createElement('div');
+    info.className = 'icon-info';
+    const title = document.createElement('h3');
+    title.innerText = icon.title;
+    const century = document.createElement('span');
+    century.innerText = icon.century || '';
+    info.append(title, century);
+
+    link.append(picture, info);
+    card.appendChild(link);
+    return card;
+}
+
+document.querySelectorAll('.icon-grid[data-endpoint]').forEach(grid => {
+    const more = grid.parentElement.querySelector('.load-more');
+    if (!more) {
+        return;
+    }
+    let loading = false;
+
+    more.addEventListener('click', async (e) => {
+        e.preventDefault();
+        const cursor = grid.dataset.nextCursor;
+        if (loading || !cursor) {
+            return;
+        }
+        loading = true;
+        try {
+            const response = await fetch(`${grid.dataset.endpoint}?before=${cursor}`);
+            if (response.ok) {
+                const data = await response.json();
+                data.icons.forEach(icon => grid.appendChild(buildProfileCard(icon)));
+                grid.dataset.nextCursor = data.next_cursor || '';
+                if (!data.next_cursor) {
+                    more.parentElement.remove();
+                }
+            }
+        } catch (error) {
+            console.error('Profile error:', error);
+        } finally {
+            loading = false;
+        }
+    });
+});
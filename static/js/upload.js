@@ -0,0 +1,27 @@
+const statusLine = document.getElementById('upload-status');
+const POLL_INTERVAL = 2000;
+
+// Poll until the ingest worker has stored the image (or given up on it)
+async function pollStatus() {
+    try {
+        const response = await fetch(`/api/icon/${statusLine.dataset.iconId}/status`);
+        if (response.ok) {
+            const data = await response.json();
+            if (data.status === 'ready') {
+                statusLine.innerText = 'Image processed.';
+                return;
+            }
+            if (data.status === 'failed') {
+                statusLine.innerText = 'Image processing failed, please try uploading again.';
+                return;
+            }
+        }
+    } catch (error) {
+        console.error('Status error:', error);
+    }
+    setTimeout(pollStatus, POLL_INTERVAL);
+}
+
+if (statusLine && statusLine.dataset.status === 'pending') {
+    setTimeout(pollStatus, POLL_INTERVAL);
+}
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+# The app reads its settings from the environment at import time, so point it
+# at a throwaway SQLite database and local storage before anything imports it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Templates and static files are looked up relative to the working directory
+os.chdir(ROOT)
+
+_scratch = tempfile.mkdtemp(prefix="iconostasis-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_scratch, 'test.db')}",
+    "SECRET_KEY": "test",
+    "IMAGE_STORAGE": "local",
+    "MEDIA_DIR": os.path.join(_scratch, "media"),
+    "UPLOAD_STAGING_DIR": os.path.join(_scratch, "uploads"),
+    "CARD_CACHE_DIR": os.path.join(_scratch, "cards"),
+    "BOT_MODE": "off",
+    "BOT_LOCK_FILE": os.path.join(_scratch, "bot.lock"),
+})
+
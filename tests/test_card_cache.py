@@ -0,0 +1,10 @@
+from card_cache import card_key
+
+CARD = {"title": "Saint George", "tradition": "Byzantine", "uploader": "Anna", "saints": ["George"]}
+
+
+def test_card_key_follows_every_drawn_field():
+    assert card_key(1, dict(CARD)) == card_key(1, dict(reversed(CARD.items())))
+    assert card_key(1, CARD) != card_key(2, CARD)
+    assert card_key(1, CARD) != card_key(1, {**CARD, "uploader": "Anna K."})
+    assert card_key(1, CARD) != card_key(1, {**CARD, "tradition": "Russian"})
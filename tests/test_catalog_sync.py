@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update
+import catalog
+import database
+import services
+from migrations import migrate
+from models import Icon, ModRank, User, icon_deletions
+
+# Stamps well before COMMIT_LAG, so the feed serves them; icons other tests
+# create are stamped now and stay beyond the horizon
+BASE = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> datetime:
+    return BASE + timedelta(minutes=minutes)
+
+
+def sync(since=BASE, limit=100):
+    icons, deleted, after = [], [], None
+    with database.SessionLocal() as db:
+        while True:
+            page, gone, after, until = catalog.changed_since(db, since, after, limit)
+            icons += [icon.id for icon in page]
+            deleted += gone
+            if after is None:
+                return icons, deleted, until
+
+
+def test_sync_reports_activity_deletions_and_waits_for_commits():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        edited, lit, removed, late = (Icon(title=title, image_url="u") for title in ("Edited", "Lit", "Removed", "Late"))
+        db.add_all([edited, lit, removed, late])
+        db.flush()
+        ids = edited.id, lit.id, removed.id, late.id
+        db.execute(update(Icon).where(Icon.id.in_(ids)).values(updated_at=at(0), activity_at=at(0)))
+        db.execute(update(Icon).where(Icon.id == edited.id).values(updated_at=at(10)))
+        # A candle moves only activity_at, but changes candle_count
+        db.execute(update(Icon).where(Icon.id == lit.id).values(activity_at=at(20), candle_count=1))
+        catalog.record_deletion(db, removed.id)
+        db.execute(update(icon_deletions).where(icon_deletions.c.icon_id == removed.id).values(deleted_at=at(30)))
+        db.delete(removed)
+        # Stamped by a write that hasn't been settled for COMMIT_LAG yet
+        db.execute(update(Icon).where(Icon.id == late.id).values(updated_at=datetime.now(timezone.utc)))
+        db.commit()
+
+    edited_id, lit_id, removed_id, _ = ids
+    icons, deleted, until = sync(limit=1)
+    assert icons == [edited_id, lit_id]
+    assert deleted == [removed_id]
+    assert until <= datetime.now(timezone.utc) - catalog.COMMIT_LAG
+
+    icons, deleted, _ = sync(since=at(15))
+    assert icons == [lit_id]
+    assert deleted == [removed_id]
+
+
+def test_unpublished_uploads_stay_out_of_metadata():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        uploader = User(username="syncuploader", display_name="Uploader", email="sync@example.com", hashed_pw="x", mod_rank=ModRank(name="Sync", description="Sync tests"))
+        ready, pending, failed = (Icon(title=status.title(), image_url="u", status=status, creator=uploader) for status in ("ready", "pending", "failed"))
+        db.add_all([ready, pending, failed])
+        db.commit()
+        ids = [ready.id, pending.id, failed.id]
+
+        assert [data["id"] for data in services.get_icons_metadata(db, ids)] == [ready.id]
+        assert services.get_icon_metadata(db, pending.id) is None
+        assert services.get_icon_metadata(db, failed.id) is None
@@ -0,0 +1,52 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+import database
+import index
+from http_cache import ICON_DELETED, touch_stamp
+from migrations import migrate
+from models import Icon, ModRank, User, icon_neighbors
+from page_cache import page_cache
+
+
+@pytest.fixture(scope="module")
+def icons():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        rank = ModRank(name="ETags", description="ETag tests")
+        uploader = User(username="etags", display_name="ETags", email="etags@example.com", hashed_pw="x", mod_rank=rank)
+        db.add_all([rank, uploader])
+        db.flush()
+        shown, neighbor = (Icon(title=title, image_url="/static/images/theotokos.jpg", user_id=uploader.id) for title in ("Shown", "Neighbor"))
+        db.add_all([shown, neighbor])
+        db.commit()
+        return shown.id, neighbor.id
+
+
+def etag(client, path: str) -> str:
+    page_cache.clear()
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def test_stamps_only_reach_the_pages_they_affect(icons):
+    shown, neighbor = icons
+    with TestClient(index.app) as client:
+        page, api, feed, other = (etag(client, path) for path in (f"/icon/{shown}", f"/api/icon/{shown}", "/api/feed", f"/icon/{neighbor}"))
+
+        # A deletion elsewhere changes listings, not icon pages
+        with database.SessionLocal() as db:
+            touch_stamp(db, ICON_DELETED)
+            db.commit()
+        assert etag(client, "/api/feed") != feed
+        assert etag(client, f"/icon/{shown}") == page
+        assert etag(client, f"/api/icon/{shown}") == api
+
+        # A new related icon changes that icon's page and metadata only
+        with database.SessionLocal() as db:
+            db.execute(insert(icon_neighbors).values(icon_id=shown, rank=0, neighbor_id=neighbor, score=0.5))
+            db.commit()
+        assert etag(client, f"/icon/{shown}") != page
+        assert etag(client, f"/api/icon/{shown}") != api
+        assert etag(client, f"/icon/{neighbor}") == other
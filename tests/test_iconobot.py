@@ -0,0 +1,22 @@
+import asyncio
+from io import BytesIO
+from PIL import Image
+import iconobot
+from config import MEDIA_DIR, MEDIA_URL
+from images import LocalStorage
+from ingest import PENDING_IMAGE_URL
+
+CARD = {"title": "Saint George", "saints": ["George"], "tradition": "Byzantine", "uploader": "Anna"}
+
+
+def test_cards_render_from_site_relative_image_urls():
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), (120, 40, 40)).save(buffer, "JPEG")
+    stored = LocalStorage(MEDIA_DIR, MEDIA_URL).save("icons/bot/card.jpeg", buffer.getvalue(), "image/jpeg")
+
+    # No HTTP session is opened: relative URLs never reach aiohttp
+    for url in (stored, PENDING_IMAGE_URL):
+        assert url.startswith("/")
+        image_bytes = asyncio.run(iconobot.fetch_image(url))
+        png = iconobot.render_card(CARD, image_bytes).getvalue()
+        assert png.startswith(b"\x89PNG")
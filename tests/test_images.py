@@ -0,0 +1,45 @@
+from io import BytesIO
+import pytest
+from PIL import Image
+from config import MEDIA_DIR, MEDIA_URL
+from images import FORMATS, CloudinaryStorage, LocalStorage, read_image, store_icon_image
+
+
+class RecordingUploader:
+    def __init__(self):
+        self.public_ids = []
+
+    def upload(self, data, public_id, **options):
+        self.public_ids.append(public_id)
+        return {"secure_url": f"https://res.cloudinary.com/test/image/upload/{public_id}"}
+
+
+def test_each_derivative_format_gets_its_own_cloudinary_object():
+    # Skip __init__, which imports and configures the Cloudinary SDK
+    storage = CloudinaryStorage.__new__(CloudinaryStorage)
+    storage.uploader = RecordingUploader()
+
+    buffer = BytesIO()
+    Image.new("RGB", (640, 480), (200, 160, 40)).save(buffer, "PNG")
+    original_url, derivatives = store_icon_image(buffer.getvalue(), storage)
+
+    public_ids = storage.uploader.public_ids
+    assert len(public_ids) == len(set(public_ids))
+    assert original_url.endswith("/original-png")
+    for entry in derivatives.values():
+        assert len({entry[fmt] for fmt in FORMATS}) == len(FORMATS)
+
+
+def test_read_image_reads_site_relative_urls_from_disk(tmp_path):
+    url = LocalStorage(MEDIA_DIR, MEDIA_URL).save("icons/abc/card.jpeg", b"jpeg bytes", "image/jpeg")
+    assert url.startswith("/")
+    assert read_image(url) == b"jpeg bytes"
+
+    path = tmp_path / "original.png"
+    path.write_bytes(b"png bytes")
+    assert read_image(path.as_uri()) == b"png bytes"
+
+    with pytest.raises(ValueError):
+        read_image(f"{MEDIA_URL}/../config.py")
+    with pytest.raises(ValueError):
+        read_image("/elsewhere/card.jpeg")
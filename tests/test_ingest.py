@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi.testclient import TestClient
+import database
+import index
+import ingest
+from migrations import migrate
+from models import Icon
+from routes import icons
+
+
+@pytest.fixture
+def icon_id():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        icon = Icon(title="Upload", image_url=ingest.PENDING_IMAGE_URL, status="pending", user_id=1)
+        db.add(icon)
+        db.commit()
+        return icon.id
+
+
+def status(icon_id: int) -> str:
+    with database.SessionLocal() as db:
+        return db.get(Icon, icon_id).status
+
+
+def test_only_one_process_claims_an_upload(icon_id):
+    with database.SessionLocal() as first, database.SessionLocal() as second:
+        assert ingest.claim_upload(first, icon_id)
+        assert not ingest.claim_upload(second, icon_id)
+    assert status(icon_id) == "processing"
+    assert icon_id not in ingest.claimable_icon_ids()
+
+
+def test_stale_claims_can_be_taken_over(icon_id):
+    with database.SessionLocal() as db:
+        assert ingest.claim_upload(db, icon_id)
+        db.get(Icon, icon_id).claimed_at = datetime.now(timezone.utc) - ingest.CLAIM_TIMEOUT * 2
+        db.commit()
+        assert icon_id in ingest.claimable_icon_ids()
+        assert ingest.claim_upload(db, icon_id)
+
+
+def test_failed_attempt_hands_the_upload_back(icon_id):
+    # No staged file: the attempt fails after claiming
+    with pytest.raises(FileNotFoundError):
+        ingest.process_upload(icon_id)
+    assert status(icon_id) == "pending"
+
+
+def test_mark_failed_leaves_finished_uploads_alone(icon_id):
+    with database.SessionLocal() as db:
+        db.get(Icon, icon_id).status = "ready"
+        db.commit()
+    ingest.mark_failed(icon_id, "gave up")
+    assert status(icon_id) == "ready"
+
+
+def test_attempts_are_counted_on_the_icon(icon_id):
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            ingest.process_upload(icon_id)
+    # A fresh process sees the attempts made by earlier ones
+    assert ingest.upload_attempts(icon_id) == 2
+
+
+def test_processing_errors_are_only_shown_to_the_uploader(icon_id):
+    ingest.mark_failed(icon_id, "storage bucket s3://internal refused the write")
+    with TestClient(index.app) as client:
+        body = client.get(f"/api/icon/{icon_id}/status").json()
+    assert body["status"] == "failed"
+    assert body["error"] == icons.UPLOAD_FAILED_MESSAGE
@@ -0,0 +1,53 @@
+import asyncio
+import pickle
+import threading
+from page_cache import MemoryBackend, PageCache, _dump_entry, _load_entry
+
+
+def test_entries_round_trip_as_json():
+    entry = {
+        "sequence": 7,
+        "stored_at": 1700000000.5,
+        "tags": ["all", "icon:3"],
+        "headers": {"content-type": "text/html; charset=utf-8", "etag": 'W/"abc"'},
+        "body": b"<html>\x00\xff</html>",
+    }
+    data = _dump_entry(entry)
+    assert data.startswith(b"{")
+    assert _load_entry(data) == entry
+
+
+def test_unreadable_entries_are_misses():
+    legacy = pickle.dumps({"sequence": 1, "stored_at": 0, "tags": (), "headers": {}, "body": b""})
+    assert _load_entry(legacy) is None
+    assert _load_entry(b'{"sequence": 1}') is None
+    assert _load_entry(b"[]") is None
+    assert _load_entry(b'{"body": "not base64!"}') is None
+
+
+class RecordingBackend(MemoryBackend):
+    blocking = True
+
+    def __init__(self):
+        super().__init__(1 << 20)
+        self.bumped = threading.Event()
+        self.threads = []
+
+    def bump(self, tags):
+        self.threads.append(threading.get_ident())
+        super().bump(tags)
+        self.bumped.set()
+
+
+def test_network_invalidations_leave_the_event_loop():
+    backend = RecordingBackend()
+    cache = PageCache(backend, ttl=60, stale=60)
+
+    async def invalidate_on_loop():
+        cache.invalidate("icon:1")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(invalidate_on_loop())
+    assert backend.bumped.wait(5)
+    assert backend.threads != [loop_thread]
+    assert backend.newest(["icon:1"]) == 1
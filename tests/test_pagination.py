@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import update
+import database
+from migrations import migrate
+from models import Comment, Icon
+from pagination import decode_cursor, encode_cursor
+from queries import comment_page
+from rankings import ranked_page
+
+
+def ranked_ids(db, ids, sort, before=None, limit=2):
+    query = db.query(Icon).filter(Icon.id.in_(ids))
+    icons, cursor = ranked_page(query, sort, before, limit)
+    return [icon.id for icon in icons], cursor
+
+
+def test_ranked_cursor_survives_score_changes_and_deleted_anchor():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        icons = [Icon(title=f"Ranked {n}", image_url="u", status="ready", candle_count=count) for n, count in enumerate((5, 4, 4, 2, 1))]
+        db.add_all(icons)
+        db.commit()
+        ids = [icon.id for icon in icons]
+
+        first, cursor = ranked_ids(db, ids, "venerated")
+        assert first == [ids[0], ids[2]]
+
+        # The last icon on the page gains candles and the next one is deleted;
+        # the second page still starts right after where the first one ended
+        db.execute(update(Icon).where(Icon.id == ids[2]).values(candle_count=9))
+        db.delete(db.get(Icon, ids[1]))
+        db.commit()
+        second, cursor = ranked_ids(db, ids, "venerated", cursor)
+        assert second == [ids[3], ids[4]]
+        assert cursor is None
+
+
+def test_comment_cursor_pages_through_equal_timestamps():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        icon = Icon(title="Discussed", image_url="u", status="ready")
+        db.add(icon)
+        db.flush()
+        # Inserted together, so they share a CURRENT_TIMESTAMP
+        comments = [Comment(icon_id=icon.id, text=str(n)) for n in range(5)]
+        db.add_all(comments)
+        db.commit()
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = comment_page(db, icon.id, cursor, 2)
+            seen += [comment.id for comment in page]
+            if cursor is None:
+                break
+        assert seen == sorted((comment.id for comment in comments), reverse=True)
+
+
+def test_malformed_cursor_is_rejected():
+    assert decode_cursor(encode_cursor(1.5, 7), float) == (1.5, 7)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", float)
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import pytest
+import database
+from migrations import migrate
+from reference import ReferenceData
+
+
+@pytest.fixture
+def reloads(monkeypatch):
+    migrate(database.engine)
+    data = ReferenceData(max_age=300)
+    count = {"reloads": 0}
+    build = data._build
+
+    def counting_build(db, version):
+        count["reloads"] += 1
+        return build(db, version)
+
+    monkeypatch.setattr(data, "_build", counting_build)
+    return data, count
+
+
+def test_unknown_ids_reload_at_most_once_per_interval(reloads):
+    data, count = reloads
+    data.refresh()
+    for _ in range(5):
+        assert data.tradition(10 ** 9) is None
+        assert data.tradition_name(10 ** 9) == "Unknown"
+        assert data.mod_rank("No such rank") is None
+    assert count["reloads"] == 1
+
+
+def test_misses_reload_once_the_interval_has_passed(reloads, monkeypatch):
+    data, count = reloads
+    data.refresh()
+    monkeypatch.setattr("reference.MISS_RELOAD_INTERVAL", 0)
+    data.tradition(10 ** 9)
+    assert count["reloads"] == 2
+
+
+def test_lookups_on_the_event_loop_reload_on_a_worker_thread(reloads):
+    data, count = reloads
+    data.refresh()
+    threads = []
+    build = data._build
+
+    def recording_build(db, version):
+        threads.append(threading.get_ident())
+        return build(db, version)
+
+    data._build = recording_build
+
+    async def lookups():
+        loop_thread = threading.get_ident()
+        stale = data._snapshot
+        data.max_age = 0
+        # The stale snapshot is served while the reload runs elsewhere
+        assert data.snapshot() is stale
+        assert data.tradition(10 ** 9) is None
+        while data._reloading:
+            await asyncio.sleep(0.01)
+        return loop_thread
+
+    loop_thread = asyncio.run(lookups())
+    assert threads and loop_thread not in threads
+    assert count["reloads"] == 2
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+from sqlalchemy import func, insert, select, update
+import database
+import related
+from migrations import migrate
+from models import ChangeStamp, Icon, ModRank, Saint, User, candles, icon_neighbors
+
+# Seeded icons are stamped long before the first run, while a bystander icon
+# stamped now moves the watermark past them, so the second run only counts
+# the icon changed in between (and icons stamped just now)
+SEEDED_AT = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+
+def neighbors(db, icon_id: int) -> list[int]:
+    return list(db.execute(
+        select(icon_neighbors.c.neighbor_id).where(icon_neighbors.c.icon_id == icon_id).order_by(icon_neighbors.c.rank)
+    ).scalars())
+
+
+def light(db, icon_id: int, users):
+    db.execute(insert(candles), [{"icon_id": icon_id, "user_id": user.id} for user in users])
+
+
+def test_refresh_related_full_then_incremental():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        rank = ModRank(name="Related", description="Related tests")
+        first, second = (User(username=name, display_name=name, email=f"{name}@example.com", hashed_pw="x", mod_rank=rank) for name in ("relatedone", "relatedtwo"))
+        saint = Saint(name="St Related", normalized_name="st related")
+        a, b, c, d, bystander = (Icon(title=title, image_url="u", status="ready") for title in ("A", "B", "C", "D", "Bystander"))
+        a.saints, b.saints = [saint], [saint]
+        db.add_all([first, second, a, b, c, d, bystander])
+        db.flush()
+        light(db, a.id, [first, second])
+        light(db, b.id, [first, second])
+        light(db, c.id, [first])
+        db.execute(update(Icon).where(Icon.id.in_([a.id, b.id, c.id, d.id])).values(updated_at=SEEDED_AT, activity_at=SEEDED_AT))
+        db.commit()
+
+        stats = related.refresh_related(db, full=True)
+        assert stats["changed"] == stats["icons"]
+        # A and B share both users and the saint; C shares one user with each
+        assert neighbors(db, a.id) == [b.id, c.id]
+        assert neighbors(db, b.id) == [a.id, c.id]
+        # Equal scores: lower id first
+        assert neighbors(db, c.id) == [a.id, b.id]
+        assert neighbors(db, d.id) == []
+
+        # Only D changes: both users light a candle for it
+        light(db, d.id, [first, second])
+        db.execute(update(Icon).where(Icon.id == d.id).values(activity_at=func.now()))
+        db.commit()
+        lit_at = db.get(Icon, d.id).activity_at
+
+        stats = related.refresh_related(db)
+        assert stats["changed"] < stats["icons"]
+        assert neighbors(db, d.id) == [c.id, a.id, b.id]
+        # D now scores high enough to enter A's list, although A didn't change
+        assert neighbors(db, a.id) == [b.id, d.id, c.id]
+        watermark = db.execute(select(ChangeStamp.changed_at).where(ChangeStamp.name == related.RELATED_ICONS)).scalar()
+        assert watermark >= lit_at
@@ -0,0 +1,46 @@
+import bcrypt
+import pytest
+from fastapi.testclient import TestClient
+import database
+import index
+from migrations import migrate
+from models import Comment, Icon, ModRank, User
+
+
+@pytest.fixture(scope="module")
+def site():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        rank = ModRank(name="Renames", description="Rename tests")
+        hashed = bcrypt.hashpw(b"pw", bcrypt.gensalt(4)).decode()
+        uploader, commenter = (
+            User(username=name, display_name=name.title(), email=f"{name}@example.com", hashed_pw=hashed, mod_rank=rank)
+            for name in ("renameuploader", "renamecommenter")
+        )
+        db.add_all([rank, uploader, commenter])
+        db.flush()
+        named, other = (Icon(title=title, image_url="/static/images/st_basil.jpg", user_id=uploader.id) for title in ("Named", "Other"))
+        db.add_all([named, other])
+        db.flush()
+        db.add(Comment(icon_id=named.id, user_id=commenter.id, text="A comment"))
+        db.commit()
+        return named.id, other.id
+
+
+def test_renaming_only_refreshes_pages_naming_the_user(site):
+    named, other = site
+    with TestClient(index.app) as anonymous, TestClient(index.app) as member:
+        before = {icon_id: anonymous.get(f"/icon/{icon_id}") for icon_id in site}
+        assert anonymous.get(f"/icon/{other}").headers["X-Cache"] == "HIT"
+
+        member.post("/login", data={"username": "renamecommenter", "password": "pw"})
+        assert member.post("/settings/edit/display_name", data={"new_display_name": "Renamed Commenter"}).status_code == 200
+
+        after = anonymous.get(f"/icon/{named}")
+        assert after.headers["X-Cache"] == "MISS"
+        assert "Renamed Commenter" in after.text
+        assert after.headers["ETag"] != before[named].headers["ETag"]
+
+        untouched = anonymous.get(f"/icon/{other}")
+        assert untouched.headers["X-Cache"] == "HIT"
+        assert untouched.headers["ETag"] == before[other].headers["ETag"]
@@ -0,0 +1,14 @@
+import database
+import saints
+from migrations import migrate
+
+
+def test_migrating_forgets_cached_saint_ids():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        [saint_id] = saints.resolve_saint_ids(db, ["St. Nicholas"])
+        db.commit()
+    assert saints._ids[saints.normalize_saint_name("St. Nicholas")] == saint_id
+
+    migrate(database.engine)
+    assert not saints._ids
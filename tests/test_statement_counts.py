@@ -0,0 +1,79 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import database
+import index
+import services
+from migrations import migrate
+from models import Comment, Icon, ModRank, Saint, Tradition, User, candles
+from page_cache import page_cache
+
+# The loader profiles in queries.py keep the icon views at a fixed number of
+# statements however many saints, comments and venerators an icon has.
+# Both counts cover a cold request: the page cache and metadata cache are
+# emptied first, and each includes its cache validator queries.
+
+ICON_DETAIL_STATEMENTS = 6
+ICON_API_STATEMENTS = 5
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+# An icon with saints, comments and venerators, and a bare one
+@pytest.fixture(scope="module")
+def icons():
+    migrate(database.engine)
+    with database.SessionLocal() as db:
+        rank = ModRank(name="Counted", description="Statement count tests")
+        tradition = Tradition(name="Counted tradition")
+        users = [User(username=f"counted{i}", display_name=f"Counted {i}", email=f"counted{i}@example.com", hashed_pw="x", mod_rank=rank) for i in range(5)]
+        saints = [Saint(name=f"Counted Saint {i}", normalized_name=f"counted saint {i}") for i in range(3)]
+        db.add_all([rank, tradition, *users, *saints])
+        db.flush()
+        busy, bare = (
+            Icon(title=title, image_url="/static/images/st_george.jpg", user_id=users[0].id, tradition_id=tradition.id, saints=saints)
+            for title in ("Busy", "Bare")
+        )
+        db.add_all([busy, bare])
+        db.flush()
+        db.execute(candles.insert(), [{"icon_id": busy.id, "user_id": user.id} for user in users[1:]])
+        db.add_all(Comment(icon_id=busy.id, user_id=users[i % 5].id, text=f"Reflection {i}") for i in range(8))
+        db.commit()
+        return busy.id, bare.id
+
+
+@pytest.fixture(scope="module")
+def client(icons):
+    with TestClient(index.app) as client:
+        yield client
+
+
+def count_statements(client, path: str):
+    page_cache.clear()
+    services._icon_metadata.clear()
+    services._related.clear()
+    counter = StatementCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(Engine, "before_cursor_execute", counter)
+    assert response.status_code == 200
+    return counter.count
+
+
+def test_icon_detail_statement_count(client, icons):
+    for icon_id in icons:
+        assert count_statements(client, f"/icon/{icon_id}") == ICON_DETAIL_STATEMENTS
+
+
+def test_icon_api_statement_count(client, icons):
+    for icon_id in icons:
+        assert count_statements(client, f"/api/icon/{icon_id}") == ICON_API_STATEMENTS